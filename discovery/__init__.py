@@ -0,0 +1 @@
+"""Pinned api discovery documents. A package so they are installed along with the modules."""
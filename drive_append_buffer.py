@@ -0,0 +1,389 @@
+"""
+Write-behind buffer for Sheets appends.
+
+Calling the Sheets api for every few rows runs out of write quota fast. An AppendBuffer collects the rows that any
+number of threads append to a spreadsheet range and sends them as one values.append call per range when the range
+has max_rows rows waiting, when its oldest row has waited flush_interval seconds, on flush() and on close():
+
+    buffer = drive_append_buffer.AppendBuffer(max_rows=1000, flush_interval=5, journal='appends.jsonl')
+    buffer.append(sheet_id, [['2020-01-01', 42]], range='Log!A1')
+    ...
+    buffer.close()
+
+Rows of a spreadsheet reach it in the order they were appended: one flush per spreadsheet runs at a time, and rows
+that could not be sent go back in front of the ones that came in meanwhile. With a journal, every appended row is
+written to a local file before append() returns and only dropped from it once Sheets has it, so rows still waiting
+when the process dies are sent by the next AppendBuffer opened on the same journal. Rows that were being sent at that
+moment may be appended twice.
+
+A range whose flush failed is tried again after a delay that doubles with every failure. Rows Sheets refuses for
+good (a 4xx answer other than a rate limit, e.g. for a missing spreadsheet or sheet) are parked: they stay out of the
+way of the other ranges until retry_parked() is called, and appending more rows to that range raises the error.
+
+"""
+from collections import deque
+from typing import Optional
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+try:
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_tools
+
+logger = logging.getLogger(__name__)
+
+# Rows sent per values.append request. Bigger flushes are split, Sheets rejects very large request bodies.
+ROWS_PER_REQUEST = 5000
+
+# Longest delay before a range whose flushes keep failing is tried again, in seconds.
+MAX_RETRY_DELAY = 300.0
+
+# Number of recent errors kept in AppendBuffer.errors.
+MAX_ERRORS = 100
+
+_default_buffer = None
+_default_lock = threading.Lock()
+
+
+class AppendBuffer:
+    """Coalesces Sheets appends by spreadsheet and range."""
+
+    def __init__(self,
+                 max_rows: int = 500,
+                 flush_interval: float = 5.0,
+                 max_pending_rows: int = 100000,
+                 value_input_option: str = 'USER_ENTERED',
+                 journal: Optional[str] = None,
+                 num_retries: int = 5,
+                 append_timeout: Optional[float] = 60.0):
+        """Start the buffer and its flusher thread.
+
+        :param max_rows: A range is flushed as soon as this many of its rows are waiting.
+        :type max_rows: int
+        :param flush_interval: A range is flushed when its oldest row has waited this many seconds.
+        :type flush_interval: float
+        :param max_pending_rows: append() blocks while this many rows are waiting, until a flush makes room.
+        :type max_pending_rows: int
+        :param append_timeout: Seconds append() waits for room before it raises TimeoutError, None waits for good.
+        :type append_timeout: float
+        :param value_input_option: "USER_ENTERED" parses values like the Sheets UI does, "RAW" stores them as is.
+        :type value_input_option: str
+        :param journal: File the waiting rows are kept in, so they survive the process. Rows left in it by an
+            earlier process are appended again.
+        :type journal: str
+        :param num_retries: How often a failed append request is retried.
+        :type num_retries: int
+        """
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_pending_rows = max_pending_rows
+        self.value_input_option = value_input_option
+        self.journal = journal
+        self.num_retries = num_retries
+        self.append_timeout = append_timeout
+        self.appends = 0
+        self.requests = 0
+        self.rows_sent = 0
+        self.failures = 0
+        # The most recent errors, oldest first.
+        self.errors = deque(maxlen=MAX_ERRORS)
+        # Rows Sheets refused for good and the error it refused them with, by (sheet_id, range).
+        self.parked = {}
+        self._parked_errors = {}
+
+        self._pending = {}
+        self._in_flight = {}
+        self._oldest = {}
+        self._retry_at = {}
+        self._retries = {}
+        self._count = 0
+        self._sheet_locks = {}
+        self._condition = threading.Condition()
+        self._closed = False
+        self._journal_file = None
+
+        if journal:
+            self._replay()
+
+        self._thread = threading.Thread(target=self._run, name='sheets-append-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, sheet_id: str, rows: list, range: str = 'A1'):
+        """
+        Queue rows to be appended after the table at range.
+
+        Args:
+            sheet_id (str): Spreadsheet id.
+            rows (list): Rows, each a list of cell values.
+            range (str): A1 range of the table, e.g. "Log!A1".
+
+        Raises:
+            HttpError: Earlier rows of the range were refused by Sheets and are parked, see retry_parked.
+            TimeoutError: The buffer stayed full for append_timeout seconds.
+
+        """
+        rows = [list(row) for row in rows]
+        if not rows:
+            return
+        key = (sheet_id, range)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The append buffer is closed")
+            if key in self._parked_errors:
+                raise self._parked_errors[key]
+            if not self._condition.wait_for(lambda: self._count < self.max_pending_rows, self.append_timeout):
+                raise TimeoutError(f"{self._count} rows have been waiting for {self.append_timeout} seconds")
+            if self._journal_file:
+                self._journal_file.write(json.dumps({'sheet_id': sheet_id, 'range': range, 'rows': rows}) + '\n')
+                self._journal_file.flush()
+            self._add(key, rows)
+            self.appends += 1
+            if len(self._pending[key]) >= self.max_rows:
+                self._condition.notify_all()
+
+    def pending(self) -> int:
+        """Number of rows waiting to be sent."""
+        with self._condition:
+            return self._count
+
+    def retry_parked(self, sheet_id: Optional[str] = None) -> int:
+        """
+        Queue the parked rows again, e.g. after the missing sheet was created.
+
+        Args:
+            sheet_id (str): Only retry the rows of this spreadsheet.
+
+        Returns:
+            int: Number of rows queued.
+
+        """
+        with self._condition:
+            keys = [key for key in self.parked if sheet_id is None or key[0] == sheet_id]
+            rows = 0
+            for key in keys:
+                parked = self.parked.pop(key)
+                del self._parked_errors[key]
+                self._add(key, parked, front=True)
+                rows += len(parked)
+            self._condition.notify_all()
+            return rows
+
+    def flush(self, sheet_id: Optional[str] = None):
+        """
+        Send the waiting rows now and wait until Sheets has them.
+
+        Args:
+            sheet_id (str): Only flush this spreadsheet.
+
+        Raises:
+            HttpError: A range could not be appended to. Its rows stay in the buffer, or are parked when Sheets
+                refused them for good.
+
+        """
+        with self._condition:
+            # Ranges being sent by the flusher thread are included, their _send waits for it to finish.
+            keys = [key for key in dict.fromkeys([*self._in_flight, *self._pending])
+                    if sheet_id is None or key[0] == sheet_id]
+        failure = None
+        for key in keys:
+            try:
+                self._send(key)
+            except Exception as error:
+                failure = failure or error
+        if failure is not None:
+            raise failure
+
+    def close(self):
+        """Stop taking rows, flush everything that is waiting and stop the flusher thread."""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        atexit.unregister(self.close)
+        self._thread.join()
+        try:
+            self.flush()
+        finally:
+            if self.parked:
+                logger.warning("%d rows Sheets refused are %s", sum(len(rows) for rows in self.parked.values()),
+                               f'left in {self.journal}' if self.journal else 'dropped')
+            if self._journal_file:
+                self._journal_file.close()
+                self._journal_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {'appends': self.appends, 'requests': self.requests, 'rows_sent': self.rows_sent,
+                    'pending': self._count, 'parked': sum(len(rows) for rows in self.parked.values()),
+                    'errors': self.failures}
+
+    def _add(self, key, rows, front=False):
+        # Called with the condition held.
+        pending = self._pending.setdefault(key, [])
+        if front:
+            pending[:0] = rows
+        else:
+            pending.extend(rows)
+        self._oldest.setdefault(key, time.monotonic())
+        self._count += len(rows)
+
+    def _send(self, key):
+        sheet_id, range = key
+        with self._condition:
+            lock = self._sheet_locks.setdefault(sheet_id, threading.Lock())
+
+        # Holding the spreadsheet's lock keeps a later flush of it from overtaking this one.
+        with lock:
+            with self._condition:
+                rows = self._pending.pop(key, [])
+                self._oldest.pop(key, None)
+                self._in_flight[key] = rows
+            sent = 0
+            refused = False
+            try:
+                values = drive_tools.sheets_service().spreadsheets().values()
+                while sent < len(rows):
+                    chunk = rows[sent:sent + ROWS_PER_REQUEST]
+                    values.append(spreadsheetId=sheet_id,
+                                  range=range,
+                                  valueInputOption=self.value_input_option,
+                                  insertDataOption='INSERT_ROWS',
+                                  body={'values': chunk}).execute(num_retries=self.num_retries)
+                    sent += len(chunk)
+                    with self._condition:
+                        self.requests += 1
+                        self.rows_sent += len(chunk)
+                with self._condition:
+                    self._retry_at.pop(key, None)
+                    self._retries.pop(key, None)
+            except Exception as error:
+                status = getattr(getattr(error, 'resp', None), 'status', 0)
+                refused = 400 <= status < 500 and not drive_tools._retryable(error)
+                with self._condition:
+                    self.failures += 1
+                    self.errors.append(error)
+                    if refused:
+                        self._parked_errors[key] = error
+                    else:
+                        retries = self._retries[key] = self._retries.get(key, 0) + 1
+                        delay = min(max(self.flush_interval, 1.0) * 2 ** (retries - 1), MAX_RETRY_DELAY)
+                        self._retry_at[key] = time.monotonic() + delay
+                raise
+            finally:
+                with self._condition:
+                    del self._in_flight[key]
+                    self._count -= len(rows)
+                    if sent < len(rows):
+                        if refused:
+                            # They would only be refused again, and hold up the range's later rows meanwhile.
+                            self.parked.setdefault(key, []).extend(rows[sent:])
+                            self._count -= len(self._pending.get(key, []))
+                            self.parked[key].extend(self._pending.pop(key, []))
+                            self._oldest.pop(key, None)
+                        else:
+                            # In front of the rows appended meanwhile, so the order is kept.
+                            self._add(key, rows[sent:], front=True)
+                    if sent or refused:
+                        self._rewrite_journal()
+                    self._condition.notify_all()
+
+    def _due(self) -> tuple:
+        # Called with the condition held. Returns the keys to flush now and the seconds until the next one is due.
+        now = time.monotonic()
+        due, wait_for = [], None
+        for key, rows in self._pending.items():
+            deadline = now if len(rows) >= self.max_rows else self._oldest[key] + self.flush_interval
+            # A range that failed waits out its retry delay, however many rows it has.
+            deadline = max(deadline, self._retry_at.get(key, deadline))
+            if deadline <= now or self._closed:
+                due.append(key)
+            else:
+                wait_for = min(wait_for or deadline - now, deadline - now)
+        return due, wait_for
+
+    def _run(self):
+        while True:
+            with self._condition:
+                due, wait_for = self._due()
+                if self._closed:
+                    return
+                if not due:
+                    self._condition.wait(wait_for)
+                    continue
+            for key in due:
+                try:
+                    self._send(key)
+                except Exception:
+                    with self._condition:
+                        parked = key in self._parked_errors
+                    if parked:
+                        logger.exception("Sheets refused the rows for %s %s, they are parked", *key)
+                    else:
+                        logger.exception("Appending to %s %s failed, the rows are tried again later", *key)
+
+    def _replay(self):
+        if os.path.exists(self.journal):
+            with open(self.journal) as journal:
+                for line in journal:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._add((entry['sheet_id'], entry['range']), entry['rows'])
+            if self._count:
+                logger.info("Appending %d rows left in %s", self._count, self.journal)
+        self._rewrite_journal()
+
+    def _rewrite_journal(self):
+        # Called with the condition held. Replaces the journal with the rows still waiting.
+        if not self.journal:
+            return
+        if self._journal_file:
+            self._journal_file.close()
+        temporary = f'{self.journal}.tmp'
+        with open(temporary, 'w') as journal:
+            for source in (self._in_flight, self._pending, self.parked):
+                for (sheet_id, range), rows in source.items():
+                    journal.write(json.dumps({'sheet_id': sheet_id, 'range': range, 'rows': rows}) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(temporary, self.journal)
+        self._journal_file = open(self.journal, 'a')
+
+
+def default_buffer() -> AppendBuffer:
+    """
+    The process wide AppendBuffer used by append_rows, created on first use and flushed when the process exits.
+
+    Returns:
+        AppendBuffer: The buffer.
+
+    """
+    global _default_buffer
+    with _default_lock:
+        if _default_buffer is None or _default_buffer._closed:
+            _default_buffer = AppendBuffer()
+        return _default_buffer
+
+
+def append_rows(sheet_id: str, rows: list, range: str = 'A1'):
+    """
+    Append rows to a sheet through the default buffer. Use it instead of a write_to_existing_sheet call per row.
+
+    Args:
+        sheet_id (str): Spreadsheet id.
+        rows (list): Rows, each a list of cell values.
+        range (str): A1 range of the table, e.g. "Log!A1".
+
+    """
+    default_buffer().append(sheet_id, rows, range)
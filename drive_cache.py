@@ -0,0 +1,234 @@
+"""
+Response cache for read-only Google Drive and Sheets api calls.
+
+"""
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlparse, parse_qsl
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def cache_key(method_id: str, uri: str, identity: Optional[str] = None) -> str:
+    """
+    Build a cache key out of an api method id, the query parameters of the request uri and the identity sending the
+    request. The parameters are sorted so two requests that only differ in parameter order share a key. Identities
+    see different files, so they never share a key.
+
+    Args:
+        method_id (str): Api method id, e.g. "drive.files.list".
+        uri (str): Full request uri.
+        identity (str): Name of the identity the request is sent as, None for the default credentials.
+
+    Returns:
+        str: Cache key. It starts with the method id, see ResponseCache.invalidate.
+
+    """
+    parsed = urlparse(uri)
+    params = sorted(parse_qsl(parsed.query, keep_blank_values=True))
+    return json.dumps([method_id, parsed.path, params, identity], separators=(',', ':'))
+
+
+def _method_id(key: str) -> str:
+    try:
+        return json.loads(key)[0]
+    except (ValueError, IndexError, KeyError, TypeError):
+        return ''
+
+
+class CacheEntry:
+    """A cached response body and the data needed to revalidate it.
+
+    The body is kept serialized and decoded on every access, so callers that change the response they got can not
+    change what later callers get from the cache.
+    """
+
+    __slots__ = ('data', 'etag', 'stored', 'size')
+
+    def __init__(self, body: object, etag: Optional[str] = None, stored: Optional[float] = None,
+                 size: Optional[int] = None):
+        self.data = json.dumps(body)
+        self.etag = etag
+        self.stored = time.time() if stored is None else stored
+        self.size = len(self.data) if size is None else size
+
+    @property
+    def body(self) -> object:
+        return json.loads(self.data)
+
+
+class ResponseCache:
+    """In memory TTL/LRU cache for api responses, optionally backed by a directory on disk.
+
+    Entries older than ``ttl`` seconds are stale. Stale entries that carry an ETag are kept around so the caller can
+    revalidate them with a conditional request instead of downloading the response again.
+    """
+
+    def __init__(self,
+                 ttl: float = 300,
+                 max_entries: int = 1024,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 directory: Optional[str] = None):
+        """Cache limits.
+
+        :param ttl: Seconds an entry is served without revalidation.
+        :type ttl: float
+        :param max_entries: Maximum number of entries kept in memory.
+        :type max_entries: int
+        :param max_bytes: Maximum size of the serialized response bodies kept in memory.
+        :type max_bytes: int
+        :param directory: If set, entries are also written to this directory so they survive between processes.
+        :type directory: str
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Files in directory by api method id, so invalidate does not have to open every one of them. The method id
+        # is part of the file name, the index is read again from the names when the directory changed.
+        self._files = {}
+        self._files_mtime = None
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """
+        Look up an entry. Stale entries are returned too, use ``is_fresh`` to decide if it needs revalidation.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            CacheEntry, None: The cached entry or None if nothing is cached for the key.
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None and self.directory:
+            entry = self._load(key)
+            if entry is not None:
+                self._store(key, entry)
+
+        return entry
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.stored < self.ttl
+
+    def set(self, key: str, body: object, etag: Optional[str] = None):
+        """
+        Store a response body.
+
+        Args:
+            key (str): Cache key.
+            body (object): Deserialized response body.
+            etag (str): ETag header of the response, if the api sent one.
+
+        """
+        entry = CacheEntry(body, etag)
+        if entry.size > self.max_bytes:
+            return
+        self._store(key, entry)
+        if self.directory:
+            self._dump(key, entry)
+
+    def touch(self, key: str):
+        """Mark an entry as fresh again after a successful revalidation."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.stored = time.time()
+        if entry is not None and self.directory:
+            self._dump(key, entry)
+
+    def invalidate(self, prefix: str = ''):
+        """
+        Drop every entry whose api method id starts with prefix, whatever identity it was cached for. With no prefix
+        the whole cache is emptied.
+
+        Args:
+            prefix (str): Api method id prefix, e.g. "drive." or "drive.files.".
+
+        """
+        match = f'["{prefix}'
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(match)]:
+                self._bytes -= self._entries.pop(key).size
+
+        if self.directory:
+            with self._lock:
+                self._index_files()
+                methods = [method for method in self._files if method.startswith(prefix)]
+                paths = [path for method in methods for path in self._files.pop(method)]
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _store(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+
+            # Evict least recently used entries until we are back under both caps.
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+
+    def _index_files(self):
+        # Called with the lock held.
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            os.makedirs(self.directory, exist_ok=True)
+            mtime = None
+        if mtime is not None and mtime == self._files_mtime:
+            return
+        self._files = {}
+        for file_name in os.listdir(self.directory):
+            method, _, rest = file_name.rpartition('.')[0].rpartition('.')
+            if file_name.endswith('.json') and rest:
+                self._files.setdefault(method, set()).add(os.path.join(self.directory, file_name))
+        self._files_mtime = mtime
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, f'{_method_id(key)}.{digest}.json')
+
+    def _dump(self, key, entry):
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as cached:
+            cached.write(f'{{"key":{json.dumps(key)},"etag":{json.dumps(entry.etag)},"stored":{entry.stored!r},'
+                         f'"body":{entry.data}}}')
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._files.setdefault(_method_id(key), set()).add(path)
+
+    def _load(self, key):
+        try:
+            with open(self._path(key)) as cached:
+                data = json.load(cached)
+        except (OSError, ValueError):
+            return None
+
+        entry = CacheEntry(data['body'], data['etag'], data['stored'])
+        if not self.is_fresh(entry) and not entry.etag:
+            return None
+        return entry
@@ -0,0 +1,429 @@
+"""
+Record and replay the http traffic of drive_tools.
+
+Recording captures every request/response pair with its timing into a gzipped JSON lines cassette, with credentials
+scrubbed. Replaying serves the recorded responses again, at the recorded speed, faster, or without any delay, so the
+request pattern of an operation can be profiled repeatably and offline:
+
+    with drive_cassettes.recording('build.cassette.gz'):
+        drive_tools.ProjectEnvironment('sheet', 'project', 'sub').build()
+
+    with drive_cassettes.replaying('build.cassette.gz', speed=10):
+        drive_tools.ProjectEnvironment('sheet', 'project', 'sub').build()
+
+    print(drive_cassettes.format_report(drive_cassettes.redundancy_report('build.cassette.gz')))
+
+Requests are attributed to the outermost drive_tools function (or ProjectEnvironment method) on the call stack, or
+to the label of an enclosing ``operation()`` block.
+
+"""
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from typing import Callable, Optional, Union
+from urllib.parse import urlparse, parse_qsl, urlencode
+import base64
+import gzip
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+try:
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_tools
+
+CASSETTE_VERSION = 1
+
+# Never written to a cassette.
+SECRET_HEADERS = ('authorization', 'cookie', 'set-cookie', 'x-goog-api-key')
+SECRET_PARAMS = ('access_token', 'key', 'token', 'oauth_token')
+SECRET_BODY_KEYS = ('access_token', 'refresh_token', 'id_token', 'client_secret', 'private_key', 'token')
+SCRUBBED = '<scrubbed>'
+
+# Request bodies bigger than this are stored as a digest only, uploads would blow up the cassette otherwise.
+MAX_REQUEST_BODY = 64 * 1024
+
+_BATCH_ID = re.compile(r'Content-ID: <([^ >]+) \+ ', re.I)
+_local = threading.local()
+
+
+class CassetteMismatch(Exception):
+    """A replayed request has no recorded response left."""
+
+
+@contextmanager
+def operation(name: str):
+    """
+    Attribute every request made inside the block to name instead of the calling drive_tools function.
+
+    Args:
+        name (str): Operation label, e.g. "nightly sync".
+
+    """
+    stack = _local.__dict__.setdefault('operations', [])
+    stack.append(name)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def current_operation() -> str:
+    """
+    The operation the current request belongs to.
+
+    Returns:
+        str: Label of the outermost operation() block, else the outermost drive_tools function on the stack.
+
+    """
+    stack = getattr(_local, 'operations', None)
+    if stack:
+        return stack[0]
+
+    found = '(none)'
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_globals.get('__name__') == drive_tools.__name__:
+            name = frame.f_code.co_name
+            owner = frame.f_locals.get('self')
+            if owner is not None:
+                name = f'{type(owner).__name__}.{name}'
+            if not name.startswith('_'):
+                found = name
+        frame = frame.f_back
+    return found
+
+
+def _normalize_uri(uri):
+    parsed = urlparse(uri)
+    params = sorted((key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+                    if key not in SECRET_PARAMS)
+    return parsed._replace(query=urlencode(params)).geturl()
+
+
+def _scrub_json(value):
+    if isinstance(value, dict):
+        return {key: SCRUBBED if key in SECRET_BODY_KEYS else _scrub_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_scrub_json(item) for item in value]
+    return value
+
+
+def _encode_body(body, limit=None):
+    if body is None:
+        return None
+    if hasattr(body, 'read'):
+        body = body.read()
+    if isinstance(body, str):
+        body = body.encode()
+    if limit is not None and len(body) > limit:
+        return {'sha256': hashlib.sha256(body).hexdigest(), 'length': len(body)}
+    try:
+        text = body.decode()
+    except UnicodeDecodeError:
+        return {'base64': base64.b64encode(body).decode()}
+    try:
+        return {'json': _scrub_json(json.loads(text))}
+    except ValueError:
+        return {'text': text}
+
+
+def _decode_body(encoded):
+    if encoded is None:
+        return b''
+    if 'json' in encoded:
+        return json.dumps(encoded['json']).encode()
+    if 'text' in encoded:
+        return encoded['text'].encode()
+    if 'base64' in encoded:
+        return base64.b64decode(encoded['base64'])
+    return b''
+
+
+def _body_key(encoded):
+    # JSON bodies take part in matching requests. Multipart and batch bodies contain random boundaries, so they don't.
+    if encoded and 'json' in encoded:
+        return json.dumps(encoded['json'], sort_keys=True)
+    return None
+
+
+def _batch_id(body):
+    if body is None:
+        return None
+    if isinstance(body, bytes):
+        body = body.decode(errors='replace')
+    match = _BATCH_ID.search(body)
+    return match.group(1) if match else None
+
+
+class Cassette:
+    """Recorded interactions and service builds."""
+
+    def __init__(self, events: Optional[list] = None):
+        self.events = events or []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, event: dict):
+        event['at'] = round(time.perf_counter() - self.started, 6)
+        with self._lock:
+            self.events.append(event)
+
+    @property
+    def interactions(self) -> list:
+        return [event for event in self.events if event['type'] == 'request']
+
+    def save(self, path: str):
+        """
+        Write the cassette as gzipped JSON lines.
+
+        Args:
+            path (str): Where to write it.
+
+        """
+        with gzip.open(path, 'wt') as cassette_file:
+            cassette_file.write(json.dumps({'type': 'header', 'version': CASSETTE_VERSION}) + '\n')
+            for event in self.events:
+                cassette_file.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+    @classmethod
+    def load(cls, path: str) -> 'Cassette':
+        """
+        Read a cassette written by save.
+
+        Args:
+            path (str): Cassette file.
+
+        Returns:
+            Cassette: The cassette.
+
+        """
+        with gzip.open(path, 'rt') as cassette_file:
+            events = [json.loads(line) for line in cassette_file if line.strip()]
+        if not events or events[0].get('version') != CASSETTE_VERSION:
+            raise ValueError(f'{path} is not a version {CASSETTE_VERSION} cassette')
+        return cls(events[1:])
+
+
+class RecordingHttp:
+    """httplib2.Http look-alike that records the traffic of the http object it wraps."""
+
+    def __init__(self, http: object, cassette: Cassette):
+        self.http = http
+        self.cassette = cassette
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        if hasattr(body, 'read'):
+            body = body.read()
+        headers = dict(headers or {})
+        started = time.perf_counter()
+        response, content = self.http.request(uri, method=method, body=body, headers=headers,
+                                              redirections=redirections, connection_type=connection_type)
+        elapsed = time.perf_counter() - started
+
+        self.cassette.add({'type': 'request',
+                           'operation': current_operation(),
+                           'method': method,
+                           'uri': _normalize_uri(uri),
+                           'request_headers': {key: value for key, value in headers.items()
+                                               if key.lower() not in SECRET_HEADERS},
+                           'request_body': _encode_body(body, MAX_REQUEST_BODY),
+                           'batch_id': _batch_id(body),
+                           'status': response.status,
+                           'response_headers': {key: value for key, value in response.items()
+                                                if key.lower() not in SECRET_HEADERS and key != 'status'},
+                           'response_body': _encode_body(content),
+                           'elapsed': round(elapsed, 6)})
+        return response, content
+
+
+class Replayer:
+    """Answers requests from a cassette. Pass its http method to drive_tools.set_transport.
+
+    Requests are matched on method, uri (secrets and parameter order ignored) and JSON body. Matching requests get
+    their recorded responses in recording order, whichever service or thread sends them.
+    """
+
+    def __init__(self, cassette: Cassette, speed: Optional[float] = None):
+        """Replay settings.
+
+        :param cassette: Cassette to replay.
+        :type cassette: Cassette
+        :param speed: 1 replays with the recorded latency, 10 ten times faster. None or 0 does not wait at all.
+        :type speed: float
+        """
+        self.speed = speed
+        self._queues = defaultdict(deque)
+        self._lock = threading.Lock()
+        for interaction in cassette.interactions:
+            key = (interaction['method'], interaction['uri'], _body_key(interaction['request_body']))
+            self._queues[key].append(interaction)
+
+    def http(self) -> 'ReplayHttp':
+        return ReplayHttp(self)
+
+    @property
+    def remaining(self) -> int:
+        """Number of recorded interactions that were not replayed yet."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def handle(self, uri, method, body):
+        import httplib2
+
+        if hasattr(body, 'read'):
+            body = body.read()
+        key = (method, _normalize_uri(uri), _body_key(_encode_body(body, MAX_REQUEST_BODY)))
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                raise CassetteMismatch(f'No recorded response left for {method} {key[1]}')
+            interaction = queue.popleft()
+
+        if self.speed:
+            time.sleep(interaction['elapsed'] / self.speed)
+
+        content = _decode_body(interaction['response_body'])
+        if interaction.get('batch_id'):
+            # Batch responses refer to the random Content-ID of the request they answer.
+            new_batch_id = _batch_id(body)
+            if new_batch_id:
+                content = content.replace(interaction['batch_id'].encode(), new_batch_id.encode())
+
+        response_headers = dict(interaction['response_headers'])
+        response_headers['status'] = str(interaction['status'])
+        return httplib2.Response(response_headers), content
+
+
+class ReplayHttp:
+    """httplib2.Http look-alike that hands every request to a Replayer."""
+
+    def __init__(self, replayer: Replayer):
+        self.replayer = replayer
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        return self.replayer.handle(uri, method, body)
+
+
+def _default_http():
+    import google_auth_httplib2
+    import httplib2
+
+    # Called while a service is built, so the current identity is the one the service sends as.
+    credentials = drive_tools._credentials(drive_tools.current_identity())
+    return google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+
+
+@contextmanager
+def recording(path: Optional[str] = None, http_factory: Optional[Callable[[], object]] = None):
+    """
+    Record the traffic of every drive_tools call made inside the block.
+
+    Args:
+        path (str): If set, the cassette is written here when the block exits.
+        http_factory (callable): Makes the http objects that really send the requests. Defaults to an authorized
+            httplib2.Http for the credentials of the identity the service is built for (see drive_tools.use_identity),
+            or the transport already set in drive_tools.
+
+    Yields:
+        Cassette: The cassette being recorded.
+
+    """
+    previous = drive_tools._transport
+    factory = http_factory or previous or _default_http
+    cassette = Cassette()
+
+    def transport():
+        cassette.add({'type': 'build', 'operation': current_operation()})
+        return RecordingHttp(factory(), cassette)
+
+    drive_tools.set_transport(transport)
+    try:
+        yield cassette
+    finally:
+        drive_tools.set_transport(previous)
+        if path:
+            cassette.save(path)
+
+
+@contextmanager
+def replaying(cassette: Union[str, Cassette], speed: Optional[float] = None):
+    """
+    Answer every drive_tools call made inside the block from a cassette.
+
+    Args:
+        cassette (str, Cassette): Cassette or the path of a cassette file.
+        speed (float): See Replayer.
+
+    Yields:
+        Replayer: The replayer, e.g. to check that every recorded response was used.
+
+    """
+    if isinstance(cassette, str):
+        cassette = Cassette.load(cassette)
+    previous = drive_tools._transport
+    replayer = Replayer(cassette, speed)
+
+    drive_tools.set_transport(replayer.http)
+    try:
+        yield replayer
+    finally:
+        drive_tools.set_transport(previous)
+
+
+def redundancy_report(cassette: Union[str, Cassette]) -> dict:
+    """
+    Summarize a cassette per operation and point out redundant traffic.
+
+    Args:
+        cassette (str, Cassette): Cassette or the path of a cassette file.
+
+    Returns:
+        dict: For every operation: number of requests, time spent waiting on them, service builds, and duplicates,
+            the GET requests that were sent more than once with the same method and uri.
+
+    """
+    if isinstance(cassette, str):
+        cassette = Cassette.load(cassette)
+
+    report = {}
+    for event in cassette.events:
+        stats = report.setdefault(event['operation'], {'requests': 0, 'seconds': 0.0, 'service_builds': 0,
+                                                       'requests_by_method': Counter(), '_gets': Counter()})
+        if event['type'] == 'build':
+            stats['service_builds'] += 1
+            continue
+        stats['requests'] += 1
+        stats['seconds'] += event['elapsed']
+        stats['requests_by_method'][event['method']] += 1
+        if event['method'] == 'GET':
+            stats['_gets'][event['uri']] += 1
+
+    for stats in report.values():
+        gets = stats.pop('_gets')
+        stats['requests_by_method'] = dict(stats['requests_by_method'])
+        stats['duplicates'] = sorted(((uri, count) for uri, count in gets.items() if count > 1),
+                                     key=lambda duplicate: -duplicate[1])
+        stats['redundant_requests'] = sum(count - 1 for _, count in stats['duplicates'])
+    return report
+
+
+def format_report(report: dict) -> str:
+    """
+    Render a redundancy_report as text.
+
+    Args:
+        report (dict): Output of redundancy_report.
+
+    Returns:
+        str: One block per operation, worst first.
+
+    """
+    lines = []
+    for name, stats in sorted(report.items(), key=lambda item: -item[1]['redundant_requests']):
+        lines.append(f"{name}: {stats['requests']} requests in {stats['seconds']:.3f}s, "
+                     f"{stats['redundant_requests']} redundant, {stats['service_builds']} service builds")
+        for uri, count in stats['duplicates']:
+            lines.append(f"    {count}x GET {uri}")
+    return '\n'.join(lines)
@@ -0,0 +1,495 @@
+"""
+drive-tools command line.
+
+Every command writes one JSON object per line to stdout as soon as it is known, a listing page by page as the pages
+arrive, so the output can be piped into jq, grep or another program without waiting for the whole result:
+
+    drive-tools ls /projects/2020 --fields id,name,size | jq -r .name
+    drive-tools tree root --jobs 8 > tree.jsonl
+    drive-tools sync ./exports /exports --jobs 4
+    drive-tools sheets-write SHEET_ID --range "Data!A2" < rows.csv
+
+Folders are given as an id, as "root" or as a path starting with "/". Failures are written as lines with an
+"error" key and make the exit status 1.
+
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, Optional
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import threading
+try:
+    import drive_cache
+    import drive_inventory
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_cache
+    from google_drive_tools import drive_inventory
+    from google_drive_tools import drive_tools
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Fields of each item in ls, find and tree output unless --fields says otherwise.
+DEFAULT_FIELDS = 'id,name,mimeType,parents,modifiedTime,size'
+
+# Rows sent per Sheets request by sheets-write.
+SHEET_ROWS_PER_REQUEST = 1000
+
+
+class Output:
+    """Writes JSON lines from any number of threads, flushing after every line."""
+
+    def __init__(self, stream=None):
+        """Where the lines go.
+
+        :param stream: Text stream, stdout by default.
+        """
+        self.stream = stream or sys.stdout
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+    def error(self, record: dict, error: Exception):
+        with self._lock:
+            self.errors += 1
+        self.write(dict(record, error=str(error)))
+
+
+class CommandError(Exception):
+    """A command can not run with the arguments it was given."""
+
+
+def _folder_id(value: Optional[str]) -> str:
+    if not value or value == 'root':
+        return 'root'
+    if value.startswith('/'):
+        folder_id = drive_tools.find_folder_by_path(value)
+        if not folder_id:
+            raise CommandError(f"No folder at {value}")
+        return folder_id
+    return value
+
+
+def _fields(args, *required: str) -> str:
+    fields = [field for field in args.fields.split(',') if field]
+    return ','.join(fields + [field for field in required if field not in fields])
+
+
+def _pages(args, query: str, fields: str, **list_arguments) -> Iterator[list]:
+    page_token = None
+    while True:
+        response = drive_tools.drive_service().files().list(q=query,
+                                                            fields=f"nextPageToken,files({fields})",
+                                                            pageSize=args.page_size,
+                                                            pageToken=page_token,
+                                                            **list_arguments).execute(num_retries=5)
+        yield response['files']
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def _run_all(args, out: Output, function, items: list, describe):
+    # Runs function on every item on args.jobs threads, writing each result line as soon as it is done.
+    with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        futures = {pool.submit(function, item): item for item in items}
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = futures.pop(future)
+                try:
+                    out.write(future.result())
+                except Exception as error:
+                    out.error(describe(item), error)
+
+
+def _list(args, out: Output, query: str, **list_arguments):
+    fields = _fields(args)
+    if args.jobs <= 1:
+        for page in _pages(args, query, fields, **list_arguments):
+            for item in page:
+                out.write(item)
+        return
+
+    items = drive_tools.list_files_in_parallel(query, partitions=args.jobs, jobs=args.jobs, fields=fields,
+                                               page_size=args.page_size, **list_arguments)
+    # The ranges are cut by modifiedTime, so it is listed whether it was asked for or not.
+    extra = fields != '*' and 'modifiedTime' not in fields.split(',')
+    for item in items:
+        if extra:
+            item.pop('modifiedTime', None)
+        out.write(item)
+
+
+def command_ls(args, out: Output):
+    query = f"'{_folder_id(args.folder)}' in parents and trashed = false"
+    if args.query:
+        query += f" and ({args.query})"
+    _list(args, out, query, supportsAllDrives=True, includeItemsFromAllDrives=True)
+
+
+def command_find(args, out: Output):
+    operator = 'contains' if args.contains else '='
+    query = f"name {operator} '{drive_tools._quote(args.name)}' and trashed = false"
+    if args.folder:
+        query += f" and '{_folder_id(args.folder)}' in parents"
+    scope = {'corpora': 'allDrives'} if args.all_drives else {}
+    _list(args, out, query, supportsAllDrives=True, includeItemsFromAllDrives=True, **scope)
+
+
+def command_tree(args, out: Output):
+    fields = _fields(args, 'id', 'name', 'mimeType')
+
+    def list_page(folder_id, page_token):
+        return drive_tools.drive_service().files().list(q=f"'{folder_id}' in parents and trashed = false",
+                                                        fields=f"nextPageToken,files({fields})",
+                                                        pageSize=args.page_size,
+                                                        pageToken=page_token,
+                                                        supportsAllDrives=True,
+                                                        includeItemsFromAllDrives=True).execute(num_retries=5)
+
+    # Every folder page is its own task, so big folders and deep trees are listed args.jobs pages at a time.
+    with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        folder_id = _folder_id(args.folder)
+        pending = {pool.submit(list_page, folder_id, None): (folder_id, '', 1)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                folder_id, path, depth = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as error:
+                    out.error({'id': folder_id, 'path': path or '/'}, error)
+                    continue
+                if response.get('nextPageToken'):
+                    pending[pool.submit(list_page, folder_id, response['nextPageToken'])] = (folder_id, path, depth)
+                for item in response['files']:
+                    item_path = f"{path}/{item['name']}"
+                    out.write(dict(item, path=item_path))
+                    if item['mimeType'] == FOLDER_MIME_TYPE and (args.depth is None or depth < args.depth):
+                        pending[pool.submit(list_page, item['id'], None)] = (item['id'], item_path, depth + 1)
+
+
+def command_upload(args, out: Output):
+    folder_id = _folder_id(args.folder)
+
+    def upload(path):
+        file_id = drive_tools.upload_csv_to_drive(os.path.dirname(path) or '.', os.path.basename(path),
+                                                  None if folder_id == 'root' else folder_id, mode=args.mode,
+                                                  compress=args.compress, convert_to_sheet=args.sheet)
+        return {'path': path, 'id': file_id}
+
+    _run_all(args, out, upload, args.paths, lambda path: {'path': path})
+
+
+def command_download(args, out: Output):
+    if args.output and len(args.file_ids) > 1 and not os.path.isdir(args.output):
+        raise CommandError("--output must be a directory when downloading several files")
+
+    def download(file_id):
+        path = args.output
+        if not path or os.path.isdir(path):
+            name = drive_tools.drive_service().files().get(fileId=file_id, fields='name',
+                                                           supportsAllDrives=True).execute(num_retries=5)['name']
+            path = os.path.join(path or '.', name.replace('/', '_'))
+        return {'id': file_id, 'path': path, 'bytes': drive_tools.download_file(file_id, path)}
+
+    _run_all(args, out, download, args.file_ids, lambda file_id: {'id': file_id})
+
+
+def _child_folder(parent_id: str, name: str) -> str:
+    folder = drive_tools.find_child_by_name(name, parent_id, FOLDER_MIME_TYPE)
+    if folder:
+        return folder['id']
+    return drive_tools.create_folder_in_drive(name, None if parent_id == 'root' else parent_id)
+
+
+def command_sync(args, out: Output):
+    if not os.path.isdir(args.directory):
+        raise CommandError(f"{args.directory} is not a directory")
+
+    # Folders are created one at a time, parents first, the files are uploaded args.jobs at a time.
+    folders = {'.': _folder_id(args.folder)}
+    uploads = []
+    for directory, names, files in os.walk(args.directory):
+        names.sort()
+        relative = os.path.relpath(directory, args.directory)
+        for name in names:
+            folders[os.path.normpath(os.path.join(relative, name))] = _child_folder(folders[relative], name)
+        uploads.extend((folders[relative], os.path.join(directory, name)) for name in sorted(files))
+
+    def upload(job):
+        folder_id, path = job
+        # Any kind of file, stored with the type its name suggests.
+        file_id = drive_tools.upload_file_to_drive(os.path.dirname(path), os.path.basename(path),
+                                                   None if folder_id == 'root' else folder_id, mode=args.mode)
+        return {'path': path, 'id': file_id}
+
+    _run_all(args, out, upload, uploads, lambda job: {'path': job[1]})
+
+
+def command_rm(args, out: Output):
+    targets = [{'folder_id': file_id} for file_id in args.file_ids]
+    if args.path:
+        targets.append({'path': args.path})
+    if args.query:
+        targets.append({'query': args.query})
+    if not targets:
+        raise CommandError("rm needs file ids, --path or --query")
+
+    for target in targets:
+        report = drive_tools.remove_items(**target, trash=args.trash, jobs=args.jobs)
+        if not report.planned:
+            out.error(target, 'Nothing found')
+        for file_id in report.removed:
+            out.write({'id': file_id, 'trashed' if args.trash else 'deleted': True})
+        for file_id, error in report.failed.items():
+            out.error({'id': file_id}, error)
+
+
+def _offset_range(a1_range: str, rows: int) -> str:
+    # Top left cell of a1_range, moved rows down. The range may be just a sheet name, e.g. "Sheet1".
+    sheet, separator, cells = a1_range.rpartition('!')
+    cell = re.fullmatch(r'([A-Za-z]{0,3})(\d*)(?::\w*)?', cells)
+    if not separator and not (cell and (cell.group(2) or ':' in cells)):
+        sheet, separator, cell = a1_range, '!', None
+    column, row = cell.groups() if cell else ('', '')
+    return f"{sheet}{separator}{column or 'A'}{int(row or 1) + rows}"
+
+
+def _rows(args) -> Iterator[list]:
+    source = open(args.input, newline='') if args.input else args.stdin or sys.stdin
+    try:
+        if args.format == 'jsonl':
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.reader(source)
+    finally:
+        if args.input:
+            source.close()
+
+
+def command_sheets_write(args, out: Output):
+    values = drive_tools.sheets_service().spreadsheets().values()
+
+    def send(batch, written):
+        if args.append:
+            response = values.append(spreadsheetId=args.sheet_id, range=args.range,
+                                     valueInputOption=args.value_input_option, insertDataOption='INSERT_ROWS',
+                                     body={'values': batch}).execute(num_retries=5)['updates']
+        else:
+            response = values.update(spreadsheetId=args.sheet_id, range=_offset_range(args.range, written),
+                                     valueInputOption=args.value_input_option,
+                                     body={'values': batch}).execute(num_retries=5)
+        out.write({'range': response.get('updatedRange'), 'rows': response.get('updatedRows', 0)})
+
+    # Rows are read and sent SHEET_ROWS_PER_REQUEST at a time, the input is never held in memory as a whole.
+    batch, written = [], 0
+    for row in _rows(args):
+        batch.append(row)
+        if len(batch) == SHEET_ROWS_PER_REQUEST:
+            send(batch, written)
+            batch, written = [], written + len(batch)
+    if batch:
+        send(batch, written)
+
+
+def command_inventory(args, out: Output):
+    def progress(report):
+        out.write({'rows': report.rows, 'rows_per_second': round(report.rows_per_second, 1),
+                   'shards': report.shards})
+
+    report = drive_inventory.export_inventory(args.path, shard_by=args.shard_by, query=args.query,
+                                              partitions=args.partitions, processes=args.jobs,
+                                              rows_per_chunk=args.rows_per_chunk, progress=progress)
+    out.write({'rows': report.rows, 'rows_per_second': round(report.rows_per_second, 1), 'files': report.files})
+    for label, error in report.failed.items():
+        out.error({'shard': label}, error)
+
+
+def command_daemon(args, out: Output):
+    try:
+        import drive_daemon
+    except ModuleNotFoundError:
+        from google_drive_tools import drive_daemon
+
+    cache = drive_cache.ResponseCache(ttl=args.cache_ttl, directory=args.cache)
+    daemon = drive_daemon.DriveDaemon(args.socket, workers=args.workers,
+                                      requests_per_second=args.requests_per_second, cache=cache)
+    with daemon:
+        out.write({'socket': args.socket, 'workers': args.workers})
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+def build_parser(parser_class: type = argparse.ArgumentParser) -> argparse.ArgumentParser:
+    """
+    Build the argument parser of the drive-tools command.
+
+    Args:
+        parser_class (type): ArgumentParser subclass to build it with.
+
+    Returns:
+        ArgumentParser: Parser, the command function is in the parsed arguments' "command".
+
+    """
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--fields', default=DEFAULT_FIELDS, help=f'item fields to output (default {DEFAULT_FIELDS})')
+    common.add_argument('--page-size', type=int, default=1000, help='items per listing page (default 1000)')
+    common.add_argument('--cache', metavar='DIRECTORY',
+                        help='cache read-only responses in this directory, shared by later runs')
+    common.add_argument('--cache-ttl', type=float, default=300, help='seconds a cached response is used (default 300)')
+    common.add_argument('--via', metavar='SOCKET', help='run the command on the drive-tools daemon at SOCKET')
+    common.add_argument('--priority', type=int, default=0, help='priority of the job on the daemon (default 0)')
+    common.add_argument('--client', help='name the daemon accounts the job to (default the user name)')
+
+    jobs = argparse.ArgumentParser(add_help=False)
+    jobs.add_argument('--jobs', type=int, default=4, help='requests in flight at once (default 4)')
+    cursors = argparse.ArgumentParser(add_help=False)
+    cursors.add_argument('--jobs', type=int, default=1,
+                         help='list this many modifiedTime ranges at once, the items come out when all are done '
+                              '(default 1, streams page by page)')
+
+    parser = parser_class(prog='drive-tools', description='Google Drive from the command line. '
+                                                                     'Output is one JSON object per line.')
+    commands = parser.add_subparsers(dest='command_name', metavar='COMMAND', required=True)
+
+    ls = commands.add_parser('ls', parents=[common, cursors], help='list the items in a folder')
+    ls.add_argument('folder', nargs='?', default='root', help='folder id or /path (default root)')
+    ls.add_argument('--query', help='extra files.list query, e.g. "mimeType = \'text/csv\'"')
+    ls.set_defaults(command=command_ls)
+
+    find = commands.add_parser('find', parents=[common, cursors], help='find items by name')
+    find.add_argument('name')
+    find.add_argument('--contains', action='store_true', help='match names containing NAME')
+    find.add_argument('--folder', help='only look in this folder')
+    find.add_argument('--all-drives', action='store_true', help='search shared drives too')
+    find.set_defaults(command=command_find)
+
+    tree = commands.add_parser('tree', parents=[common, jobs], help='list a folder and everything below it')
+    tree.add_argument('folder', nargs='?', default='root', help='folder id or /path (default root)')
+    tree.add_argument('--depth', type=int, help='levels to descend (default all)')
+    tree.set_defaults(command=command_tree)
+
+    upload = commands.add_parser('upload', parents=[common, jobs], help='upload local csv files')
+    upload.add_argument('paths', nargs='+', metavar='PATH')
+    upload.add_argument('--folder', default='root', help='folder id or /path (default root)')
+    upload.add_argument('--mode', default=drive_tools.UPLOAD_CREATE,
+                        choices=(drive_tools.UPLOAD_CREATE, drive_tools.UPLOAD_UPDATE,
+                                 drive_tools.UPLOAD_SKIP_IDENTICAL))
+    conversion = upload.add_mutually_exclusive_group()
+    conversion.add_argument('--compress', action='store_true', help='gzip while uploading')
+    conversion.add_argument('--sheet', action='store_true', help='convert to a Google Sheet')
+    upload.set_defaults(command=command_upload)
+
+    download = commands.add_parser('download', parents=[common, jobs], help='download files')
+    download.add_argument('file_ids', nargs='+', metavar='FILE_ID')
+    download.add_argument('--output', '-o', help='file, or directory to write into (default .)')
+    download.set_defaults(command=command_download)
+
+    sync = commands.add_parser('sync', parents=[common, jobs],
+                               help='upload a local directory tree to a folder, any kind of file')
+    sync.add_argument('directory')
+    sync.add_argument('folder', nargs='?', default='root', help='folder id or /path (default root)')
+    sync.add_argument('--mode', default=drive_tools.UPLOAD_SKIP_IDENTICAL,
+                      choices=(drive_tools.UPLOAD_CREATE, drive_tools.UPLOAD_UPDATE,
+                               drive_tools.UPLOAD_SKIP_IDENTICAL))
+    sync.set_defaults(command=command_sync)
+
+    rm = commands.add_parser('rm', parents=[common, jobs], help='delete items and everything below them')
+    rm.add_argument('file_ids', nargs='*', metavar='FILE_ID')
+    rm.add_argument('--path', help='folder /path to remove')
+    rm.add_argument('--query', help='remove everything matching this files.list query')
+    rm.add_argument('--trash', action='store_true', help='move to the trash instead of deleting')
+    rm.set_defaults(command=command_rm)
+
+    # Rows go out one request after the other, each starting where the last one ended, so there is no --jobs.
+    sheets_write = commands.add_parser('sheets-write', parents=[common], help='write rows from stdin to a sheet')
+    sheets_write.add_argument('sheet_id')
+    sheets_write.add_argument('--range', default='A1', help='top left cell, e.g. "Data!B2" (default A1)')
+    sheets_write.add_argument('--append', action='store_true', help='append after the table at --range')
+    sheets_write.add_argument('--input', help='read rows from this file instead of stdin')
+    sheets_write.add_argument('--format', choices=('csv', 'jsonl'), default='csv',
+                              help='csv rows, or one JSON array per line')
+    sheets_write.add_argument('--value-input-option', choices=('RAW', 'USER_ENTERED'), default='USER_ENTERED')
+    sheets_write.set_defaults(command=command_sheets_write, stdin=None)
+
+    inventory = commands.add_parser('inventory', parents=[common], help='export metadata of everything to a file')
+    inventory.add_argument('path', help='.parquet file or csv file name')
+    inventory.add_argument('--shard-by', choices=('drive', 'modified'), default='drive')
+    inventory.add_argument('--partitions', type=int, default=16)
+    inventory.add_argument('--jobs', '--processes', dest='jobs', type=int,
+                           help='worker processes (default one per CPU, at most one per shard)')
+    inventory.add_argument('--rows-per-chunk', type=int, default=drive_inventory.ROWS_PER_CHUNK)
+    inventory.add_argument('--query', help='files.list query restricting the inventory')
+    inventory.set_defaults(command=command_inventory)
+
+    daemon = commands.add_parser('daemon', parents=[common], help='run jobs sent with --via on warm workers')
+    daemon.add_argument('--socket', default=os.path.expanduser('~/.drive-tools.sock'))
+    daemon.add_argument('--workers', type=int, default=4, help='jobs run at once (default 4)')
+    daemon.add_argument('--requests-per-second', type=float, default=10,
+                        help='rate limit of all jobs together (default 10)')
+    daemon.set_defaults(command=command_daemon)
+
+    return parser
+
+
+def main(argv: Optional[list] = None) -> int:
+    """
+    Run the drive-tools command.
+
+    Args:
+        argv (list): Arguments without the program name. Defaults to sys.argv[1:].
+
+    Returns:
+        int: Exit status, 0 when everything worked, 1 when anything failed.
+
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.via and args.command_name != 'daemon':
+        try:
+            import drive_daemon
+        except ModuleNotFoundError:
+            from google_drive_tools import drive_daemon
+
+        rows = sys.stdin.read() if args.command_name == 'sheets-write' and not args.input else None
+        return drive_daemon.submit(sys.argv[1:] if argv is None else argv, args.via, priority=args.priority,
+                                   client=args.client, input=rows)
+    if args.cache and args.command_name != 'daemon':
+        drive_tools.set_response_cache(drive_cache.ResponseCache(ttl=args.cache_ttl, directory=args.cache))
+
+    out = Output()
+    try:
+        args.command(args, out)
+    except CommandError as error:
+        sys.stderr.write(f"drive-tools {args.command_name}: {error}\n")
+        return 1
+    except BrokenPipeError:
+        # The reader went away (e.g. piped into head), which is not a failure.
+        sys.stdout = open(os.devnull, 'w')
+        return 0
+    except Exception as error:
+        out.error({'command': args.command_name}, error)
+    finally:
+        if args.cache and args.command_name != 'daemon':
+            drive_tools.set_response_cache(None)
+
+    return 1 if out.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,465 @@
+"""
+Long running drive-tools daemon.
+
+Starting a script that uses drive_tools costs credential loading, building services and TLS handshakes before the
+first request goes out. The daemon pays that once and keeps it: credentials, services, the response cache, the name
+index (see drive_name_index) and the connections of its worker threads stay warm between jobs. Jobs are drive-tools
+commands sent over a Unix socket:
+
+    drive-tools daemon --socket ~/.drive-tools.sock --workers 4 &
+    drive-tools ls /exports --via ~/.drive-tools.sock --priority 5
+
+or from Python:
+
+    drive_daemon.submit(['upload', 'report.csv', '--folder', '/exports'], priority=5)
+
+A pool of workers runs the jobs. Higher priorities start first. Among equal priorities the client with the fewest
+running jobs and the least recent worker time goes next, so one busy cron job can not starve the others. Every
+request of every job goes through one identity and its rate limit, and while Drive is throttling it only jobs of
+priority THROTTLED_MIN_PRIORITY and above are started.
+
+The protocol is JSON lines. The client sends one request line, {"argv": [...], "priority": 0, "client": "name",
+"cwd": "/path", "input": "..."}, and gets the command's output lines back, followed by {"daemon": {"exit": 0, ...}}.
+{"stats": true} is answered with one {"daemon": {...}} line of queue and quota statistics.
+
+"""
+from typing import Optional
+import argparse
+import getpass
+import heapq
+import io
+import itertools
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+try:
+    import drive_cache
+    import drive_cli
+    import drive_identities
+    import drive_name_index
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_cache
+    from google_drive_tools import drive_cli
+    from google_drive_tools import drive_identities
+    from google_drive_tools import drive_name_index
+    from google_drive_tools import drive_tools
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = os.path.expanduser('~/.drive-tools.sock')
+
+# Commands the daemon runs. inventory forks worker processes and is better run on its own.
+DAEMON_COMMANDS = ('ls', 'find', 'tree', 'upload', 'download', 'sync', 'rm', 'sheets-write')
+
+# Arguments holding local paths. Relative ones are relative to the client's working directory, not the daemon's.
+PATH_ARGUMENTS = ('paths', 'directory', 'output', 'input')
+
+# Worker seconds a client used count half as much after this many seconds.
+USAGE_HALF_LIFE = 60.0
+
+# While Drive is throttling the daemon's identity, jobs below this priority wait.
+THROTTLED_MIN_PRIORITY = 1
+
+
+class Job:
+    """A command waiting for or running on a worker."""
+
+    def __init__(self, args: argparse.Namespace, out: 'ClientOutput', priority: int = 0, client: str = ''):
+        """Describe the job.
+
+        :param args: Parsed drive-tools arguments.
+        :type args: argparse.Namespace
+        :param out: Where the command's output lines go.
+        :type out: ClientOutput
+        :param priority: Higher priorities start first.
+        :type priority: int
+        :param client: Name the job's worker time is accounted to.
+        :type client: str
+        """
+        self.args = args
+        self.out = out
+        self.priority = priority
+        self.client = client
+        self.status = None
+        self.queued = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def summary(self) -> dict:
+        return {'exit': self.status, 'client': self.client, 'priority': self.priority,
+                'queued_seconds': round((self.started or self.queued) - self.queued, 3),
+                'run_seconds': round((self.finished or self.started or 0) - (self.started or 0), 3)}
+
+
+class Scheduler:
+    """Orders jobs by priority, then by how little of the workers each client has had lately."""
+
+    def __init__(self, identity: Optional[drive_identities.Identity] = None, half_life: float = USAGE_HALF_LIFE):
+        """Start an empty queue.
+
+        :param identity: Identity the jobs send as. Its throttling holds back low priority jobs.
+        :type identity: drive_identities.Identity
+        :param half_life: Seconds after which a client's past worker time counts half.
+        :type half_life: float
+        """
+        self.identity = identity
+        self.half_life = half_life
+        self.completed = 0
+        self._queues = {}
+        self._running = {}
+        self._usage = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def submit(self, job: Job):
+        with self._condition:
+            heapq.heappush(self._queues.setdefault(job.client, []), (-job.priority, next(self._sequence), job))
+            self._condition.notify()
+
+    def usage(self, client: str) -> float:
+        """Worker seconds used by client, decayed by half_life."""
+        value, stamp = self._usage.get(client, (0.0, time.monotonic()))
+        return value * 0.5 ** ((time.monotonic() - stamp) / self.half_life)
+
+    def next(self) -> Optional[Job]:
+        """
+        Wait for the next job to run.
+
+        Returns:
+            Job: The job, None once the scheduler is closed.
+
+        """
+        with self._condition:
+            while not self._closed:
+                client, wait_for = self._pick()
+                if client is not None:
+                    _, _, job = heapq.heappop(self._queues[client])
+                    self._running[client] = self._running.get(client, 0) + 1
+                    return job
+                self._condition.wait(wait_for)
+        return None
+
+    def _pick(self):
+        candidates = [(queue[0][0], client, queue[0][1]) for client, queue in self._queues.items() if queue]
+        if not candidates:
+            return None, None
+
+        cooldown = self.identity.cooldown_until - time.monotonic() if self.identity else 0
+        if cooldown > 0:
+            candidates = [candidate for candidate in candidates if -candidate[0] >= THROTTLED_MIN_PRIORITY]
+            if not candidates:
+                return None, cooldown
+
+        _, client, _ = min(candidates, key=lambda candidate: (candidate[0], self._running.get(candidate[1], 0),
+                                                              self.usage(candidate[1]), candidate[2]))
+        return client, None
+
+    def finished(self, job: Job, seconds: float):
+        """A job of the scheduler is done, after running for seconds."""
+        with self._condition:
+            self._running[job.client] -= 1
+            self._usage[job.client] = (self.usage(job.client) + seconds, time.monotonic())
+            self.completed += 1
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {'queued': sum(len(queue) for queue in self._queues.values()),
+                    'running': sum(self._running.values()),
+                    'completed': self.completed,
+                    'clients': {client: {'queued': len(self._queues.get(client, ())),
+                                         'running': self._running.get(client, 0),
+                                         'usage_seconds': round(self.usage(client), 3)}
+                                for client in set(self._queues) | set(self._running)}}
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class ClientGone(Exception):
+    """The client of a job closed its connection, its output can not be delivered."""
+
+
+class ClientOutput(drive_cli.Output):
+    """Output of a job, written back to the client's socket."""
+
+    def __init__(self, stream):
+        """Where the lines go.
+
+        :param stream: Text stream writing to the client's connection.
+        """
+        super().__init__(stream)
+        self.disconnected = False
+
+    def write(self, record: dict):
+        if self.disconnected:
+            raise ClientGone()
+        try:
+            super().write(record)
+        except (BrokenPipeError, ConnectionResetError) as error:
+            self.disconnected = True
+            raise ClientGone(str(error)) from error
+
+
+class _ArgumentParser(argparse.ArgumentParser):
+    # Usage errors and --help go back to the client instead of ending the daemon.
+
+    def error(self, message):
+        raise drive_cli.CommandError(f"{self.prog}: {message}")
+
+    def print_help(self, file=None):
+        raise drive_cli.CommandError(self.format_help())
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line.strip():
+            # A connection that only checks whether the daemon is up.
+            return
+
+        daemon = self.server.daemon
+        stream = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+        out = ClientOutput(stream)
+        try:
+            try:
+                request = json.loads(line)
+                if request.get('stats'):
+                    out.write({'daemon': daemon.stats()})
+                    return
+                job = daemon.job(request, out)
+            except (ValueError, drive_cli.CommandError) as error:
+                out.error({'daemon': {'exit': 2}}, error)
+                return
+            job.done.wait()
+            out.write({'daemon': job.summary()})
+        except (ClientGone, OSError):
+            # The client went away.
+            pass
+        finally:
+            stream.detach()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class DriveDaemon:
+    """Runs drive-tools jobs from a Unix socket on warm workers."""
+
+    def __init__(self,
+                 socket_path: str = DEFAULT_SOCKET,
+                 workers: int = 4,
+                 requests_per_second: float = drive_identities.DEFAULT_REQUESTS_PER_SECOND,
+                 cache: Optional[drive_cache.ResponseCache] = None,
+                 identity: Optional[drive_identities.Identity] = None):
+        """Configure the daemon, start() runs it.
+
+        :param socket_path: Path of the Unix socket. Only the user running the daemon can connect to it.
+        :type socket_path: str
+        :param workers: Jobs run at once.
+        :type workers: int
+        :param requests_per_second: Rate limit of all jobs together.
+        :type requests_per_second: float
+        :param cache: Response cache shared by the jobs. Defaults to an in memory cache.
+        :type cache: drive_cache.ResponseCache
+        :param identity: Identity every request is sent as. Defaults to the google_creds() user limited to
+            requests_per_second.
+        :type identity: drive_identities.Identity
+        """
+        self.socket_path = socket_path
+        self.workers = workers
+        self.identity = identity or drive_identities.Identity('daemon', None, requests_per_second)
+        self.cache = cache or drive_cache.ResponseCache()
+        self.name_index = drive_name_index.NameIndex()
+        self.scheduler = Scheduler(self.identity)
+        self._parser = drive_cli.build_parser(_ArgumentParser)
+        self._server = None
+        self._threads = []
+
+    def job(self, request: dict, out: ClientOutput) -> Job:
+        """
+        Parse a request and queue its job.
+
+        Args:
+            request (dict): Request line sent by the client.
+            out (ClientOutput): Where the job's output goes.
+
+        Returns:
+            Job: The queued job.
+
+        """
+        args = self._parser.parse_args(request['argv'])
+        if args.command_name not in DAEMON_COMMANDS:
+            raise drive_cli.CommandError(f"The daemon does not run {args.command_name}")
+
+        cwd = request.get('cwd') or os.getcwd()
+        for name in PATH_ARGUMENTS:
+            value = getattr(args, name, None)
+            if isinstance(value, str):
+                setattr(args, name, os.path.join(cwd, value))
+            elif isinstance(value, list):
+                setattr(args, name, [os.path.join(cwd, item) for item in value])
+        if args.command_name == 'sheets-write':
+            args.stdin = io.StringIO(request.get('input', ''))
+
+        job = Job(args, out, int(request.get('priority', 0)), str(request.get('client', '')))
+        self.scheduler.submit(job)
+        return job
+
+    def stats(self) -> dict:
+        stats = self.scheduler.stats()
+        stats['identity'] = {'requests': self.identity.requests, 'throttles': self.identity.throttles,
+                             'headroom': max(self.identity.headroom(), -1e9)}
+        stats['cache_entries'] = len(self.cache)
+        stats['name_index'] = self.name_index.stats()
+        return stats
+
+    def _work(self):
+        try:
+            drive_tools.drive_service()
+            drive_tools.sheets_service()
+        except Exception:
+            logger.exception("Could not build the services")
+
+        while True:
+            job = self.scheduler.next()
+            if job is None:
+                return
+            job.started = time.monotonic()
+            try:
+                job.args.command(job.args, job.out)
+            except Exception as error:
+                # Any failure of the command, a missing input file or a connection error after the retries included,
+                # goes back to the client. Only writing to the client itself tells that it went away.
+                try:
+                    if not job.out.disconnected:
+                        job.out.error({'command': job.args.command_name}, error)
+                except ClientGone:
+                    pass
+                if job.out.disconnected:
+                    logger.info("Job %s of %s lost its client", job.args.command_name, job.client)
+            job.finished = time.monotonic()
+            job.status = 1 if job.out.errors else 0
+            self.scheduler.finished(job, job.finished - job.started)
+            job.done.set()
+
+    def start(self) -> 'DriveDaemon':
+        """Bind the socket and start the workers. Returns the daemon."""
+        if os.path.exists(self.socket_path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(self.socket_path)
+                except OSError:
+                    os.unlink(self.socket_path)
+                else:
+                    raise RuntimeError(f"A daemon is already listening on {self.socket_path}")
+
+        drive_tools.set_response_cache(self.cache)
+        drive_tools.set_name_index(self.name_index)
+        drive_tools.set_default_identity(self.identity)
+
+        old_umask = os.umask(0o177)
+        try:
+            self._server = _Server(self.socket_path, _Handler)
+        finally:
+            os.umask(old_umask)
+        self._server.daemon = self
+
+        self._threads = [threading.Thread(target=self._server.serve_forever, name='drive-daemon-server', daemon=True)]
+        self._threads.extend(threading.Thread(target=self._work, name=f'drive-daemon-worker-{number}', daemon=True)
+                             for number in range(self.workers))
+        for thread in self._threads:
+            thread.start()
+        logger.info("Listening on %s with %d workers", self.socket_path, self.workers)
+        return self
+
+    def close(self):
+        """Stop taking jobs, let the running ones finish and remove the socket."""
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self.scheduler.close()
+        for thread in self._threads:
+            thread.join()
+        self._server.server_close()
+        self._server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        drive_tools.set_default_identity(None)
+        drive_tools.set_name_index(None)
+        drive_tools.set_response_cache(None)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _request(socket_path: str, request: dict, stream) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall((json.dumps(request) + '\n').encode())
+        with connection.makefile('r', encoding='utf-8') as lines:
+            for line in lines:
+                record = json.loads(line)
+                if 'daemon' in record:
+                    if 'error' in record:
+                        sys.stderr.write(f"{record['error']}\n")
+                    return record['daemon']
+                stream.write(line)
+                stream.flush()
+    raise ConnectionError(f"The daemon on {socket_path} closed the connection before the job finished")
+
+
+def submit(argv: list,
+           socket_path: str = DEFAULT_SOCKET,
+           priority: int = 0,
+           client: Optional[str] = None,
+           input: Optional[str] = None,
+           stream=None) -> int:
+    """
+    Run a drive-tools command on the daemon and copy its output lines to stream as they arrive.
+
+    Args:
+        argv (list): drive-tools arguments, e.g. ["ls", "/exports"].
+        socket_path (str): Socket of the daemon.
+        priority (int): Higher priorities start first.
+        client (str): Name the job is accounted to. Defaults to the user name.
+        input (str): Rows for sheets-write, instead of its stdin.
+        stream: Text stream the output goes to. Defaults to stdout.
+
+    Returns:
+        int: Exit status of the command, 2 when the daemon refused it.
+
+    """
+    request = {'argv': list(argv), 'priority': priority, 'client': client or getpass.getuser(), 'cwd': os.getcwd()}
+    if input is not None:
+        request['input'] = input
+    return _request(socket_path, request, stream or sys.stdout)['exit']
+
+
+def stats(socket_path: str = DEFAULT_SOCKET) -> dict:
+    """
+    Queue, client and quota statistics of a running daemon.
+
+    Args:
+        socket_path (str): Socket of the daemon.
+
+    Returns:
+        dict: queued, running, completed, clients, identity and cache_entries.
+
+    """
+    return _request(socket_path, {'stats': True}, sys.stdout)
@@ -0,0 +1,1079 @@
+"""
+In-process stand-in for the Google Drive v3 and Sheets v4 endpoints used by drive_tools.
+
+FakeDrive keeps files, shared drives and spreadsheets in memory and answers the http requests googleapiclient sends,
+so drive_tools can be exercised and benchmarked without a network or a Google account:
+
+    fake = FakeDrive()
+    drive_tools.set_transport(fake.http)
+
+It understands the parts of the api drive_tools relies on: the files.list query language, pagination, partial
+responses (fields), multipart and resumable uploads, media downloads, batch requests, permissions and the changes
+feed. Latency, errors and 429s can be injected to see how callers behave under load.
+
+Watch channels (changes.watch, files.watch) get their push notifications delivered the way Google sends them: a
+POST with the X-Goog-* headers to the channel's address, from a background thread.
+
+"""
+from email.parser import BytesParser
+from email.utils import formatdate
+from typing import Optional
+from urllib.parse import urlparse, parse_qsl, unquote
+import csv
+import datetime
+import hashlib
+import io
+import itertools
+import json
+import queue
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+SPREADSHEET_MIME_TYPE = 'application/vnd.google-apps.spreadsheet'
+PERMISSION_ROLES = ('owner', 'organizer', 'fileOrganizer', 'writer', 'commenter', 'reader')
+
+# Timestamps handed out by the fake start here and move forward one second per change, so they are unique and ordered.
+EPOCH = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class FakeApiError(Exception):
+    """Raised inside a handler to answer with an api error."""
+
+    def __init__(self, status: int, message: str, reason: str = 'badRequest'):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+def parse_time(value: str) -> datetime.datetime:
+    """Parse an RFC 3339 timestamp as used by the api. Timestamps without a timezone are UTC."""
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def format_time(value: datetime.datetime) -> str:
+    return value.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.') + \
+        f'{value.microsecond // 1000:03d}Z'
+
+
+# files.list query language ------------------------------------------------------------------------------------------
+
+_TOKEN = re.compile(r"\s*(?:(?P<string>'(?:[^'\\]|\\.)*')|(?P<op><=|>=|!=|=|<|>)|(?P<paren>[()])|"
+                    r"(?P<word>[A-Za-z_][A-Za-z0-9_.]*)|(?P<number>-?\d+(?:\.\d+)?))")
+
+_TIME_FIELDS = ('modifiedTime', 'createdTime', 'viewedByMeTime')
+
+
+def _tokenize(query):
+    tokens = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = _TOKEN.match(query, position)
+        if not match or match.end() == position:
+            raise FakeApiError(400, f'Invalid Value: {query}', 'invalid')
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class _QueryParser:
+    """Recursive descent parser turning a q string into a predicate over file dicts."""
+
+    def __init__(self, query):
+        self.tokens = _tokenize(query)
+        self.position = 0
+
+    def parse(self):
+        predicate = self._or()
+        if self.position != len(self.tokens):
+            raise FakeApiError(400, 'Invalid Value', 'invalid')
+        return predicate
+
+    def _peek(self, word=None):
+        if self.position >= len(self.tokens):
+            return None
+        kind, value = self.tokens[self.position]
+        if word is not None:
+            return kind == 'word' and value.lower() == word
+        return kind, value
+
+    def _next(self):
+        if self.position >= len(self.tokens):
+            raise FakeApiError(400, 'Invalid Value', 'invalid')
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def _or(self):
+        predicates = [self._and()]
+        while self._peek('or'):
+            self._next()
+            predicates.append(self._and())
+        if len(predicates) == 1:
+            return predicates[0]
+        return lambda item: any(predicate(item) for predicate in predicates)
+
+    def _and(self):
+        predicates = [self._not()]
+        while self._peek('and'):
+            self._next()
+            predicates.append(self._not())
+        if len(predicates) == 1:
+            return predicates[0]
+        return lambda item: all(predicate(item) for predicate in predicates)
+
+    def _not(self):
+        if self._peek('not'):
+            self._next()
+            predicate = self._not()
+            return lambda item: not predicate(item)
+        if self._peek() == ('paren', '('):
+            self._next()
+            predicate = self._or()
+            if self._next() != ('paren', ')'):
+                raise FakeApiError(400, 'Invalid Value', 'invalid')
+            return predicate
+        return self._comparison()
+
+    def _comparison(self):
+        kind, value = self._next()
+        if kind == 'string':
+            # 'value' in collection
+            if not self._peek('in'):
+                raise FakeApiError(400, 'Invalid Value', 'invalid')
+            self._next()
+            _, collection = self._next()
+            if collection == 'parents':
+                return lambda item: value in item.get('parents', ())
+            if collection in ('owners', 'writers', 'readers'):
+                return lambda item: True
+            raise FakeApiError(400, f'Invalid Value: {collection}', 'invalid')
+
+        field = value
+        kind, operator = self._next()
+        if kind == 'word' and operator.lower() == 'contains':
+            _, needle = self._next()
+            if field == 'fullText':
+                field = 'name'
+            return lambda item: needle.lower() in str(item.get(field, '')).lower()
+        if kind != 'op':
+            raise FakeApiError(400, 'Invalid Value', 'invalid')
+
+        kind, operand = self._next()
+        if kind == 'word':
+            operand = operand.lower() == 'true'
+        elif field in _TIME_FIELDS:
+            operand = parse_time(operand)
+
+        def compare(item):
+            current = item.get(field)
+            if field in _TIME_FIELDS:
+                current = parse_time(current) if current else None
+            elif isinstance(operand, bool):
+                current = bool(current)
+            if current is None:
+                return operator == '!='
+            return {'=': current == operand, '!=': current != operand, '<': current < operand,
+                    '<=': current <= operand, '>': current > operand, '>=': current >= operand}[operator]
+
+        return compare
+
+
+def compile_query(query: Optional[str]):
+    """
+    Compile a files.list q string into a predicate.
+
+    Args:
+        query (str): Query, e.g. "mimeType = 'application/vnd.google-apps.folder' and trashed = false".
+
+    Returns:
+        callable: Function taking a file dict and returning True if it matches.
+
+    """
+    if not query:
+        return lambda item: True
+    return _QueryParser(query).parse()
+
+
+# Partial responses -----------------------------------------------------------------------------------------------
+
+def _parse_fields(fields):
+    spec = {}
+    depth = 0
+    name = ''
+    sub = ''
+    for char in fields + ',':
+        if char == '(':
+            depth += 1
+            if depth == 1:
+                continue
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                continue
+        if depth:
+            sub += char
+        elif char == ',':
+            name = name.strip()
+            if name:
+                spec[name] = _parse_fields(sub) if sub else None
+            name, sub = '', ''
+        else:
+            name += char
+    return spec
+
+
+def project(resource: dict, fields: Optional[str]) -> dict:
+    """
+    Apply a partial response selector to a resource.
+
+    Args:
+        resource (dict): Full resource.
+        fields (str): Selector, e.g. "nextPageToken, files(id,name)". None or "*" keeps everything.
+
+    Returns:
+        dict: The selected fields.
+
+    """
+    if not fields or fields.strip() == '*':
+        return resource
+    return _project(resource, _parse_fields(fields))
+
+
+def _project(value, spec):
+    if spec is None or '*' in spec:
+        return value
+    if isinstance(value, list):
+        return [_project(item, spec) for item in value]
+    if not isinstance(value, dict):
+        return value
+    projected = {}
+    for name, sub in spec.items():
+        head, _, rest = name.partition('/')
+        if head in value:
+            projected[head] = _project(value[head], {rest: sub} if rest else sub)
+    return projected
+
+
+# Sheets ranges ---------------------------------------------------------------------------------------------------
+
+def _cell(reference):
+    match = re.match(r'([A-Za-z]*)(\d*)', reference)
+    letters, digits = match.groups()
+    column = 0
+    for letter in letters.upper():
+        column = column * 26 + ord(letter) - ord('A') + 1
+    return (int(digits) - 1 if digits else 0), (column - 1 if letters else 0)
+
+
+def _range_start(a1_range):
+    a1_range = unquote(a1_range)
+    sheet, _, cells = a1_range.rpartition('!')
+    if not sheet and not re.fullmatch(r'[A-Za-z]{0,3}\d*(:[A-Za-z]{0,3}\d*)?', cells):
+        # Just a sheet name.
+        sheet, cells = a1_range, 'A1'
+    return sheet.strip("'") or 'Sheet1', _cell(cells.split(':')[0])
+
+
+class FakeHttp:
+    """httplib2.Http look-alike that hands every request to a FakeDrive."""
+
+    def __init__(self, drive: 'FakeDrive'):
+        self.drive = drive
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        return self.drive.handle(uri, method, body, headers or {})
+
+
+class FakeDrive:
+    """In memory Drive v3 and Sheets v4 backend."""
+
+    def __init__(self,
+                 latency: float = 0.0,
+                 default_page_size: int = 100,
+                 error_rate: float = 0.0,
+                 requests_per_second: Optional[float] = None,
+                 seed: Optional[int] = None):
+        """Backend behaviour.
+
+        :param latency: Seconds every request takes.
+        :type latency: float
+        :param default_page_size: Page size of list calls that do not send pageSize.
+        :type default_page_size: int
+        :param error_rate: Share of requests answered with a 500 or 503.
+        :type error_rate: float
+        :param requests_per_second: If set, requests above this rate are answered with a 429.
+        :type requests_per_second: float
+        :param seed: Seed for the random numbers behind error_rate.
+        :type seed: int
+        """
+        self.latency = latency
+        self.default_page_size = default_page_size
+        self.error_rate = error_rate
+        self.requests_per_second = requests_per_second
+        self.files = {}
+        self.content = {}
+        self.drives = {}
+        self.sheets = {}
+        self.permissions = {}
+        self.notifications = []
+        self.changes = []
+        self.channels = {}
+        self.deliveries = []
+        self.requests = []
+        self._uploads = {}
+        self._permission_ids = {}
+        self._resource_ids = {}
+        self._outbox = queue.Queue()
+        self._sender = None
+        self._failures = []
+        self._ids = itertools.count(1)
+        self._clock = itertools.count(1)
+        self._random = random.Random(seed)
+        self._tokens = requests_per_second or 0
+        self._refilled = time.monotonic()
+        self._version = 0
+        self._list_cache = {}
+        self._lock = threading.RLock()
+        self.root_id = self._new_id('root')
+        self.user_email = 'me@example.com'
+
+    def http(self) -> FakeHttp:
+        """
+        An http object talking to this fake. Pass the bound method to drive_tools.set_transport.
+
+        Returns:
+            FakeHttp: Http object.
+
+        """
+        return FakeHttp(self)
+
+    # Seeding ---------------------------------------------------------------------------------------------------
+
+    def add_file(self, name: str, parent: Optional[str] = None, mime_type: str = 'text/plain',
+                 content: bytes = b'', drive_id: Optional[str] = None, **fields) -> dict:
+        """
+        Add a file without going through the api.
+
+        Args:
+            name (str): File name.
+            parent (str): Parent folder id. Defaults to My Drive's root, or the shared drive if drive_id is set.
+            mime_type (str): mimeType of the file.
+            content (bytes): File content.
+            drive_id (str): Shared drive the file lives in.
+            **fields: Any other api fields, e.g. modifiedTime.
+
+        Returns:
+            dict: The new file.
+
+        """
+        with self._lock:
+            item = {'name': name, 'mimeType': mime_type, 'parents': [parent or drive_id or self.root_id]}
+            if drive_id:
+                item['driveId'] = drive_id
+            item.update(fields)
+            return self._insert(item, content if mime_type != FOLDER_MIME_TYPE else None)
+
+    def add_folder(self, name: str, parent: Optional[str] = None, drive_id: Optional[str] = None, **fields) -> dict:
+        """Add a folder without going through the api. See add_file."""
+        return self.add_file(name, parent, FOLDER_MIME_TYPE, drive_id=drive_id, **fields)
+
+    def add_drive(self, name: str) -> dict:
+        """
+        Add a shared drive.
+
+        Args:
+            name (str): Shared drive name.
+
+        Returns:
+            dict: The new shared drive.
+
+        """
+        with self._lock:
+            drive = {'kind': 'drive#drive', 'id': self._new_id('drive'), 'name': name,
+                     'createdTime': self._now(), 'hidden': False}
+            self.drives[drive['id']] = drive
+            self._changed()
+            return drive
+
+    def fail_next(self, count: int = 1, status: int = 429, method: Optional[str] = None, path: str = ''):
+        """
+        Answer the next count matching requests with an error.
+
+        Args:
+            count (int): Number of requests to fail.
+            status (int): Http status to answer with.
+            method (str): Only fail requests with this http method.
+            path (str): Only fail requests whose path contains this string.
+
+        """
+        with self._lock:
+            for _ in range(count):
+                self._failures.append((status, method, path))
+
+    # Request dispatch ------------------------------------------------------------------------------------------
+
+    def handle(self, uri: str, method: str, body, headers: dict) -> tuple:
+        """
+        Answer one http request.
+
+        Returns:
+            tuple: (httplib2.Response, bytes) like httplib2.Http.request.
+
+        """
+        import httplib2
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        parsed = urlparse(uri)
+        params = dict(parse_qsl(parsed.query, keep_blank_values=True))
+        headers = {key.lower(): value for key, value in headers.items()}
+        if hasattr(body, 'read'):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode()
+
+        with self._lock:
+            self.requests.append((method, parsed.path))
+            error = self._injected_error(method, parsed.path)
+
+        if error:
+            status, reason = error
+            response_headers, content = self._error_body(status, 'Injected error', reason)
+        else:
+            try:
+                status, response_headers, content = self._route(method, parsed.path, params, body, headers)
+            except FakeApiError as api_error:
+                status = api_error.status
+                response_headers, content = self._error_body(status, str(api_error), api_error.reason)
+
+        response_headers['status'] = str(status)
+        response_headers.setdefault('content-type', 'application/json; charset=UTF-8')
+        if isinstance(content, (dict, list)):
+            content = json.dumps(content).encode()
+        return httplib2.Response(response_headers), content
+
+    def _injected_error(self, method, path):
+        for index, (status, failure_method, failure_path) in enumerate(self._failures):
+            if (failure_method is None or failure_method == method) and failure_path in path:
+                del self._failures[index]
+                return status, 'rateLimitExceeded' if status == 429 else 'backendError'
+
+        if self.requests_per_second:
+            now = time.monotonic()
+            self._tokens = min(self.requests_per_second,
+                               self._tokens + (now - self._refilled) * self.requests_per_second)
+            self._refilled = now
+            if self._tokens < 1:
+                return 429, 'rateLimitExceeded'
+            self._tokens -= 1
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            return self._random.choice((500, 503)), 'backendError'
+        return None
+
+    @staticmethod
+    def _error_body(status, message, reason):
+        return {}, {'error': {'code': status, 'message': message,
+                              'errors': [{'domain': 'global', 'reason': reason, 'message': message}]}}
+
+    _ROUTES = (
+        ('POST', r'/batch/drive/v3', '_batch'),
+        ('POST', r'/upload/drive/v3/files', '_upload_create'),
+        ('PATCH', r'/upload/drive/v3/files/(?P<file_id>[^/]+)', '_upload_update'),
+        ('PUT', r'/upload/session/(?P<session>[^/]+)', '_upload_chunk'),
+        ('GET', r'/drive/v3/files', '_files_list'),
+        ('POST', r'/drive/v3/files', '_files_create'),
+        ('DELETE', r'/drive/v3/files/trash', '_files_empty_trash'),
+        ('GET', r'/drive/v3/files/(?P<file_id>[^/]+)', '_files_get'),
+        ('PATCH', r'/drive/v3/files/(?P<file_id>[^/]+)', '_files_update'),
+        ('DELETE', r'/drive/v3/files/(?P<file_id>[^/]+)', '_files_delete'),
+        ('GET', r'/drive/v3/files/(?P<file_id>[^/]+)/permissions', '_permissions_list'),
+        ('POST', r'/drive/v3/files/(?P<file_id>[^/]+)/permissions', '_permissions_create'),
+        ('GET', r'/drive/v3/files/(?P<file_id>[^/]+)/permissions/(?P<permission_id>[^/]+)', '_permissions_get'),
+        ('PATCH', r'/drive/v3/files/(?P<file_id>[^/]+)/permissions/(?P<permission_id>[^/]+)', '_permissions_update'),
+        ('DELETE', r'/drive/v3/files/(?P<file_id>[^/]+)/permissions/(?P<permission_id>[^/]+)', '_permissions_delete'),
+        ('GET', r'/drive/v3/drives', '_drives_list'),
+        ('GET', r'/drive/v3/drives/(?P<drive_id>[^/]+)', '_drives_get'),
+        ('GET', r'/drive/v3/changes/startPageToken', '_changes_start_page_token'),
+        ('GET', r'/drive/v3/changes', '_changes_list'),
+        ('POST', r'/drive/v3/changes/watch', '_changes_watch'),
+        ('POST', r'/drive/v3/files/(?P<file_id>[^/]+)/watch', '_files_watch'),
+        ('POST', r'/drive/v3/channels/stop', '_channels_stop'),
+        ('POST', r'/v4/spreadsheets', '_sheets_create'),
+        ('GET', r'/v4/spreadsheets/(?P<sheet_id>[^/]+)/values/(?P<range>[^/:]+)', '_values_get'),
+        ('PUT', r'/v4/spreadsheets/(?P<sheet_id>[^/]+)/values/(?P<range>[^/:]+)', '_values_update'),
+        ('POST', r'/v4/spreadsheets/(?P<sheet_id>[^/]+)/values/(?P<range>[^/:]+):append', '_values_append'),
+        ('POST', r'/v4/spreadsheets/(?P<sheet_id>[^/]+)/values:batchUpdate', '_values_batch_update'),
+    )
+
+    def _route(self, method, path, params, body, headers):
+        if headers.get('x-http-method-override'):
+            # googleapiclient turns GETs with very long urls into POSTs carrying the query in the body.
+            method = headers['x-http-method-override']
+            params.update(parse_qsl(body.decode()))
+            body = None
+
+        for route_method, pattern, handler in self._ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                result = getattr(self, handler)(params=params, body=body, headers=headers, **match.groupdict())
+                if len(result) == 2:
+                    return result[0], {}, result[1]
+                return result
+        raise FakeApiError(404, f'Not Found: {method} {path}', 'notFound')
+
+    # Helpers ---------------------------------------------------------------------------------------------------
+
+    def _new_id(self, prefix='file'):
+        return f'{prefix}{next(self._ids):06d}'
+
+    def _now(self):
+        return format_time(EPOCH + datetime.timedelta(seconds=next(self._clock)))
+
+    def _changed(self, file_id=None, removed=False):
+        self._version += 1
+        self._list_cache.clear()
+        if file_id:
+            item = self.files.get(file_id)
+            self.changes.append({'kind': 'drive#change', 'changeType': 'file', 'fileId': file_id,
+                                 'removed': removed, 'time': self._now(),
+                                 'file': None if removed else dict(item)})
+            if self.channels:
+                self._notify_change(file_id, item, removed)
+
+    def _insert(self, metadata, content=None):
+        now = self._now()
+        item = {'kind': 'drive#file', 'id': self._new_id(), 'trashed': False,
+                'createdTime': now, 'modifiedTime': now}
+        item.update(metadata)
+        item.setdefault('mimeType', 'application/octet-stream')
+        item.setdefault('parents', [self.root_id])
+        item.setdefault('owners', [{'emailAddress': self.user_email}])
+        if item['parents']:
+            parent = self.files.get(item['parents'][0])
+            if parent and parent.get('driveId'):
+                item['driveId'] = parent['driveId']
+            elif item['parents'][0] in self.drives:
+                item['driveId'] = item['parents'][0]
+        self.files[item['id']] = item
+        if item['mimeType'] == SPREADSHEET_MIME_TYPE:
+            self.sheets[item['id']] = {}
+        if content is not None:
+            self._set_content(item, content)
+        self._changed(item['id'])
+        return item
+
+    def _set_content(self, item, content):
+        if item['mimeType'] == SPREADSHEET_MIME_TYPE:
+            # Uploaded csv is converted, like Drive does when the metadata asks for a spreadsheet.
+            rows = list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+            self.sheets[item['id']] = {'Sheet1': rows}
+            return
+        self.content[item['id']] = content
+        item['size'] = str(len(content))
+        item['md5Checksum'] = hashlib.md5(content).hexdigest()
+
+    def _file(self, file_id):
+        if file_id == 'root':
+            file_id = self.root_id
+        item = self.files.get(file_id)
+        if item is None:
+            raise FakeApiError(404, f'File not found: {file_id}.', 'notFound')
+        return item
+
+    def _descendants(self, file_id):
+        children = [item['id'] for item in self.files.values() if file_id in item.get('parents', ())]
+        found = list(children)
+        for child in children:
+            found.extend(self._descendants(child))
+        return found
+
+    @staticmethod
+    def _json(body):
+        return json.loads(body) if body else {}
+
+    @staticmethod
+    def _multipart(body, headers):
+        message = BytesParser().parsebytes(b'Content-Type: ' + headers['content-type'].encode() + b'\r\n\r\n' + body)
+        parts = message.get_payload()
+        metadata = json.loads(parts[0].get_payload(decode=True) or b'{}')
+        if len(parts) > 1:
+            metadata.setdefault('mimeType', parts[1].get_content_type())
+        content = parts[1].get_payload(decode=True) if len(parts) > 1 else b''
+        return metadata, content
+
+    def _page(self, items, params, key):
+        page_size = min(int(params.get('pageSize') or self.default_page_size), 1000)
+        offset = int(params.get('pageToken') or 0)
+        page = items[offset:offset + page_size]
+        response = {'kind': f'drive#{key[:-1]}List', key: page}
+        if offset + page_size < len(items):
+            response['nextPageToken'] = str(offset + page_size)
+        return response
+
+    # Drive files -----------------------------------------------------------------------------------------------
+
+    def _matching_files(self, params):
+        cache_key = (params.get('q'), params.get('orderBy'), params.get('corpora'), params.get('driveId'),
+                     params.get('includeItemsFromAllDrives'), params.get('spaces'))
+        items = self._list_cache.get(cache_key)
+        if items is not None:
+            return items
+
+        query = params.get('q')
+        if query:
+            # "root" is an alias for the id of My Drive's root folder.
+            query = query.replace("'root' in parents", f"'{self.root_id}' in parents")
+        predicate = compile_query(query)
+        all_drives = params.get('includeItemsFromAllDrives') == 'true'
+        drive_id = params.get('driveId')
+        items = [item for item in self.files.values()
+                 if (item.get('driveId') == drive_id if drive_id else (all_drives or not item.get('driveId')))
+                 and predicate(item)]
+
+        for order in reversed((params.get('orderBy') or '').split(',')):
+            field, _, direction = order.strip().partition(' ')
+            if not field:
+                continue
+            if field == 'folder':
+                key = (lambda item: item['mimeType'] != FOLDER_MIME_TYPE)
+            else:
+                key = (lambda item, field=field: item.get(field) or '')
+            items.sort(key=key, reverse=direction.strip() == 'desc')
+
+        self._list_cache[cache_key] = items
+        return items
+
+    def _files_list(self, params, body, headers):
+        with self._lock:
+            response = self._page(self._matching_files(params), params, 'files')
+        return 200, project(response, params.get('fields'))
+
+    def _files_get(self, params, body, headers, file_id):
+        with self._lock:
+            item = self._file(file_id)
+            if params.get('alt') == 'media':
+                content = self.content.get(item['id'], b'')
+                match = re.match(r'bytes=(\d+)-(\d*)', headers.get('range', ''))
+                start = int(match.group(1)) if match else 0
+                end = min(int(match.group(2)) if match and match.group(2) else len(content) - 1, len(content) - 1)
+                response_headers = {'content-type': item['mimeType'],
+                                    'content-range': f'bytes {start}-{max(end, start)}/{len(content)}',
+                                    'content-length': str(max(end - start + 1, 0))}
+                return 206 if match else 200, response_headers, content[start:end + 1]
+            return 200, project(dict(item), params.get('fields'))
+
+    def _files_create(self, params, body, headers):
+        with self._lock:
+            item = self._insert(self._json(body))
+            return 200, project(dict(item), params.get('fields'))
+
+    def _files_update(self, params, body, headers, file_id, content=None):
+        with self._lock:
+            item = self._file(file_id)
+            metadata = self._json(body)
+            # Like Drive, properties are merged key by key and a key set to null is removed.
+            for key in ('properties', 'appProperties'):
+                if key in metadata:
+                    merged = dict(item.get(key) or {}, **(metadata.pop(key) or {}))
+                    item[key] = {name: value for name, value in merged.items() if value is not None}
+            item.update({key: value for key, value in metadata.items() if key not in ('id', 'kind')})
+            parents = [parent for parent in item.get('parents', [])
+                       if parent not in params.get('removeParents', '').split(',')]
+            parents.extend(parent for parent in params.get('addParents', '').split(',') if parent)
+            item['parents'] = parents
+            if content is not None:
+                self._set_content(item, content)
+            item['modifiedTime'] = self._now()
+            self._changed(item['id'])
+            return 200, project(dict(item), params.get('fields'))
+
+    def _files_delete(self, params, body, headers, file_id):
+        with self._lock:
+            item = self._file(file_id)
+            for removed_id in [item['id']] + self._descendants(item['id']):
+                self.files.pop(removed_id, None)
+                self.content.pop(removed_id, None)
+                self.sheets.pop(removed_id, None)
+                self.permissions.pop(removed_id, None)
+                self._changed(removed_id, removed=True)
+        return 204, b''
+
+    def _files_empty_trash(self, params, body, headers):
+        with self._lock:
+            drive_id = params.get('driveId')
+            for item in list(self.files.values()):
+                if item.get('trashed') and item.get('driveId') == drive_id and item['id'] in self.files:
+                    self._files_delete({}, None, headers, item['id'])
+        return 204, b''
+
+    # Uploads ---------------------------------------------------------------------------------------------------
+
+    def _upload_create(self, params, body, headers):
+        upload_type = params.get('uploadType')
+        if upload_type == 'resumable':
+            return self._start_session(None, params, body, headers)
+        if upload_type == 'multipart':
+            metadata, content = self._multipart(body, headers)
+        else:
+            metadata, content = {}, body or b''
+        with self._lock:
+            metadata.setdefault('mimeType', headers.get('content-type', 'application/octet-stream'))
+            item = self._insert(metadata, content)
+            return 200, project(dict(item), params.get('fields'))
+
+    def _upload_update(self, params, body, headers, file_id):
+        upload_type = params.get('uploadType')
+        if upload_type == 'resumable':
+            return self._start_session(file_id, params, body, headers)
+        if upload_type == 'multipart':
+            metadata, content = self._multipart(body, headers)
+        else:
+            metadata, content = {}, body or b''
+        return self._files_update(params, json.dumps(metadata).encode(), headers, file_id, content)
+
+    def _start_session(self, file_id, params, body, headers):
+        with self._lock:
+            session = self._new_id('upload')
+            self._uploads[session] = {'file_id': file_id, 'params': params, 'metadata': self._json(body),
+                                      'content_type': headers.get('x-upload-content-type'), 'data': b''}
+        return 200, {'location': f'https://www.googleapis.com/upload/session/{session}'}, b''
+
+    def _upload_chunk(self, params, body, headers, session):
+        with self._lock:
+            upload = self._uploads.get(session)
+            if upload is None:
+                raise FakeApiError(404, 'Upload session not found.', 'notFound')
+            upload['data'] += body or b''
+
+            content_range = headers.get('content-range', '')
+            match = re.match(r'bytes (?:\d+-\d+|\*)/(\d+|\*)', content_range)
+            total = match.group(1) if match else str(len(upload['data']))
+            if total == '*' or len(upload['data']) < int(total):
+                if not upload['data']:
+                    return 308, {}, b''
+                return 308, {'range': f"bytes=0-{len(upload['data']) - 1}"}, b''
+
+            del self._uploads[session]
+            metadata = upload['metadata']
+            if upload['file_id']:
+                return self._files_update(upload['params'], json.dumps(metadata).encode(), headers,
+                                          upload['file_id'], upload['data'])
+            if upload['content_type']:
+                metadata.setdefault('mimeType', upload['content_type'])
+            item = self._insert(metadata, upload['data'])
+            return 200, project(dict(item), upload['params'].get('fields'))
+
+    # Permissions -----------------------------------------------------------------------------------------------
+
+    def _file_permissions(self, file_id):
+        item = self._file(file_id)
+        permissions = self.permissions.get(item['id'])
+        if permissions is None:
+            owner = item['owners'][0]['emailAddress']
+            permissions = self.permissions[item['id']] = [{'kind': 'drive#permission', 'type': 'user',
+                                                           'role': 'owner', 'emailAddress': owner,
+                                                           'id': self._permission_id('user', owner)}]
+        return permissions
+
+    def _permission_id(self, permission_type, target):
+        # Like Drive, a grantee has the same permission id on every file.
+        if permission_type == 'anyone':
+            return 'anyoneWithLink'
+        return self._permission_ids.setdefault((permission_type, target), self._new_id('perm'))
+
+    def _permission(self, file_id, permission_id):
+        for permission in self._file_permissions(file_id):
+            if permission['id'] == permission_id:
+                return permission
+        raise FakeApiError(404, f'Permission not found: {permission_id}.', 'notFound')
+
+    def _permissions_list(self, params, body, headers, file_id):
+        with self._lock:
+            response = self._page(self._file_permissions(file_id), params, 'permissions')
+        return 200, project(response, params.get('fields'))
+
+    def _permissions_create(self, params, body, headers, file_id):
+        with self._lock:
+            permissions = self._file_permissions(file_id)
+            request = self._json(body)
+            permission_type, role = request.get('type'), request.get('role')
+            if role not in PERMISSION_ROLES:
+                raise FakeApiError(400, f'Invalid role: {role}.', 'invalid')
+            if permission_type in ('user', 'group'):
+                target = request.get('emailAddress')
+            elif permission_type == 'domain':
+                target = request.get('domain')
+            elif permission_type == 'anyone':
+                target = None
+            else:
+                raise FakeApiError(400, f'Invalid permission type: {permission_type}.', 'invalid')
+            if permission_type != 'anyone' and not target:
+                raise FakeApiError(400, 'The permission is missing its grantee.', 'required')
+
+            permission_id = self._permission_id(permission_type, target)
+            permission = next((existing for existing in permissions if existing['id'] == permission_id), None)
+            if permission is None:
+                permission = {'kind': 'drive#permission', 'id': permission_id}
+                permissions.append(permission)
+            permission.update({key: value for key, value in request.items() if key != 'id'})
+            if permission_type in ('user', 'group') and params.get('sendNotificationEmail', 'true') != 'false':
+                self.notifications.append((target, file_id, params.get('emailMessage')))
+            self._changed(file_id)
+            return 200, project(dict(permission), params.get('fields'))
+
+    def _permissions_get(self, params, body, headers, file_id, permission_id):
+        with self._lock:
+            return 200, project(dict(self._permission(file_id, permission_id)), params.get('fields'))
+
+    def _permissions_update(self, params, body, headers, file_id, permission_id):
+        with self._lock:
+            permission = self._permission(file_id, permission_id)
+            role = self._json(body).get('role', permission['role'])
+            if role not in PERMISSION_ROLES:
+                raise FakeApiError(400, f'Invalid role: {role}.', 'invalid')
+            permission['role'] = role
+            self._changed(file_id)
+            return 200, project(dict(permission), params.get('fields'))
+
+    def _permissions_delete(self, params, body, headers, file_id, permission_id):
+        with self._lock:
+            permission = self._permission(file_id, permission_id)
+            if permission['role'] == 'owner':
+                raise FakeApiError(403, 'The owner of a file cannot be removed.', 'cannotRemoveOwner')
+            self._file_permissions(file_id).remove(permission)
+            self._changed(file_id)
+        return 204, b''
+
+    # Shared drives ---------------------------------------------------------------------------------------------
+
+    def _drives_list(self, params, body, headers):
+        with self._lock:
+            response = self._page(list(self.drives.values()), params, 'drives')
+        return 200, project(response, params.get('fields'))
+
+    def _drives_get(self, params, body, headers, drive_id):
+        with self._lock:
+            drive = self.drives.get(drive_id)
+            if drive is None:
+                raise FakeApiError(404, f'Shared drive not found: {drive_id}', 'notFound')
+            return 200, project(dict(drive), params.get('fields'))
+
+    # Changes ---------------------------------------------------------------------------------------------------
+
+    def _changes_start_page_token(self, params, body, headers):
+        with self._lock:
+            return 200, {'kind': 'drive#startPageToken', 'startPageToken': str(len(self.changes) + 1)}
+
+    def _changes_list(self, params, body, headers):
+        with self._lock:
+            start = int(params['pageToken']) - 1
+            page_size = min(int(params.get('pageSize') or self.default_page_size), 1000)
+            changes = self.changes[start:start + page_size]
+            response = {'kind': 'drive#changeList', 'changes': changes}
+            if start + page_size < len(self.changes):
+                response['nextPageToken'] = str(start + page_size + 1)
+            else:
+                response['newStartPageToken'] = str(len(self.changes) + 1)
+        return 200, project(response, params.get('fields'))
+
+    # Push notifications ----------------------------------------------------------------------------------------
+
+    def flush_notifications(self):
+        """Wait until every queued push notification has been delivered (or failed to be)."""
+        self._outbox.join()
+
+    def _changes_watch(self, params, body, headers):
+        with self._lock:
+            page_token = params.get('pageToken')
+            if not page_token:
+                raise FakeApiError(400, 'Required parameter: pageToken', 'required')
+            return self._watch(params, body, 'changes', None,
+                               f'https://www.googleapis.com/drive/v3/changes?alt=json&pageToken={page_token}')
+
+    def _files_watch(self, params, body, headers, file_id):
+        with self._lock:
+            item = self._file(file_id)
+            return self._watch(params, body, item['id'], item['id'],
+                               f"https://www.googleapis.com/drive/v3/files/{item['id']}?alt=json")
+
+    def _watch(self, params, body, resource, file_id, resource_uri):
+        request = self._json(body)
+        if request.get('type') not in ('web_hook', 'webhook'):
+            raise FakeApiError(400, f"Invalid channel type: {request.get('type')}.", 'invalid')
+        if not request.get('id') or not request.get('address'):
+            raise FakeApiError(400, 'A channel needs an id and an address.', 'required')
+        if request['id'] in self.channels:
+            raise FakeApiError(400, f"Channel id {request['id']} not unique", 'channelIdNotUnique')
+
+        expiration = int(request.get('expiration') or (time.time() + 3600) * 1000)
+        channel = {'kind': 'api#channel', 'id': request['id'], 'resourceUri': resource_uri,
+                   'resourceId': self._resource_ids.setdefault(resource, self._new_id('resource')),
+                   'expiration': str(expiration)}
+        if request.get('token'):
+            channel['token'] = request['token']
+        self.channels[request['id']] = dict(channel, address=request['address'], fileId=file_id,
+                                            messages=itertools.count(1))
+        self._notify(self.channels[request['id']], 'sync')
+        return 200, project(channel, params.get('fields'))
+
+    def _channels_stop(self, params, body, headers):
+        with self._lock:
+            request = self._json(body)
+            channel = self.channels.get(request.get('id'))
+            if channel is None or channel['resourceId'] != request.get('resourceId'):
+                raise FakeApiError(404, f"Channel '{request.get('id')}' not found for project", 'notFound')
+            del self.channels[request['id']]
+        return 204, b''
+
+    def _notify_change(self, file_id, item, removed):
+        now = time.time() * 1000
+        for channel_id, channel in list(self.channels.items()):
+            if int(channel['expiration']) < now:
+                del self.channels[channel_id]
+            elif channel['fileId'] is None:
+                self._notify(channel, 'change')
+            elif channel['fileId'] == file_id:
+                if removed:
+                    self._notify(channel, 'remove')
+                else:
+                    self._notify(channel, 'trash' if item.get('trashed') else 'update', 'content,properties')
+
+    def _notify(self, channel, state, changed=None):
+        headers = {'X-Goog-Channel-ID': channel['id'],
+                   'X-Goog-Channel-Expiration': formatdate(int(channel['expiration']) / 1000, usegmt=True),
+                   'X-Goog-Resource-ID': channel['resourceId'],
+                   'X-Goog-Resource-URI': channel['resourceUri'],
+                   'X-Goog-Resource-State': state,
+                   'X-Goog-Message-Number': str(next(channel['messages']))}
+        if channel.get('token'):
+            headers['X-Goog-Channel-Token'] = channel['token']
+        if changed:
+            headers['X-Goog-Changed'] = changed
+        self._outbox.put((channel['address'], headers))
+        if self._sender is None:
+            self._sender = threading.Thread(target=self._deliver, name='FakeDrive notifications', daemon=True)
+            self._sender.start()
+
+    def _deliver(self):
+        while True:
+            address, headers = self._outbox.get()
+            try:
+                request = urllib.request.Request(address, data=b'', headers=headers, method='POST')
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    status = response.status
+            except urllib.error.HTTPError as error:
+                status = error.code
+            except OSError:
+                status = None
+            self.deliveries.append((headers['X-Goog-Channel-ID'], headers['X-Goog-Resource-State'], status))
+            self._outbox.task_done()
+
+    # Batch -----------------------------------------------------------------------------------------------------
+
+    def _batch(self, params, body, headers):
+        message = BytesParser().parsebytes(b'Content-Type: ' + headers['content-type'].encode() + b'\r\n\r\n' + body)
+        boundary = 'batch_' + self._new_id('')
+        lines = []
+        for part in message.get_payload():
+            request = part.get_payload()
+            request_line, _, rest = request.partition('\n')
+            method, path, _ = request_line.split(' ', 2)
+            inner = BytesParser().parsebytes(rest.encode())
+            inner_headers = {key.lower(): value for key, value in inner.items()}
+            inner_body = inner.get_payload(decode=False).encode() or None
+
+            parsed = urlparse(path)
+            try:
+                status, response_headers, content = self._route(
+                    method, parsed.path, dict(parse_qsl(parsed.query, keep_blank_values=True)), inner_body,
+                    inner_headers)
+            except FakeApiError as api_error:
+                status = api_error.status
+                response_headers, content = self._error_body(status, str(api_error), api_error.reason)
+            if isinstance(content, (dict, list)):
+                content = json.dumps(content).encode()
+
+            lines.append(f'--{boundary}')
+            lines.append('Content-Type: application/http')
+            lines.append(f"Content-ID: <response-{part['Content-ID'][1:]}")
+            lines.append('')
+            lines.append(f'HTTP/1.1 {status} OK')
+            lines.append('Content-Type: application/json; charset=UTF-8')
+            lines.append('')
+            lines.append(content.decode())
+        lines.append(f'--{boundary}--')
+        return 200, {'content-type': f'multipart/mixed; boundary={boundary}'}, '\r\n'.join(lines).encode()
+
+    # Sheets ----------------------------------------------------------------------------------------------------
+
+    def _grid(self, sheet_id, sheet_name):
+        if sheet_id not in self.sheets:
+            raise FakeApiError(404, 'Requested entity was not found.', 'notFound')
+        return self.sheets[sheet_id].setdefault(sheet_name, [])
+
+    def _sheets_create(self, params, body, headers):
+        with self._lock:
+            properties = self._json(body).get('properties', {})
+            item = self._insert({'name': properties.get('title', 'Untitled spreadsheet'),
+                                 'mimeType': SPREADSHEET_MIME_TYPE})
+            spreadsheet = {'spreadsheetId': item['id'], 'properties': properties,
+                           'spreadsheetUrl': f"https://docs.google.com/spreadsheets/d/{item['id']}/edit"}
+        return 200, project(spreadsheet, params.get('fields'))
+
+    def _write(self, sheet_id, a1_range, values):
+        sheet_name, (row, column) = _range_start(a1_range)
+        grid = self._grid(sheet_id, sheet_name)
+        for row_offset, values_row in enumerate(values):
+            while len(grid) <= row + row_offset:
+                grid.append([])
+            target = grid[row + row_offset]
+            while len(target) < column + len(values_row):
+                target.append('')
+            target[column:column + len(values_row)] = [str(value) for value in values_row]
+        self._changed(sheet_id)
+        columns = max((len(values_row) for values_row in values), default=0)
+        return {'spreadsheetId': sheet_id, 'updatedRange': f'{sheet_name}!{a1_range}',
+                'updatedRows': len(values), 'updatedColumns': columns,
+                'updatedCells': sum(len(values_row) for values_row in values)}
+
+    def _values_get(self, params, body, headers, sheet_id, range):
+        with self._lock:
+            sheet_name, (row, column) = _range_start(range)
+            grid = self._grid(sheet_id, sheet_name)
+            values = [grid_row[column:] for grid_row in grid[row:]]
+        return 200, {'range': unquote(range), 'majorDimension': 'ROWS', 'values': values}
+
+    def _values_update(self, params, body, headers, sheet_id, range):
+        with self._lock:
+            return 200, self._write(sheet_id, unquote(range), self._json(body).get('values', []))
+
+    def _values_append(self, params, body, headers, sheet_id, range):
+        with self._lock:
+            sheet_name, (_, column) = _range_start(range)
+            grid = self._grid(sheet_id, sheet_name)
+            letters = re.match(r'[A-Za-z]*', unquote(range).rpartition('!')[2]).group() or 'A'
+            updates = self._write(sheet_id, f'{sheet_name}!{letters}{len(grid) + 1}',
+                                  self._json(body).get('values', []))
+        return 200, {'spreadsheetId': sheet_id, 'tableRange': unquote(range), 'updates': updates}
+
+    def _values_batch_update(self, params, body, headers, sheet_id):
+        with self._lock:
+            responses = [self._write(sheet_id, data['range'], data.get('values', []))
+                         for data in self._json(body).get('data', [])]
+        return 200, {'spreadsheetId': sheet_id, 'responses': responses,
+                     'totalUpdatedCells': sum(response['updatedCells'] for response in responses)}
@@ -0,0 +1,272 @@
+"""
+Spread requests over several Google identities.
+
+Drive enforces its quotas per user, so one identity caps how fast a job can go. An Identity wraps credentials (a
+service account, a service account impersonating a user through domain-wide delegation, or any other google.auth
+credentials) together with its own token bucket. drive_tools builds separate services for every identity and paces
+their requests through the bucket. A CredentialsPool picks an identity per unit of work, the one with the most
+budget left or, for work that has to run as a particular user, the same one every time:
+
+    pool = drive_identities.CredentialsPool.delegated('service-account.json',
+                                                      ['ann@example.com', 'bob@example.com', 'cy@example.com'])
+    file_ids = pool.map(lambda name: drive_tools.upload_csv_to_drive('exports', name, folder_id), csv_names)
+
+    with pool.identity(affinity='ann@example.com'):
+        drive_tools.upload_csv_to_drive('exports', 'report.csv')
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Optional
+import hashlib
+import threading
+import time
+try:
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_tools
+
+SCOPES = ('https://www.googleapis.com/auth/drive',
+          'https://www.googleapis.com/auth/spreadsheets')
+
+# Sustained requests per second per identity. Drive allows bursts well above this but starts answering writes with
+# rate limit errors when a single user keeps it up.
+DEFAULT_REQUESTS_PER_SECOND = 10
+
+# How long an identity is passed over by CredentialsPool.pick after Drive throttled it.
+THROTTLE_COOLDOWN_SECONDS = 10
+
+
+class Identity:
+    """Credentials with their own rate limit."""
+
+    def __init__(self, name: str, credentials: object, requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+                 burst: Optional[float] = None):
+        """Wrap credentials.
+
+        :param name: Unique name, e.g. the service account or delegated user email.
+        :type name: str
+        :param credentials: google.auth credentials. None sends as the drive_tools.google_creds() user.
+        :type credentials: google.auth.credentials.Credentials
+        :param requests_per_second: Pace of the identity's requests.
+        :type requests_per_second: float
+        :param burst: Requests that may go out at once. Defaults to one second worth of requests.
+        :type burst: float
+        """
+        self.name = name
+        self.credentials = credentials
+        self.limiter = drive_tools.RateLimiter(requests_per_second, burst)
+        self.requests = 0
+        self.throttles = 0
+        self.active = 0
+        self.cooldown_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_service_account_file(cls, path: str, subject: Optional[str] = None, scopes: tuple = SCOPES,
+                                  **limits) -> 'Identity':
+        """
+        Load a service account key file.
+
+        Args:
+            path (str): Path of the json key file.
+            subject (str): User to impersonate through domain-wide delegation. Defaults to the service account itself.
+            scopes (tuple): OAuth scopes. With delegation they have to be granted to the service account's client id
+                in the Admin console.
+            **limits: requests_per_second and burst, see Identity.
+
+        Returns:
+            Identity: The identity, named after the subject or the service account.
+
+        """
+        from google.oauth2 import service_account
+
+        credentials = service_account.Credentials.from_service_account_file(path, scopes=list(scopes))
+        return cls._service_account(credentials, subject, limits)
+
+    @classmethod
+    def from_service_account_info(cls, info: dict, subject: Optional[str] = None, scopes: tuple = SCOPES,
+                                  **limits) -> 'Identity':
+        """Like from_service_account_file, for a key that is already parsed."""
+        from google.oauth2 import service_account
+
+        credentials = service_account.Credentials.from_service_account_info(info, scopes=list(scopes))
+        return cls._service_account(credentials, subject, limits)
+
+    @classmethod
+    def _service_account(cls, credentials, subject, limits):
+        if subject:
+            credentials = credentials.with_subject(subject)
+        return cls(subject or credentials.service_account_email, credentials, **limits)
+
+    def delegate(self, subject: str, **limits) -> 'Identity':
+        """
+        The same service account impersonating another user.
+
+        Args:
+            subject (str): User to impersonate.
+            **limits: requests_per_second and burst. Default to the limits of this identity.
+
+        Returns:
+            Identity: A new identity with its own rate limit.
+
+        """
+        limits.setdefault('requests_per_second', self.limiter.rate)
+        limits.setdefault('burst', self.limiter.burst)
+        return Identity(subject, self.credentials.with_subject(subject), **limits)
+
+    def acquire(self, count: int = 1):
+        """Wait for the identity's rate limit to allow count more requests."""
+        self.limiter.acquire(count)
+        with self._lock:
+            self.requests += count
+
+    def throttled(self):
+        """Drive answered one of the identity's requests with a rate limit error."""
+        with self._lock:
+            self.throttles += 1
+            self.cooldown_until = time.monotonic() + THROTTLE_COOLDOWN_SECONDS
+
+    def headroom(self) -> float:
+        """
+        How many requests the identity can send right now without waiting.
+
+        Returns:
+            float: Tokens in its bucket, negative when it is behind, minus infinity while cooling down.
+
+        """
+        if time.monotonic() < self.cooldown_until:
+            return float('-inf')
+        return self.limiter.available()
+
+    def __repr__(self):
+        return f"Identity({self.name!r})"
+
+
+class CredentialsPool:
+    """A set of identities that requests are spread over."""
+
+    def __init__(self, identities: list):
+        """Pool the identities.
+
+        :param identities: Identities with unique names.
+        :type identities: list
+        """
+        if not identities:
+            raise ValueError("A credentials pool needs at least one identity")
+        if len({identity.name for identity in identities}) != len(identities):
+            raise ValueError("The identities of a credentials pool need unique names")
+        self.identities = list(identities)
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_service_account_files(cls, paths: list, **limits) -> 'CredentialsPool':
+        """
+        One identity per service account key file.
+
+        Args:
+            paths (list): Paths of the json key files.
+            **limits: requests_per_second and burst of every identity.
+
+        Returns:
+            CredentialsPool: The pool.
+
+        """
+        return cls([Identity.from_service_account_file(path, **limits) for path in paths])
+
+    @classmethod
+    def delegated(cls, service_account: object, subjects: list, **limits) -> 'CredentialsPool':
+        """
+        One identity per user, all impersonated by the same service account through domain-wide delegation.
+
+        Args:
+            service_account (str, Identity): Key file path, or the service account's Identity.
+            subjects (list): Users to impersonate.
+            **limits: requests_per_second and burst of every identity.
+
+        Returns:
+            CredentialsPool: The pool.
+
+        """
+        if isinstance(service_account, str):
+            service_account = Identity.from_service_account_file(service_account)
+        return cls([service_account.delegate(subject, **limits) for subject in subjects])
+
+    def pick(self, affinity: Optional[str] = None) -> Identity:
+        """
+        Choose the identity for the next piece of work.
+
+        Args:
+            affinity (str): Work with the same affinity (a user, a folder id, ...) always gets the same identity, as
+                long as it is not cooling down after being throttled. Without one the identity with the most budget
+                left is picked.
+
+        Returns:
+            Identity: The identity.
+
+        """
+        with self._lock:
+            candidates = [identity for identity in self.identities if identity.headroom() > float('-inf')]
+            if not candidates:
+                # Everybody is cooling down, the rate limiters will slow things down anyway.
+                candidates = self.identities
+
+            if affinity is not None:
+                # Rendezvous hashing: the same identity keeps the affinity when others join or cool down.
+                return max(candidates,
+                           key=lambda identity: hashlib.sha1(f'{identity.name}/{affinity}'.encode()).digest())
+
+            # Work that is still running counts against the budget, so threads picking at once spread out.
+            return max(candidates, key=lambda identity: identity.headroom() - identity.active)
+
+    @contextmanager
+    def identity(self, affinity: Optional[str] = None):
+        """
+        Send the requests of the block as a picked identity, see pick.
+
+        Args:
+            affinity (str): See pick.
+
+        """
+        with self._lock:
+            identity = self.pick(affinity)
+            identity.active += 1
+        try:
+            with drive_tools.use_identity(identity):
+                yield identity
+        finally:
+            with self._lock:
+                identity.active -= 1
+
+    def map(self, function: Callable, items: list, jobs: int = 8,
+            affinity: Optional[Callable[[object], str]] = None) -> list:
+        """
+        Call function on every item in a thread pool, each call running as an identity from the pool.
+
+        Args:
+            function (callable): Called with one item.
+            items (list): Work items.
+            jobs (int): Calls running at once. More identities can keep more calls busy.
+            affinity (callable): Called with an item, returns its affinity, see pick.
+
+        Returns:
+            list: The results, in the order of items.
+
+        """
+        def run(item):
+            with self.identity(affinity(item) if affinity else None):
+                return function(item)
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            return list(executor.map(run, items))
+
+    def stats(self) -> dict:
+        """
+        Requests sent and throttling seen per identity.
+
+        Returns:
+            dict: {name: {'requests': int, 'throttles': int}}.
+
+        """
+        return {identity.name: {'requests': identity.requests, 'throttles': identity.throttles}
+                for identity in self.identities}
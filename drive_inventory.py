@@ -0,0 +1,376 @@
+"""
+Export an inventory of Drive metadata.
+
+The scan is split into shards, one per shared drive (plus My Drive) or one per modifiedTime range, which are listed
+by a pool of worker processes. Pages stream back through a bounded queue and are written as they arrive, to Parquet
+row groups (needs pyarrow) or to CSV files of a fixed number of rows. Memory use stays flat however big the domain
+is, and the listing is not held back by one interpreter:
+
+    report = drive_inventory.export_inventory('inventory.parquet', shard_by='drive', processes=8)
+    print(report.rows, report.rows_per_second)
+
+"""
+from typing import Callable, Optional
+import csv
+import datetime
+import multiprocessing
+import os
+import queue
+import time
+try:
+    import drive_records
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_records
+    from google_drive_tools import drive_tools
+
+# Columns of the inventory, in order. parents is a list in Parquet and ";" separated in CSV.
+COLUMNS = ('id', 'name', 'mime_type', 'parents', 'drive_id', 'modified_time', 'size', 'md5_checksum')
+
+# Pages a worker may get ahead of the writer before it has to wait.
+QUEUE_PAGES = 64
+
+# Rows per Parquet row group and per CSV file.
+ROWS_PER_CHUNK = 100000
+
+_worker_queue = None
+
+
+class Shard:
+    """One disjoint part of the scan."""
+
+    def __init__(self, label: str, query: Optional[str] = None, drive_id: Optional[str] = None,
+                 all_drives: bool = False):
+        """Describe the part.
+
+        :param label: Name the shard is reported under.
+        :type label: str
+        :param query: files.list query of the shard.
+        :type query: str
+        :param drive_id: Shared drive the shard lists.
+        :type drive_id: str
+        :param all_drives: List My Drive and every shared drive, instead of My Drive only.
+        :type all_drives: bool
+        """
+        self.label = label
+        self.query = query
+        self.drive_id = drive_id
+        self.all_drives = all_drives
+
+    def list_arguments(self) -> dict:
+        """files.list arguments selecting the shard."""
+        if self.drive_id:
+            scope = {'corpora': 'drive', 'driveId': self.drive_id, 'includeItemsFromAllDrives': True}
+        elif self.all_drives:
+            scope = {'corpora': 'allDrives', 'includeItemsFromAllDrives': True}
+        else:
+            scope = {'corpora': 'user'}
+        if self.query:
+            scope['q'] = self.query
+        return dict(scope, supportsAllDrives=True)
+
+    def __repr__(self):
+        return f"Shard({self.label!r})"
+
+
+def _and(*queries):
+    return ' and '.join(f'({query})' for query in queries if query) or None
+
+
+def shards_by_drive(query: Optional[str] = None) -> list:
+    """
+    One shard for My Drive and one per shared drive the user can see.
+
+    Args:
+        query (str): files.list query every shard is restricted to, e.g. "trashed = false".
+
+    Returns:
+        list: Shards.
+
+    """
+    shards = [Shard('my drive', query)]
+    page_token = None
+    while True:
+        response = drive_tools.drive_service().drives().list(pageSize=100, pageToken=page_token,
+                                                             fields="nextPageToken, drives(id,name)").execute()
+        shards.extend(Shard(drive['name'], query, drive_id=drive['id']) for drive in response.get('drives', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return shards
+
+
+def shards_by_modified_time(partitions: int,
+                            start: datetime.datetime,
+                            end: Optional[datetime.datetime] = None,
+                            query: Optional[str] = None) -> list:
+    """
+    Split the scan of every drive the user can see into modifiedTime ranges of equal length. The first range is open
+    towards the past and the last towards the future, so no item is missed.
+
+    Args:
+        partitions (int): Number of shards.
+        start (datetime): Start of the second range, roughly when the domain's files start.
+        end (datetime): Start of the last range. Defaults to now.
+        query (str): files.list query every shard is restricted to.
+
+    Returns:
+        list: Shards.
+
+    """
+    end = end or datetime.datetime.now(datetime.timezone.utc)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=datetime.timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=datetime.timezone.utc)
+    # partitions - 1 edges from start to end, with open ranges before the first and after the last one.
+    count = max(partitions - 1, 1)
+    step = (end - start) / max(count - 1, 1)
+    edges = [(start + step * index).astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+             for index in range(count)]
+    edges = [None] + edges + [None]
+
+    shards = []
+    for lower, upper in zip(edges, edges[1:]):
+        bounds = _and(f"modifiedTime >= '{lower}'" if lower else None,
+                      f"modifiedTime < '{upper}'" if upper else None)
+        shards.append(Shard(f"{lower or '...'} - {upper or '...'}", _and(query, bounds), all_drives=True))
+    return shards
+
+
+def _row(item):
+    record = drive_records.FileRecord.from_api(item)
+    return tuple(getattr(record, column) for column in COLUMNS)
+
+
+def _init_worker(pages):
+    global _worker_queue
+    _worker_queue = pages
+    # A forked worker must not talk over the connections of the parent.
+    drive_tools.reset_services()
+
+
+def _scan(index_and_shard):
+    """Runs in a worker process: list one shard and put its pages on the queue."""
+    index, shard = index_and_shard
+    fields = f"nextPageToken, files({drive_records.FileRecord.fields()})"
+    rows = 0
+    try:
+        page_token = None
+        while True:
+            response = drive_tools.drive_service().files().list(fields=fields, pageSize=1000, pageToken=page_token,
+                                                                **shard.list_arguments()).execute(num_retries=5)
+            page = [_row(item) for item in response.get('files', [])]
+            rows += len(page)
+            _worker_queue.put(('rows', index, page))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+    except Exception as error:
+        _worker_queue.put(('error', index, f'{type(error).__name__}: {error}'))
+        return
+    _worker_queue.put(('done', index, rows))
+
+
+class CsvWriter:
+    """Writes rows to CSV files holding at most rows_per_file rows each."""
+
+    def __init__(self, path: str, rows_per_file: int = ROWS_PER_CHUNK):
+        """Prepare the first file.
+
+        :param path: Path of the export, e.g. "inventory.csv". Files are numbered: inventory-00000.csv, ...
+        :type path: str
+        :param rows_per_file: Rows per file.
+        :type rows_per_file: int
+        """
+        self._stem, self._suffix = os.path.splitext(path)
+        self.rows_per_file = rows_per_file
+        self.files = []
+        self._file = None
+        self._writer = None
+        self._rows_in_file = 0
+
+    def write(self, rows: list):
+        for row in rows:
+            if self._file is None or self._rows_in_file >= self.rows_per_file:
+                self._next_file()
+            self._writer.writerow(';'.join(value) if isinstance(value, tuple) else value for value in row)
+            self._rows_in_file += 1
+
+    def _next_file(self):
+        if self._file is not None:
+            self._file.close()
+        path = f'{self._stem}-{len(self.files):05d}{self._suffix or ".csv"}'
+        self.files.append(path)
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+        self._rows_in_file = 0
+
+    def close(self):
+        if self._file is None:
+            # An empty inventory still gets a file with the header.
+            self._next_file()
+        self._file.close()
+
+
+class ParquetWriter:
+    """Writes rows to a Parquet file, one row group per rows_per_group rows. Needs pyarrow."""
+
+    def __init__(self, path: str, rows_per_group: int = ROWS_PER_CHUNK):
+        """Open the file.
+
+        :param path: Path of the Parquet file.
+        :type path: str
+        :param rows_per_group: Rows buffered before a row group is written.
+        :type rows_per_group: int
+        """
+        import pyarrow
+        import pyarrow.parquet
+
+        self._pyarrow = pyarrow
+        self.schema = pyarrow.schema([('id', pyarrow.string()),
+                                      ('name', pyarrow.string()),
+                                      ('mime_type', pyarrow.string()),
+                                      ('parents', pyarrow.list_(pyarrow.string())),
+                                      ('drive_id', pyarrow.string()),
+                                      ('modified_time', pyarrow.string()),
+                                      ('size', pyarrow.int64()),
+                                      ('md5_checksum', pyarrow.string())])
+        self.rows_per_group = rows_per_group
+        self.files = [path]
+        self._writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self._buffer = []
+
+    def write(self, rows: list):
+        self._buffer.extend(rows)
+        while len(self._buffer) >= self.rows_per_group:
+            self._flush(self._buffer[:self.rows_per_group])
+            del self._buffer[:self.rows_per_group]
+
+    def _flush(self, rows):
+        columns = [[row[index] for row in rows] for index in range(len(COLUMNS))]
+        self._writer.write_table(self._pyarrow.Table.from_arrays(
+            [self._pyarrow.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def close(self):
+        if self._buffer:
+            self._flush(self._buffer)
+            self._buffer = []
+        self._writer.close()
+
+
+class InventoryReport:
+    """Progress and outcome of an export."""
+
+    def __init__(self, shards: list):
+        # Shards are reported under their label. Labels are not unique (two shared drives can have the same name, two
+        # modifiedTime ranges can round to the same second), so repeated ones get the index of the shard appended.
+        labels = [shard.label for shard in shards]
+        self.labels = [label if labels.count(label) == 1 else f'{label} #{index}' for index, label in enumerate(labels)]
+        self.shards = {label: 0 for label in self.labels}
+        self.failed = {}
+        self.files = []
+        self.rows = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __bool__(self):
+        return not self.failed
+
+    def __repr__(self):
+        return (f"InventoryReport(rows={self.rows}, rows_per_second={self.rows_per_second:.0f}, "
+                f"failed={len(self.failed)})")
+
+
+def export_inventory(path: str,
+                     file_format: Optional[str] = None,
+                     shard_by: str = 'drive',
+                     shards: Optional[list] = None,
+                     query: Optional[str] = None,
+                     partitions: int = 16,
+                     start: Optional[datetime.datetime] = None,
+                     processes: Optional[int] = None,
+                     rows_per_chunk: int = ROWS_PER_CHUNK,
+                     progress: Optional[Callable[[InventoryReport], None]] = None,
+                     progress_interval: float = 10.0,
+                     start_method: Optional[str] = None) -> InventoryReport:
+    """
+    List everything the user can see in worker processes and stream it into Parquet or CSV.
+
+    Args:
+        path (str): Where to write. A ".parquet" path writes Parquet, anything else chunked CSV.
+        file_format (str): "parquet" or "csv", overrides the guess from path.
+        shard_by (str): "drive" for one shard per shared drive (and My Drive), "modified" for modifiedTime ranges.
+        shards (list): Shards to scan instead of the ones shard_by would make.
+        query (str): files.list query restricting the inventory, e.g. "trashed = false".
+        partitions (int): Number of modifiedTime ranges for shard_by "modified".
+        start (datetime): Start of the modifiedTime ranges. Defaults to ten years ago.
+        processes (int): Worker processes. Defaults to the number of CPUs, at most one per shard.
+        rows_per_chunk (int): Rows per Parquet row group or CSV file.
+        progress (callable): Called with the report every progress_interval seconds while the export runs.
+        progress_interval (float): Seconds between progress calls.
+        start_method (str): multiprocessing start method for the workers, e.g. "spawn".
+
+    Returns:
+        InventoryReport: Rows written per shard, rows per second, the files written and the shards that failed.
+
+    """
+    if shards is None:
+        if shard_by == 'drive':
+            shards = shards_by_drive(query)
+        elif shard_by == 'modified':
+            start = start or datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=3650)
+            shards = shards_by_modified_time(partitions, start, query=query)
+        else:
+            raise ValueError(f"shard_by must be 'drive' or 'modified', not {shard_by!r}")
+
+    file_format = file_format or ('parquet' if path.endswith('.parquet') else 'csv')
+    writer = ParquetWriter(path, rows_per_chunk) if file_format == 'parquet' else CsvWriter(path, rows_per_chunk)
+
+    report = InventoryReport(shards)
+    context = multiprocessing.get_context(start_method)
+    pages = context.Queue(QUEUE_PAGES)
+    processes = max(1, min(processes or os.cpu_count() or 1, len(shards)))
+    last_progress = time.monotonic()
+
+    with context.Pool(processes, initializer=_init_worker, initargs=(pages,)) as pool:
+        pending = pool.map_async(_scan, list(enumerate(shards)), chunksize=1)
+        remaining = len(shards)
+        try:
+            while remaining:
+                try:
+                    kind, index, payload = pages.get(timeout=1)
+                except queue.Empty:
+                    if pending.ready() and not pending.successful():
+                        # A worker died without reporting, e.g. it could not unpickle a shard.
+                        pending.get()
+                    continue
+
+                label = report.labels[index]
+                if kind == 'rows':
+                    writer.write(payload)
+                    report.rows += len(payload)
+                    report.shards[label] += len(payload)
+                else:
+                    remaining -= 1
+                    if kind == 'error':
+                        report.failed[label] = payload
+
+                if progress and time.monotonic() - last_progress >= progress_interval:
+                    last_progress = time.monotonic()
+                    progress(report)
+        finally:
+            writer.close()
+            report.files = writer.files
+            report.finished = time.monotonic()
+
+    return report
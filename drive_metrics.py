@@ -0,0 +1,242 @@
+"""
+Instrumentation for Google Drive and Sheets api calls.
+
+drive_tools reports every api call to the active instrumentation (see drive_tools.set_instrumentation). The default
+is Instrumentation, which does nothing. MetricsRecorder keeps per method latency histograms and counters in memory and
+can be exported in the Prometheus text format. OpenTelemetryInstrumentation forwards everything to an OpenTelemetry
+meter.
+
+"""
+from bisect import bisect_left
+from typing import Optional
+import threading
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Instrumentation:
+    """No-op instrumentation. Subclass it and override the record_* methods you care about.
+
+    drive_tools skips the timing and byte counting entirely while ``enabled`` is False.
+    """
+
+    enabled = False
+
+    def record_call(self, method: str, seconds: float, request_bytes: int, response_bytes: int, status: int):
+        """An api request finished. method is the api method id, e.g. "drive.files.list". status is 0 when the
+        request failed without a response (connection reset, timeout, ...)."""
+
+    def record_page(self, method: str):
+        """A page of a list call was received."""
+
+    def record_retry(self, method: str):
+        """A request is retried after a 429 or 5xx response or a transport error."""
+
+    def record_cache(self, method: str, hit: bool):
+        """A read-only request was looked up in the response cache."""
+
+    def record_build(self, what: str, seconds: float):
+        """Credentials were loaded ("credentials") or a service was built (e.g. "drive.v3")."""
+
+
+class Histogram:
+    """Latency histogram with fixed buckets."""
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """
+        Cumulative bucket counts as (upper bound, count) pairs, the last bound being "+Inf".
+
+        Returns:
+            list: Bucket counts.
+
+        """
+        running = 0
+        buckets = []
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), self.counts):
+            running += count
+            buckets.append((bound, running))
+        return buckets
+
+
+class MethodStats:
+    """Everything recorded for one api method."""
+
+    __slots__ = ('latency', 'calls', 'errors', 'request_bytes', 'response_bytes', 'pages', 'retries',
+                 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.calls = 0
+        self.errors = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.pages = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class MetricsRecorder(Instrumentation):
+    """Keeps the metrics in memory."""
+
+    enabled = True
+
+    def __init__(self):
+        self.methods = {}
+        self.builds = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, method):
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods.setdefault(method, MethodStats())
+        return stats
+
+    def record_call(self, method, seconds, request_bytes, response_bytes, status):
+        with self._lock:
+            stats = self._stats(method)
+            stats.latency.observe(seconds)
+            stats.calls += 1
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+            if status >= 400 or not status:
+                stats.errors += 1
+
+    def record_page(self, method):
+        with self._lock:
+            self._stats(method).pages += 1
+
+    def record_retry(self, method):
+        with self._lock:
+            self._stats(method).retries += 1
+
+    def record_cache(self, method, hit):
+        with self._lock:
+            stats = self._stats(method)
+            if hit:
+                stats.cache_hits += 1
+            else:
+                stats.cache_misses += 1
+
+    def record_build(self, what, seconds):
+        with self._lock:
+            histogram = self.builds.get(what)
+            if histogram is None:
+                histogram = self.builds[what] = Histogram()
+            histogram.observe(seconds)
+
+    def summary(self) -> dict:
+        """
+        Summarize the recorded metrics.
+
+        Returns:
+            dict: Per method counters and mean latency, plus the time spent building credentials and services.
+
+        """
+        with self._lock:
+            methods = {method: {'calls': stats.calls,
+                                'errors': stats.errors,
+                                'mean_seconds': stats.latency.total / stats.latency.count if stats.latency.count else 0,
+                                'total_seconds': stats.latency.total,
+                                'request_bytes': stats.request_bytes,
+                                'response_bytes': stats.response_bytes,
+                                'pages': stats.pages,
+                                'retries': stats.retries,
+                                'cache_hits': stats.cache_hits,
+                                'cache_misses': stats.cache_misses}
+                       for method, stats in self.methods.items()}
+            builds = {what: {'count': histogram.count, 'total_seconds': histogram.total}
+                      for what, histogram in self.builds.items()}
+        return {'methods': methods, 'builds': builds}
+
+
+def prometheus_text(recorder: MetricsRecorder, prefix: str = 'drive_tools') -> str:
+    """
+    Render a MetricsRecorder in the Prometheus text exposition format.
+
+    Args:
+        recorder (MetricsRecorder): Recorder to export.
+        prefix (str): Prefix for the metric names.
+
+    Returns:
+        str: Metrics, ready to be served on a /metrics endpoint or written for the node exporter textfile collector.
+
+    """
+    lines = []
+
+    def histogram(name, label, histograms):
+        lines.append(f'# TYPE {prefix}_{name} histogram')
+        for value, data in histograms:
+            for bound, count in data.cumulative():
+                lines.append(f'{prefix}_{name}_bucket{{{label}="{value}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_{name}_sum{{{label}="{value}"}} {data.total}')
+            lines.append(f'{prefix}_{name}_count{{{label}="{value}"}} {data.count}')
+
+    with recorder._lock:
+        methods = sorted(recorder.methods.items())
+        histogram('request_duration_seconds', 'method', [(method, stats.latency) for method, stats in methods])
+
+        for counter in ('errors', 'request_bytes', 'response_bytes', 'pages', 'retries', 'cache_hits',
+                        'cache_misses'):
+            lines.append(f'# TYPE {prefix}_{counter}_total counter')
+            for method, stats in methods:
+                lines.append(f'{prefix}_{counter}_total{{method="{method}"}} {getattr(stats, counter)}')
+
+        histogram('build_duration_seconds', 'what', sorted(recorder.builds.items()))
+
+    return '\n'.join(lines) + '\n'
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    """Forward the metrics to an OpenTelemetry meter. Needs the opentelemetry-api package."""
+
+    enabled = True
+
+    def __init__(self, meter: Optional[object] = None):
+        """Create the instruments.
+
+        :param meter: OpenTelemetry meter. Defaults to the global meter provider's "drive_tools" meter.
+        :type meter: opentelemetry.metrics.Meter
+        """
+        if meter is None:
+            from opentelemetry import metrics
+            meter = metrics.get_meter('drive_tools')
+
+        self._duration = meter.create_histogram('drive_tools.request.duration', unit='s')
+        self._request_bytes = meter.create_counter('drive_tools.request.size', unit='By')
+        self._response_bytes = meter.create_counter('drive_tools.response.size', unit='By')
+        self._pages = meter.create_counter('drive_tools.pages')
+        self._retries = meter.create_counter('drive_tools.retries')
+        self._cache = meter.create_counter('drive_tools.cache.lookups')
+        self._builds = meter.create_histogram('drive_tools.build.duration', unit='s')
+
+    def record_call(self, method, seconds, request_bytes, response_bytes, status):
+        attributes = {'method': method, 'status': status}
+        self._duration.record(seconds, attributes)
+        self._request_bytes.add(request_bytes, attributes)
+        self._response_bytes.add(response_bytes, attributes)
+
+    def record_page(self, method):
+        self._pages.add(1, {'method': method})
+
+    def record_retry(self, method):
+        self._retries.add(1, {'method': method})
+
+    def record_cache(self, method, hit):
+        self._cache.add(1, {'method': method, 'hit': hit})
+
+    def record_build(self, what, seconds):
+        self._builds.record(seconds, {'what': what})
@@ -0,0 +1,201 @@
+"""
+Name index for find-or-create lookups.
+
+Most lookups in provisioning flows are for names that do not exist yet, and each of them used to cost a listing.
+A NameIndex keeps one Bloom filter of names per scope (a parent folder, or all of the user's folders), built from a
+single listing. A name the filter does not contain is definitely absent and is answered without a request; only
+possible hits are checked with the api. drive_tools builds the filters and keeps them current with the items it
+creates itself (see drive_tools.set_name_index). Identities see different items, so drive_tools qualifies the scopes
+with the name of the identity sending the lookup.
+
+A Bloom filter can not forget a name, so items deleted or renamed since the filter was built only cost the server
+check they would have cost anyway. A scope whose filter keeps turning up such false positives, is filled beyond its
+capacity or is older than max_age is listed again on its next lookup. max_age also bounds how long items created by
+other processes can go unnoticed.
+
+"""
+from typing import Iterable, Optional
+import hashlib
+import math
+import threading
+import time
+
+# Scope of the filter holding the names of every folder the user can see.
+ALL_FOLDERS = '*folders*'
+
+
+class BloomFilter:
+    """Set membership with no false negatives and a bounded rate of false positives."""
+
+    __slots__ = ('capacity', 'size', 'hashes', 'count', '_bits')
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        """Size the filter.
+
+        :param capacity: Number of items the filter holds at error_rate.
+        :type capacity: int
+        :param error_rate: Chance that an item that was never added is reported as contained.
+        :type error_rate: float
+        """
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + number * second) % self.size for number in range(self.hashes))
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def __len__(self):
+        return self.count
+
+
+class _Scope:
+    __slots__ = ('names', 'built', 'false_positives')
+
+    def __init__(self, names: BloomFilter):
+        self.names = names
+        self.built = time.monotonic()
+        self.false_positives = 0
+
+
+class NameIndex:
+    """Bloom filters of item names, one per scope."""
+
+    def __init__(self, error_rate: float = 0.01, max_age: float = 300.0, headroom: float = 2.0,
+                 max_false_positives: int = 32):
+        """Configure the index, the filters are built on demand.
+
+        :param error_rate: False positive rate of each filter.
+        :type error_rate: float
+        :param max_age: Seconds after which a scope is listed again.
+        :type max_age: float
+        :param headroom: A filter is sized for this many times the names it is built from, leaving room for creates.
+        :type headroom: float
+        :param max_false_positives: A scope is listed again after this many possible hits turned out to be absent.
+        :type max_false_positives: int
+        """
+        self.error_rate = error_rate
+        self.max_age = max_age
+        self.headroom = headroom
+        self.max_false_positives = max_false_positives
+        self.absent = 0
+        self.possible = 0
+        self.false_positives = 0
+        self.builds = 0
+        self._scopes = {}
+        # Names added to a scope while it is being built, one list per build in progress.
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def _current(self, scope: str) -> Optional[_Scope]:
+        # Called with the lock held.
+        entry = self._scopes.get(scope)
+        if entry is None:
+            return None
+        if (time.monotonic() - entry.built > self.max_age or len(entry.names) > entry.names.capacity
+                or entry.false_positives >= self.max_false_positives):
+            del self._scopes[scope]
+            return None
+        return entry
+
+    def needs_build(self, scope: str) -> bool:
+        """Whether the scope has to be listed before might_contain can answer for it."""
+        with self._lock:
+            return self._current(scope) is None
+
+    def build(self, scope: str, names: Iterable[str]):
+        """
+        Replace the filter of a scope. Pass the listing itself, e.g. a generator going through the pages: names
+        added to the scope while it runs may be missing from it, and are put in the new filter too.
+
+        Args:
+            scope (str): Parent folder id, or ALL_FOLDERS.
+            names (iterable): Every name in the scope.
+
+        """
+        added = []
+        with self._lock:
+            self._building.setdefault(scope, []).append(added)
+        bloom = None
+        try:
+            names = list(names)
+            bloom = BloomFilter(int(len(names) * self.headroom) + 64, self.error_rate)
+            for name in names:
+                bloom.add(name)
+        finally:
+            with self._lock:
+                builds = [other for other in self._building.pop(scope) if other is not added]
+                if builds:
+                    self._building[scope] = builds
+                if bloom is not None:
+                    # Under the same lock as the swap, so no add falls between the two.
+                    for name in added:
+                        bloom.add(name)
+                    self._scopes[scope] = _Scope(bloom)
+                    self.builds += 1
+
+    def might_contain(self, scope: str, name: str) -> Optional[bool]:
+        """
+        Look a name up.
+
+        Args:
+            scope (str): Parent folder id, or ALL_FOLDERS.
+            name (str): Item name.
+
+        Returns:
+            bool, None: False if the name is definitely absent, True if it may be there, None if the scope has no
+                current filter.
+
+        """
+        with self._lock:
+            entry = self._current(scope)
+            if entry is None:
+                return None
+            found = name in entry.names
+            if found:
+                self.possible += 1
+            else:
+                self.absent += 1
+            return found
+
+    def add(self, scope: str, name: str):
+        """An item called name was created in scope."""
+        with self._lock:
+            entry = self._scopes.get(scope)
+            if entry is not None:
+                entry.names.add(name)
+            for added in self._building.get(scope, ()):
+                added.append(name)
+
+    def false_positive(self, scope: str):
+        """A possible hit in scope was not there after all."""
+        with self._lock:
+            self.false_positives += 1
+            entry = self._scopes.get(scope)
+            if entry is not None:
+                entry.false_positives += 1
+
+    def invalidate(self, scope: Optional[str] = None):
+        """Drop the filter of a scope, or of every scope, so it is listed again on the next lookup."""
+        with self._lock:
+            if scope is None:
+                self._scopes.clear()
+            else:
+                self._scopes.pop(scope, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'scopes': len(self._scopes), 'builds': self.builds, 'absent': self.absent,
+                    'possible': self.possible, 'false_positives': self.false_positives,
+                    'bytes': sum(len(entry.names._bits) for entry in self._scopes.values())}
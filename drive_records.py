@@ -0,0 +1,148 @@
+"""
+Compact records for Google Drive metadata.
+
+A list call with fields="*" returns a dict per item holding every field the api knows about. The records here only
+keep the fields we use, store them in __slots__ instead of a per-instance dict, intern the values that repeat across
+items (mimeTypes and parent ids) and keep parents as a tuple.
+
+"""
+from sys import intern
+from typing import Optional
+
+
+def _interned(value: Optional[str]) -> Optional[str]:
+    return None if value is None else intern(value)
+
+
+def _interned_tuple(values: Optional[list]) -> tuple:
+    return tuple(intern(value) for value in values) if values else ()
+
+
+def _int(value: Optional[str]) -> Optional[int]:
+    # The api sends int64 values as strings.
+    return None if value is None else int(value)
+
+
+class _Record:
+    """Base class for the records. Subclasses set __slots__ and _API_FIELDS."""
+
+    __slots__ = ()
+
+    # (attribute, api field name, converter) for every slot.
+    _API_FIELDS = ()
+
+    def __init__(self, **kwargs):
+        for attribute, _, convert in self._API_FIELDS:
+            value = kwargs.get(attribute)
+            setattr(self, attribute, convert(value) if convert and value is not None else value)
+
+    @classmethod
+    def fields(cls) -> str:
+        """
+        The partial response selector for one item, e.g. "id,name,mimeType".
+
+        Returns:
+            str: Comma separated api field names.
+
+        """
+        return ','.join(api_name for _, api_name, _ in cls._API_FIELDS)
+
+    @classmethod
+    def from_api(cls, data: dict) -> '_Record':
+        """
+        Build a record from an item of an api response.
+
+        Args:
+            data (dict): Item as returned by the api.
+
+        Returns:
+            _Record: The record.
+
+        """
+        record = cls.__new__(cls)
+        for attribute, api_name, convert in cls._API_FIELDS:
+            value = data.get(api_name)
+            setattr(record, attribute, convert(value) if convert else value)
+        return record
+
+    def to_dict(self) -> dict:
+        """
+        Turn the record back into an api style dict. Fields that are not set are left out.
+
+        Returns:
+            dict: Item keyed by api field names.
+
+        """
+        data = {}
+        for attribute, api_name, _ in self._API_FIELDS:
+            value = getattr(self, attribute)
+            if value is None:
+                continue
+            if isinstance(value, tuple):
+                value = list(value)
+            elif isinstance(value, int) and not isinstance(value, bool):
+                value = str(value)
+            data[api_name] = value
+        return data
+
+    def __getitem__(self, api_name: str):
+        # Lets code written against the raw dicts keep using record['id'], record['mimeType'], ...
+        for attribute, name, _ in self._API_FIELDS:
+            if name == api_name:
+                return getattr(self, attribute)
+        raise KeyError(api_name)
+
+    def _values(self) -> tuple:
+        return tuple(getattr(self, attribute) for attribute, _, _ in self._API_FIELDS)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __hash__(self):
+        # Consistent with __eq__, so records can go in sets and be used as dict keys. Don't change a record while it
+        # is in one.
+        return hash((type(self), self._values()))
+
+    def __repr__(self):
+        return f"{type(self).__name__}(id={self.id!r}, name={self.name!r})"
+
+
+class FileRecord(_Record):
+    """A Drive file."""
+
+    __slots__ = ('id', 'name', 'mime_type', 'parents', 'drive_id', 'modified_time', 'size', 'md5_checksum')
+
+    _API_FIELDS = (('id', 'id', None),
+                   ('name', 'name', None),
+                   ('mime_type', 'mimeType', _interned),
+                   ('parents', 'parents', _interned_tuple),
+                   ('drive_id', 'driveId', _interned),
+                   ('modified_time', 'modifiedTime', None),
+                   ('size', 'size', _int),
+                   ('md5_checksum', 'md5Checksum', None))
+
+
+class FolderRecord(_Record):
+    """A Drive folder."""
+
+    __slots__ = ('id', 'name', 'mime_type', 'parents', 'drive_id', 'modified_time')
+
+    _API_FIELDS = (('id', 'id', None),
+                   ('name', 'name', None),
+                   ('mime_type', 'mimeType', _interned),
+                   ('parents', 'parents', _interned_tuple),
+                   ('drive_id', 'driveId', _interned),
+                   ('modified_time', 'modifiedTime', None))
+
+
+class DriveRecord(_Record):
+    """A shared drive."""
+
+    __slots__ = ('id', 'name', 'created_time', 'hidden')
+
+    _API_FIELDS = (('id', 'id', None),
+                   ('name', 'name', None),
+                   ('created_time', 'createdTime', None),
+                   ('hidden', 'hidden', None))
@@ -1,21 +1,356 @@
 """
 Functions for interact with Google Drive
 
+The Google client libraries are only imported the first time a service is needed, and services are built from the
+discovery documents pinned in discovery/ so building one never goes over the network.
+
 """
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Union
+from typing import Callable, Optional, Union
+import datetime
+import errno
+import hashlib
+import json
+import mimetypes
 import pickle
 import os.path
-from pprint import pprint
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from apiclient import errors
+import random
+import socket
+import ssl
+import threading
+import time
+try:
+    import drive_cache
+    import drive_metrics
+    import drive_name_index
+    import drive_records
+except ModuleNotFoundError:
+    from google_drive_tools import drive_cache
+    from google_drive_tools import drive_metrics
+    from google_drive_tools import drive_name_index
+    from google_drive_tools import drive_records
 
 # TODO change all none domain to my_
 # TODO search for folders as files and seperate functions for folders as drives
 
+# Discovery documents for the apis used here. Refresh them when a newer api revision is needed.
+DISCOVERY_DIR = Path(__file__).parent / 'discovery'
+
+# Cache for read-only api calls. Disabled until set_response_cache() is called.
+_response_cache = None
+
+# Name index for find-or-create lookups. Disabled until set_name_index() is called.
+_name_index = None
+
+# Where api calls are reported. The default does nothing.
+_instrumentation = drive_metrics.Instrumentation()
+
+# Read-only calls whose answer moves on without the resource changing, so they are never cached.
+UNCACHED_METHODS = ('drive.changes.list', 'drive.changes.getStartPageToken')
+
+# Responses that are worth retrying when a request is executed with num_retries.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Drive answers some rate limits, sharing in particular, with a 403 instead of a 429. These reasons are retried too.
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'sharingRateLimitExceeded')
+
+# Pace of permission changes. Drive throttles sharing well below its general request quota.
+SHARING_REQUESTS_PER_SECOND = 10
+
+# Credentials are loaded once per process, services are built once per thread because httplib2 is not thread safe.
+_creds = None
+_creds_lock = threading.Lock()
+_services = threading.local()
+
+# Identity (see drive_identities) the current thread sends its requests as. None means google_creds().
+_identity = threading.local()
+
+# Identity of threads that never called use_identity. Set with set_default_identity().
+_default_identity = None
+
+# Makes the http object services send requests through. None means an authorized httplib2.Http for google_creds().
+_transport = None
+
+
+def set_response_cache(cache: Optional[drive_cache.ResponseCache]) -> None:
+    """
+    Turn on caching of read-only api calls (files.list, files.get, drives.list, ...). Pass None to turn it off.
+
+    Args:
+        cache (ResponseCache): Cache that responses are stored in.
+
+    """
+    global _response_cache
+    _response_cache = cache
+
+
+def set_name_index(index: Optional[drive_name_index.NameIndex]) -> None:
+    """
+    Answer name lookups (find_my_folder_by_name_by_searching_files, find_child_by_name) for names that are
+    definitely absent from a Bloom filter instead of the api. Items created through this module are added to the
+    filters as they are created. Pass None to turn it off.
+
+    Args:
+        index (NameIndex): e.g. drive_name_index.NameIndex().
+
+    """
+    global _name_index
+    _name_index = index
+
+
+def set_instrumentation(instrumentation: Optional[drive_metrics.Instrumentation]) -> None:
+    """
+    Report latency, bytes, pages, retries, cache lookups and build times of every api call to instrumentation.
+    Pass None to go back to the no-op default.
+
+    Args:
+        instrumentation (Instrumentation): e.g. drive_metrics.MetricsRecorder().
+
+    """
+    global _instrumentation
+    _instrumentation = instrumentation or drive_metrics.Instrumentation()
+
+
+def set_transport(transport: Optional[Callable[[], object]]) -> None:
+    """
+    Send every api request through http objects made by transport instead of the network, e.g. the http method of a
+    drive_fake.FakeDrive. Services built before the switch are dropped. Pass None to go back to Google.
+
+    Args:
+        transport (callable): Called without arguments once per service, returns an httplib2.Http like object.
+
+    """
+    global _transport
+    _transport = transport
+    reset_services()
+
+
+def reset_services() -> None:
+    """
+    Drop every service built so far, so the next call builds new ones. A process forked from one that already used
+    the api has to call this before its first request, otherwise parent and child share the same connections.
+
+    """
+    global _services
+    _services = threading.local()
+
+
+@lru_cache(maxsize=None)
+def _request_builder() -> type:
+    """
+    Build the HttpRequest class used by every service.
+
+    GET requests are served from the response cache when one is set. A stale cache entry with an ETag is revalidated
+    with If-None-Match so an unchanged response is not downloaded again. Any other request (create, delete,
+    update, ...) invalidates the cached responses of the same api. Every request that goes over the wire is reported
+    to the instrumentation, and retried with exponential backoff on RETRY_STATUSES and on transport errors (connection
+    resets, timeouts, ...) when num_retries is set.
+
+    Returns:
+        type: HttpRequest subclass.
+
+    """
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import HttpRequest
+
+    class _HttpRequest(HttpRequest):
+
+        # Set on requests of services built for an identity, which paces them and is told about throttling.
+        identity = None
+
+        def execute(self, http=None, num_retries=0):
+            cache = _response_cache
+            if cache is None or self.methodId in UNCACHED_METHODS:
+                return self._send(http, num_retries)
+
+            if self.method != 'GET':
+                response = self._send(http, num_retries)
+                cache.invalidate(self.methodId.split('.')[0] + '.')
+                return response
+
+            identity = None if self.identity is None else self.identity.name
+            key = drive_cache.cache_key(self.methodId, self.uri, identity)
+            entry = cache.get(key)
+            if entry is not None:
+                if cache.is_fresh(entry):
+                    _instrumentation.record_cache(self.methodId, True)
+                    return entry.body
+                if entry.etag:
+                    self.headers['If-None-Match'] = entry.etag
+            _instrumentation.record_cache(self.methodId, False)
+
+            headers = {}
+            self.add_response_callback(headers.update)
+            try:
+                response = self._send(http, num_retries)
+            except HttpError as error:
+                if entry is not None and error.resp.status == 304:
+                    cache.touch(key)
+                    return entry.body
+                raise
+
+            cache.set(key, response, headers.get('etag'))
+            return response
+
+        def _send(self, http, num_retries):
+            metrics = _instrumentation
+            received = []
+            if metrics.enabled:
+                postproc = self.postproc
+
+                def measured(resp, content):
+                    received.append(len(content or b''))
+                    return postproc(resp, content)
+
+                self.postproc = measured
+
+            attempt = 0
+            while True:
+                if self.identity is not None:
+                    self.identity.acquire()
+                started = time.perf_counter()
+                try:
+                    response = super().execute(http=http)
+                except HttpError as error:
+                    if metrics.enabled:
+                        metrics.record_call(self.methodId, time.perf_counter() - started, self._body_bytes(),
+                                            len(error.content or b''), error.resp.status)
+                    if self.identity is not None and _retryable(error):
+                        self.identity.throttled()
+                    if attempt < num_retries and _retryable(error):
+                        attempt += 1
+                        metrics.record_retry(self.methodId)
+                        _backoff(attempt)
+                        continue
+                    raise
+                except Exception as error:
+                    if not _transport_error(error):
+                        raise
+                    if metrics.enabled:
+                        metrics.record_call(self.methodId, time.perf_counter() - started, self._body_bytes(), 0, 0)
+                    if attempt < num_retries:
+                        attempt += 1
+                        metrics.record_retry(self.methodId)
+                        _backoff(attempt)
+                        continue
+                    raise
+
+                if metrics.enabled:
+                    metrics.record_call(self.methodId, time.perf_counter() - started, self._body_bytes(),
+                                        sum(received), 200)
+                    if self.methodId.endswith('.list'):
+                        metrics.record_page(self.methodId)
+                return response
+
+        def _body_bytes(self):
+            if self.resumable is not None:
+                return self.resumable.size() or 0
+            return len(self.body or b'')
+
+    return _HttpRequest
+
+
+@lru_cache(maxsize=None)
+def _discovery_document(api: str, version: str) -> str:
+    with open(DISCOVERY_DIR / f'{api}.{version}.json') as document:
+        return document.read()
+
+
+def _build_service(api: str, version: str) -> object:
+    """
+    Build an api service from its pinned discovery document. Services are reused within a thread, one per identity
+    when the thread uses one (see use_identity).
+
+    Args:
+        api (str): Api name, e.g. "drive".
+        version (str): Api version, e.g. "v3".
+
+    Returns:
+        object: Api service instance.
+
+    """
+    identity = current_identity()
+    name = f'{api}_{version}' if identity is None else f'{api}_{version}_{identity.name}'
+    service = getattr(_services, name, None)
+    if service is None:
+        from googleapiclient.discovery import build_from_document
+
+        if _transport is not None:
+            auth = {'http': _transport()}
+        else:
+            auth = {'credentials': _credentials(identity)}
+
+        request_builder = _request_builder()
+        if identity is not None:
+            request_class = request_builder
+
+            def request_builder(*args, **kwargs):
+                request = request_class(*args, **kwargs)
+                request.identity = identity
+                return request
+
+        started = time.perf_counter()
+        service = build_from_document(_discovery_document(api, version),
+                                      requestBuilder=request_builder,
+                                      **auth)
+        _instrumentation.record_build(f'{api}.{version}', time.perf_counter() - started)
+        setattr(_services, name, service)
+
+    return service
+
+
+def _credentials(identity: Optional[object]) -> object:
+    # Credentials the requests of identity are sent with. An identity without credentials sends as google_creds().
+    if identity is not None and identity.credentials is not None:
+        return identity.credentials
+    return google_creds()
+
+
+def current_identity() -> Optional[object]:
+    """
+    The identity requests of the current thread are sent as.
+
+    Returns:
+        Identity: The identity, None for the default google_creds() user.
+
+    """
+    return getattr(_identity, 'identity', _default_identity)
+
+
+def set_default_identity(identity: Optional[object]) -> None:
+    """
+    Send the requests of every thread that does not pick its own identity with use_identity as identity. Threads
+    started by the library itself are included, so one identity's rate limit then paces the whole process. An
+    identity without credentials sends as the google_creds() user. Pass None to turn it off.
+
+    Args:
+        identity (Identity): Identity to use.
+
+    """
+    global _default_identity
+    _default_identity = identity
+
+
+@contextmanager
+def use_identity(identity: Optional[object]):
+    """
+    Send every request made by this thread inside the block as identity, with its own services and rate limit. See
+    drive_identities.Identity and drive_identities.CredentialsPool, None goes back to google_creds().
+
+    Args:
+        identity (Identity): Identity to use.
+
+    """
+    previous = current_identity()
+    _identity.identity = identity
+    try:
+        yield identity
+    finally:
+        _identity.identity = previous
+
 
 def google_creds() -> object:
     """
@@ -24,31 +359,44 @@ def google_creds() -> object:
        Returns:
 
        """
-    # If modifying these scopes, delete the file token.pickle.
-    SCOPES = ['https://www.googleapis.com/auth/drive.file',
-              'https://www.googleapis.com/auth/drive',
-              'https://www.googleapis.com/auth/drive.activity',
-              'https://www.googleapis.com/auth/spreadsheets'
-              ]
-
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+    global _creds
+
+    with _creds_lock:
+        if _creds and _creds.valid:
+            return _creds
+
+        started = time.perf_counter()
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.auth.transport.requests import Request
+
+        # If modifying these scopes, delete the file token.pickle.
+        SCOPES = ['https://www.googleapis.com/auth/drive.file',
+                  'https://www.googleapis.com/auth/drive',
+                  'https://www.googleapis.com/auth/drive.activity',
+                  'https://www.googleapis.com/auth/spreadsheets'
+                  ]
+
+        creds = _creds
+        # The file token.pickle stores the user's access and refresh tokens, and is
+        # created automatically when the authorization flow completes for the first
+        # time.
+        if not creds and os.path.exists('token.pickle'):
+            with open('token.pickle', 'rb') as token:
+                creds = pickle.load(token)
+        # If there are no (valid) credentials available, let the user log in.
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    'credentials.json', SCOPES)
+                creds = flow.run_local_server(port=0)
+            # Save the credentials for the next run
+            with open('token.pickle', 'wb') as token:
+                pickle.dump(creds, token)
+
+        _creds = creds
+        _instrumentation.record_build('credentials', time.perf_counter() - started)
 
     return creds
 
@@ -61,7 +409,7 @@ def drive_service() -> object:
         object: Drive API service instance.
 
     """
-    g_drive_service = build('drive', 'v3', credentials=google_creds())
+    g_drive_service = _build_service('drive', 'v3')
 
     return g_drive_service
 
@@ -74,36 +422,318 @@ def sheets_service() -> object:
         object: Google Sheets API service instance.
 
     """
-    g_sheets_service = build('sheets', 'v4', credentials=google_creds())
+    g_sheets_service = _build_service('sheets', 'v4')
 
     return g_sheets_service
 
 
 def no_cache_discovery_service():
-    service = build('drive', 'v3', credentials=google_creds(), cache_discovery=False)
-    return service
+    # Services are always built from the pinned discovery documents now, so there is no discovery cache to skip.
+    return drive_service()
+
+
+def _backoff(attempt: int):
+    # Wait before retry number attempt, with jitter so parallel callers don't retry in lockstep.
+    time.sleep(min(2 ** attempt, 32) * random.uniform(0.5, 1))
+
+
+def _transport_error(error) -> bool:
+    """Whether an exception raised while sending a request is a network hiccup worth retrying. These are the errors
+    googleapiclient retries itself when it is given num_retries."""
+    import httplib2
+
+    if isinstance(error, (ssl.SSLError, socket.timeout, ConnectionError, httplib2.ServerNotFoundError)):
+        return True
+    return isinstance(error, OSError) and errno.errorcode.get(error.errno) in ('WSAETIMEDOUT', 'ETIMEDOUT', 'EPIPE',
+                                                                             'ECONNABORTED')
 
 
-def list_my_folders_by_searching_files() -> list:
+def _retryable(error) -> bool:
+    """Whether an HttpError is a rate limit or a server side hiccup that is worth retrying."""
+    if error.resp.status in RETRY_STATUSES:
+        return True
+    if error.resp.status != 403:
+        return False
+    try:
+        content = error.content.decode() if isinstance(error.content, bytes) else error.content
+        errors = json.loads(content)['error']['errors']
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+    return any(detail.get('reason') in RATE_LIMIT_REASONS for detail in errors)
+
+
+class RateLimiter:
+    """Token bucket shared by the threads sending requests."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """Start with a full bucket.
+
+        :param rate: Requests per second.
+        :type rate: float
+        :param burst: Requests that may go out at once. Defaults to one second worth of requests.
+        :type burst: float
+        """
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def available(self) -> float:
+        """Tokens in the bucket right now, negative while the bucket is paying off a debt."""
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def acquire(self, count: int = 1):
+        """Take count tokens, sleeping until the bucket has paid for them."""
+        with self._lock:
+            self._refill()
+            # Going into debt lets a batch larger than the bucket through, the wait pays it back.
+            self._tokens -= count
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def _execute_in_batches(make_request: Callable[[object, object], object],
+                        keys: list,
+                        jobs: int = 4,
+                        batch_size: int = 100,
+                        num_retries: int = 5,
+                        limiter: Optional['RateLimiter'] = None,
+                        read_only: bool = False) -> tuple:
+    """
+    Send one Drive request per key through batch requests. Batches run concurrently, each thread with its own service.
+    Requests answered with one of RETRY_STATUSES or RATE_LIMIT_REASONS are sent again in a later batch, with
+    exponential backoff.
+
+    Args:
+        make_request (callable): Called with a Drive service and a key, returns the HttpRequest for that key.
+        keys (list): One request is sent per key.
+        jobs (int): Number of batches in flight at once.
+        batch_size (int): Requests per batch. The api allows at most 100.
+        num_retries (int): How often a failed request is retried.
+        limiter (RateLimiter): Paces the requests, every request of a batch takes a token before the batch is sent.
+        read_only (bool): The requests change nothing, so the response cache is left alone.
+
+    Returns:
+        tuple: (responses, errors). responses maps the keys that succeeded to their response, errors maps the keys
+            that failed to the last HttpError.
+
+    """
+    from googleapiclient.errors import HttpError
+
+    responses = {}
+    errors = {}
+    lock = threading.Lock()
+    # The worker threads send as the caller's identity.
+    identity = current_identity()
+
+    def run(chunk):
+        with use_identity(identity):
+            send(chunk)
+
+    def send(chunk):
+        service = drive_service()
+        pending = list(chunk)
+        attempt = 0
+        while pending:
+            outcome = {}
+            batch = service.new_batch_http_request()
+            for index, key in enumerate(pending):
+                batch.add(make_request(service, key),
+                          callback=lambda request_id, response, error: outcome.__setitem__(request_id,
+                                                                                          (response, error)),
+                          request_id=str(index))
+
+            if limiter is not None:
+                limiter.acquire(len(pending))
+            if identity is not None:
+                identity.acquire(len(pending))
+            started = time.perf_counter()
+            try:
+                batch.execute()
+            except HttpError as error:
+                # The whole batch was rejected.
+                outcome = {str(index): (None, error) for index in range(len(pending))}
+                if identity is not None and _retryable(error):
+                    identity.throttled()
+            if _instrumentation.enabled:
+                _instrumentation.record_call('drive.batch', time.perf_counter() - started, 0, 0, 200)
+
+            retry = []
+            for index, key in enumerate(pending):
+                response, error = outcome.get(str(index), (None, None))
+                if error is None:
+                    with lock:
+                        responses[key] = response
+                elif attempt < num_retries and _retryable(error):
+                    retry.append(key)
+                else:
+                    with lock:
+                        errors[key] = error
+
+            pending = retry
+            if pending:
+                attempt += 1
+                _instrumentation.record_retry('drive.batch')
+                _backoff(attempt)
+
+    chunks = [keys[start:start + batch_size] for start in range(0, len(keys), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        list(executor.map(run, chunks))
+
+    # Batches don't go through the request class, so drop what the response cache knows about Drive ourselves.
+    if _response_cache is not None and keys and not read_only:
+        _response_cache.invalidate('drive.')
+
+    return responses, errors
+
+
+def _parse_time(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _format_time(value: datetime.datetime) -> str:
+    value = value.astimezone(datetime.timezone.utc)
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + f'{value.microsecond // 1000:03d}Z'
+
+
+def list_files_in_parallel(query: Optional[str] = None,
+                           field: str = 'modifiedTime',
+                           partitions: int = 8,
+                           jobs: int = 8,
+                           split_after_pages: int = 3,
+                           fields: str = '*',
+                           page_size: int = 1000,
+                           **list_arguments) -> list:
+    """
+    List everything matching a files.list query with several cursors at once. The query is split into disjoint
+    ranges of field (modifiedTime or createdTime) that are listed concurrently, each ordered by field. A range that
+    is still going after split_after_pages pages is cut where its cursor got to, and the rest is split in two new
+    ranges, so busy stretches of time end up with more cursors. Items are deduplicated by id when the ranges are
+    merged.
+
+    Args:
+        query (str): files.list query, e.g. "mimeType = 'application/vnd.google-apps.folder'".
+        field (str): Timestamp field the ranges are made of, modifiedTime or createdTime.
+        partitions (int): Number of ranges to start with.
+        jobs (int): Number of ranges listed at once.
+        split_after_pages (int): Pages a range may take before its remainder is split.
+        fields (str): Fields of each item, e.g. "id,name". field is always added.
+        page_size (int): Items per page.
+        **list_arguments: Passed on to files.list, e.g. corpora, driveId, spaces.
+
+    Returns:
+        list: Dicts of the items, in no particular order.
+
+    """
+    if fields != '*' and field not in fields.split(','):
+        fields = f'{fields},{field}'
+    selector = f"nextPageToken, files({fields})"
+
+    def bounded(lower, upper):
+        bounds = [f"{field} >= '{_format_time(lower)}'" if lower else None,
+                  f"{field} < '{_format_time(upper)}'" if upper else None]
+        return ' and '.join(f'({part})' for part in [query] + bounds if part) or None
+
+    def list_range(lower, upper):
+        """List one range. Returns its items and, if it got split, the ranges that are left."""
+        service = drive_service()
+        items = []
+        page_token = None
+        pages = 0
+        while True:
+            response = service.files().list(q=bounded(lower, upper), orderBy=field, fields=selector,
+                                            pageSize=page_size, pageToken=page_token,
+                                            **list_arguments).execute(num_retries=5)
+            items.extend(response.get('files', []))
+            page_token = response.get('nextPageToken')
+            pages += 1
+            if not page_token:
+                return items, []
+            if not items:
+                # Drive can answer with an empty page that still has a nextPageToken, there is nothing to cut at yet.
+                continue
+
+            reached = _parse_time(items[-1][field])
+            end = upper or datetime.datetime.now(datetime.timezone.utc)
+            # Only split once the cursor moved past the start, a stretch of items sharing one timestamp can't be cut.
+            moved = lower is None or reached > lower
+            if pages >= split_after_pages and moved and end - reached > datetime.timedelta(seconds=2):
+                middle = reached + (end - reached) / 2
+                # Items at exactly reached are listed again by the first new range and dropped at the merge.
+                return items, [(reached, middle), (middle, upper)]
+
+    # Spread the first ranges between the oldest item and now.
+    oldest = drive_service().files().list(q=query, orderBy=field, fields=f"files({field})", pageSize=1,
+                                          **list_arguments).execute(num_retries=5).get('files')
+    if not oldest:
+        return []
+    start = _parse_time(oldest[0][field])
+    step = (datetime.datetime.now(datetime.timezone.utc) - start) / max(partitions, 1)
+    edges = [start + step * index for index in range(1, max(partitions, 1))]
+    ranges = list(zip([None] + edges, edges + [None]))
+
+    merged = {}
+    # The worker threads send as the caller's identity.
+    identity = current_identity()
+
+    def run(lower, upper):
+        with use_identity(identity):
+            return list_range(lower, upper)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        running = {executor.submit(run, lower, upper) for lower, upper in ranges}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                items, rest = future.result()
+                for item in items:
+                    merged.setdefault(item['id'], item)
+                running.update(executor.submit(run, lower, upper) for lower, upper in rest)
+
+    return list(merged.values())
+
+
+def list_my_folders_by_searching_files(as_records: bool = False, jobs: int = 1) -> list:
     """
     Creates a list of all the folders that api Oauth user owns.
 
+    Args:
+        as_records (bool): Only request the fields a FolderRecord holds and return FolderRecords instead of dicts.
+        jobs (int): List with this many cursors at once, see list_files_in_parallel. The folders are then in no
+            particular order.
+
     Returns:
-        list: List of folders. Each folder returns a dict of data.
+        list: List of folders. Each folder returns a dict of data, or a FolderRecord if as_records is set.
 
     """
+    if jobs > 1:
+        folders = list_files_in_parallel("mimeType = 'application/vnd.google-apps.folder'", jobs=jobs,
+                                         partitions=jobs, spaces='drive',
+                                         fields=drive_records.FolderRecord.fields() if as_records else '*')
+        return [drive_records.FolderRecord.from_api(folder) for folder in folders] if as_records else folders
+
     page_token = None
     getting_files = True
     my_folders = []  # all the folders i have access to
+    fields = f"nextPageToken, files({drive_records.FolderRecord.fields()})" if as_records else "*"
 
     while getting_files:
         if not page_token:
             response = drive_service().files().list(q="mimeType = 'application/vnd.google-apps.folder'",
-                                                    fields="*",
+                                                    fields=fields,
                                                     spaces='drive').execute()
         else:
             response = drive_service().files().list(q="mimeType = 'application/vnd.google-apps.folder'",
-                                                    fields="*",
+                                                    fields=fields,
                                                     spaces='drive',
                                                     pageToken=page_token).execute()
 
@@ -114,24 +744,31 @@ def list_my_folders_by_searching_files() -> list:
             page_token = response["nextPageToken"]
 
         folders = response['files']  # Drive api refers to files and folders as files.
+        if as_records:
+            folders = map(drive_records.FolderRecord.from_api, folders)
         for folder in folders:
             my_folders.append(folder)
 
     return my_folders
 
 
-def list_domain_folders_by_searching_files() -> list:
+def list_domain_folders_by_searching_files(as_records: bool = False) -> list:
     """
     Creates a list of all the domain shared folders that api Oauth user has access to.
 
+    Args:
+        as_records (bool): Only request the fields a FolderRecord holds and return FolderRecords instead of dicts.
+
     Returns:
-        list: List of domain shared folders. Each folder returns a dict of data.
+        list: List of domain shared folders. Each folder returns a dict of data, or a FolderRecord if as_records is
+            set.
 
     """
 
     page_token = None
     getting_files = True
     domain_folders = []  # all the domain shared folders i have access to.
+    fields = f"nextPageToken, files({drive_records.FolderRecord.fields()})" if as_records else "*"
 
     while getting_files:
         if not page_token:
@@ -139,14 +776,14 @@ def list_domain_folders_by_searching_files() -> list:
                                                                  supportsAllDrives=True,
                                                                  includeItemsFromAllDrives=True,
                                                                  corpora='allDrives',
-                                                                 fields="*",
+                                                                 fields=fields,
                                                                  ).execute()
         else:
             response = no_cache_discovery_service().files().list(q="mimeType = 'application/vnd.google-apps.folder'",
                                                                  supportsAllDrives=True,
                                                                  includeItemsFromAllDrives=True,
                                                                  corpora='allDrives',
-                                                                 fields="*",
+                                                                 fields=fields,
                                                                  pageToken=page_token
                                                                  ).execute()
 
@@ -157,34 +794,41 @@ def list_domain_folders_by_searching_files() -> list:
             page_token = response["nextPageToken"]
 
         folders = response['files']
+        if as_records:
+            folders = map(drive_records.FolderRecord.from_api, folders)
         for folder in folders:
             domain_folders.append(folder)
 
     return domain_folders
 
 
-def list_domain_folders_by_searching_drives():
+def list_domain_folders_by_searching_drives(as_records: bool = False) -> list:
     """
     Creates a list of all the domain shared folders that api Oauth user has access to.
 
+    Args:
+        as_records (bool): Only request the fields a DriveRecord holds and return DriveRecords instead of dicts.
+
     Returns:
-        list: List of domain shared folders. Each folder returns a dict of data.
+        list: List of domain shared folders. Each folder returns a dict of data, or a DriveRecord if as_records is
+            set.
 
     """
 
     page_token = None
     getting_files = True
     domain_folders = []  # all the domain shared folders i have access to.
+    fields = f"nextPageToken, drives({drive_records.DriveRecord.fields()})" if as_records else "*"
 
     while getting_files:
         if not page_token:
             # TODO test with and with out fields
             response = no_cache_discovery_service().drives().list(useDomainAdminAccess=True,
-                                                                  fields="*",
+                                                                  fields=fields,
                                                                   ).execute()
         else:
             response = no_cache_discovery_service().drives().list(useDomainAdminAccess=True,
-                                                                  fields="*",
+                                                                  fields=fields,
                                                                   pageToken=page_token
                                                                   ).execute()
 
@@ -195,17 +839,66 @@ def list_domain_folders_by_searching_drives():
             page_token = response["nextPageToken"]
 
         folders = response['drives']
+        if as_records:
+            folders = map(drive_records.DriveRecord.from_api, folders)
         for folder in folders:
             domain_folders.append(folder)
 
     return domain_folders
 
 
+def _index_scope(scope: str) -> str:
+    # Identities see different items, and "root" is a different folder for each of them, so they get their own
+    # filters.
+    identity = current_identity()
+    return scope if identity is None else f'{identity.name}:{scope}'
+
+
+def _index_says_absent(scope: str, name: str, query: str) -> bool:
+    """
+    Whether the name index knows that name is not in scope, listing the names matching query to build the scope's
+    filter first if it has none. Always False without an index. scope comes from _index_scope.
+
+    """
+    index = _name_index
+    if index is None:
+        return False
+    if index.needs_build(scope):
+        def names():
+            page_token = None
+            while True:
+                response = drive_service().files().list(q=query,
+                                                        fields="nextPageToken, files(name)",
+                                                        pageSize=1000,
+                                                        pageToken=page_token,
+                                                        supportsAllDrives=True,
+                                                        includeItemsFromAllDrives=True).execute(num_retries=5)
+                yield from (item['name'] for item in response['files'])
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    return
+
+        # The listing runs inside build, which keeps what other threads create meanwhile.
+        index.build(scope, names())
+    return index.might_contain(scope, name) is False
+
+
+def _index_created(name: str, parent_id: Optional[str], mime_type: Optional[str] = None):
+    index = _name_index
+    if index is not None:
+        index.add(_index_scope(parent_id or 'root'), name)
+        if mime_type == 'application/vnd.google-apps.folder':
+            index.add(_index_scope(drive_name_index.ALL_FOLDERS), name)
+
+
 def find_my_folder_by_name_by_searching_files(folder_name: str) -> Union[bool, dict]:
     """
     Search through all the folders that the Oauth user owns. If the folder_name is found it returns a dict of
     data about the folder.
 
+    With a name index (see set_name_index) a name that is definitely absent is answered without a request, and a
+    possible hit is checked with a single query instead of a scan of every folder.
+
     Args:
         folder_name: Name of the Google Drive folder.
 
@@ -213,6 +906,19 @@ def find_my_folder_by_name_by_searching_files(folder_name: str) -> Union[bool, d
         bool, dict: If folder_name is found it returns a dict. If the folder name is not found it returns False.
 
     """
+    if _name_index is not None:
+        scope = _index_scope(drive_name_index.ALL_FOLDERS)
+        folder_query = "mimeType = 'application/vnd.google-apps.folder'"
+        if _index_says_absent(scope, folder_name, folder_query):
+            return False
+        response = drive_service().files().list(q=f"name = '{_quote(folder_name)}' and {folder_query}",
+                                                fields="*").execute(num_retries=5)
+        for folder in response['files']:
+            if folder['name'] == folder_name:
+                return folder
+        _name_index.false_positive(scope)
+        return False
+
     page_token = None
     getting_files = True
     folder_data = False
@@ -241,6 +947,40 @@ def find_my_folder_by_name_by_searching_files(folder_name: str) -> Union[bool, d
     return folder_data
 
 
+def find_child_by_name(name: str, parent_id: str = 'root', mime_type: Optional[str] = None) -> Union[bool, dict]:
+    """
+    Find an item by name directly inside a folder, the lookup half of find-or-create. With a name index (see
+    set_name_index) the folder's names are listed once, and names that are definitely absent are answered without
+    a request.
+
+    Args:
+        name (str): Name of the item.
+        parent_id (str): Id of the folder to look in.
+        mime_type (str): Only match items of this type, e.g. "application/vnd.google-apps.folder".
+
+    Returns:
+        bool, dict: id, name, mimeType and parents of the item. False if there is no such item.
+
+    """
+    scope = _index_scope(parent_id)
+    children = f"'{parent_id}' in parents and trashed = false"
+    if _index_says_absent(scope, name, children):
+        return False
+
+    response = drive_service().files().list(q=f"name = '{_quote(name)}' and {children}",
+                                            fields="files(id,name,mimeType,parents)",
+                                            supportsAllDrives=True,
+                                            includeItemsFromAllDrives=True,
+                                            pageSize=100).execute(num_retries=5)
+    named = [item for item in response['files'] if item['name'] == name]
+    if not named and _name_index is not None:
+        _name_index.false_positive(scope)
+    for item in named:
+        if mime_type is None or item['mimeType'] == mime_type:
+            return item
+    return False
+
+
 def find_domain_folder_by_name_by_searching_files(folder_name: str) -> Union[bool, dict]:
     """
     Search through all the domain folders that the Oauth user has access to. If the folder_name is found it returns a
@@ -424,36 +1164,300 @@ def find_file_by_name(file_name: str) -> Union[bool, dict]:
     return file_data
 
 
-def upload_csv_to_drive(csv_path: str, csv_name: str, folder_id: Optional[str] = None) -> str:
+def _quote(value: str) -> str:
+    """Escape a value for use inside single quotes in a files.list query."""
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+@lru_cache(maxsize=4096)
+def _md5_of(path: str, modified_ns: int, size: int, chunk_size: int) -> str:
+    # modified_ns and size are part of the cache key only, a changed file is hashed again.
+    digest = hashlib.md5()
+    with open(path, 'rb') as content:
+        for chunk in iter(lambda: content.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_md5(path: Union[str, Path], chunk_size: int = 1024 * 1024) -> str:
+    """
+    md5 of a local file, as Drive reports it in md5Checksum. The file is read in chunks, and the result is cached
+    by path, modification time and size, so hashing an unchanged file again is free.
+
+    Args:
+        path (str): Path of the file.
+        chunk_size (int): Bytes read at a time.
+
+    Returns:
+        str: Hex digest.
+
+    """
+    stat = os.stat(path)
+    return _md5_of(os.path.realpath(path), stat.st_mtime_ns, stat.st_size, chunk_size)
+
+
+# Modes of upload_csv_to_drive.
+UPLOAD_CREATE = 'create'
+UPLOAD_UPDATE = 'update'
+UPLOAD_SKIP_IDENTICAL = 'skip'
+
+# Files up to this size are sent in one multipart request, larger ones in resumable chunks of UPLOAD_CHUNK_SIZE.
+SIMPLE_UPLOAD_LIMIT = 5 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 256 * 1024
+
+# Drive refuses to convert bigger csv files to a spreadsheet.
+SHEET_CONVERSION_LIMIT = 100 * 1024 * 1024
+
+SPREADSHEET_MIME_TYPE = 'application/vnd.google-apps.spreadsheet'
+
+
+@lru_cache(maxsize=None)
+def _gzip_upload() -> type:
+    """
+    Build the MediaUpload class that gzips a local file while it is uploaded.
+
+    The compressed size is not known up front, so chunks are sent with an open ended Content-Range until the file
+    is read to the end. Only the part of the compressed stream that has not been acknowledged yet is kept in memory,
+    which is a chunk and a bit. The file always compresses to the same bytes, so an upload restored with
+    MediaUpload.new_from_json compresses it again and skips what the server already has.
+
+    Returns:
+        type: MediaUpload subclass.
+
+    """
+    from googleapiclient.http import MediaUpload
+    import zlib
+
+    class _GzipUpload(MediaUpload):
+
+        def __init__(self, path, chunksize, read_size=256 * 1024):
+            self._path = str(path)
+            self._file = open(path, 'rb')
+            self._chunksize = chunksize
+            self._read_size = read_size
+            # wbits 31 writes a gzip header. Its mtime is left at 0 so the same file always compresses the same.
+            self._compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+            self._buffer = bytearray()
+            self._start = 0
+            self._keep_from = 0
+            self._served = 0
+            self._total = None
+
+        def chunksize(self):
+            return self._chunksize
+
+        def mimetype(self):
+            return 'application/gzip'
+
+        def resumable(self):
+            return True
+
+        def has_stream(self):
+            return False
+
+        def size(self):
+            # Called before every chunk. Looking one byte past the next chunk tells whether it is the last one,
+            # so its Content-Range carries the total and the upload is finished without an empty request.
+            self._fill(self._served + self._chunksize + 1)
+            return self._total
+
+        def getbytes(self, begin, length):
+            # The server acknowledged everything before begin, it is not asked for again.
+            self._keep_from = begin
+            self._trim()
+            self._fill(begin + length + 1)
+            self._served = begin + min(length, len(self._buffer))
+            return bytes(self._buffer[:length])
+
+        def _trim(self):
+            cut = min(self._keep_from - self._start, len(self._buffer))
+            if cut > 0:
+                del self._buffer[:cut]
+                self._start += cut
+
+        def _fill(self, end):
+            while self._total is None and self._start + len(self._buffer) < end:
+                data = self._file.read(self._read_size)
+                if data:
+                    self._buffer += self._compressor.compress(data)
+                else:
+                    self._buffer += self._compressor.flush()
+                    self._total = self._start + len(self._buffer)
+                    self._file.close()
+                # A restored upload drops what it compresses again until it catches up with the server.
+                self._trim()
+
+        def to_json(self):
+            return json.dumps({'path': self._path, 'chunksize': self._chunksize, 'read_size': self._read_size,
+                               '_class': type(self).__name__, '_module': type(self).__module__})
+
+        @staticmethod
+        def from_json(s):
+            data = json.loads(s)
+            return _GzipUpload(data['path'], data['chunksize'], data['read_size'])
+
+    return _GzipUpload
+
+
+def __getattr__(name):
+    # MediaUpload.new_from_json looks the upload class up by name, it only exists once googleapiclient is imported.
+    if name == '_GzipUpload':
+        return _gzip_upload()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def upload_csv_to_drive(csv_path: str, csv_name: str, folder_id: Optional[str] = None,
+                        mode: str = UPLOAD_CREATE, compress: bool = False, convert_to_sheet: bool = False) -> str:
     """
     Upload csv files to Google Drive. If no folder_id is passed to the function then it will upload the csv
     to the users root of the G drive.
 
+    Files up to SIMPLE_UPLOAD_LIMIT go up in a single request, larger ones in resumable chunks so a dropped
+    connection only costs the chunk in flight.
+
     Args:
         csv_path (str): Local path of the csv you wish to upload to google drive.
         csv_name (str): File name fo the local csv you wish to upload to google drive.
         folder_id (str): If you want to drop the file somewhere other than the root add the folder id.
+        mode (str): What to do when the folder already has a file called csv_name.
+            UPLOAD_CREATE ("create") always adds a new file next to it.
+            UPLOAD_UPDATE ("update") replaces the content of the existing file, keeping its id.
+            UPLOAD_SKIP_IDENTICAL ("skip") is like update, but sends nothing when the existing file's md5Checksum
+            matches the local file, so an unchanged file costs one metadata lookup.
+        compress (bool): Gzip the csv while it is uploaded and store it as csv_name + ".gz", for archive copies.
+            The local file is not touched and never held in memory as a whole.
+        convert_to_sheet (bool): Have Drive convert the csv to a Google Sheet called csv_name. Files bigger than
+            SHEET_CONVERSION_LIMIT are refused, Drive would fail the conversion after the upload.
 
     Returns:
         str: The google drive file id for the uploaded csv file.
 
     """
-    if folder_id:
-        csv_metadata = {'name': csv_name,
-                        'parents': [folder_id]}
+    if compress and convert_to_sheet:
+        raise ValueError("A csv can be compressed or converted to a sheet, not both")
+    return _upload(csv_path, csv_name, folder_id, mode, 'text/csv', compress, convert_to_sheet)
+
+
+def upload_file_to_drive(file_path: str, file_name: str, folder_id: Optional[str] = None,
+                         mode: str = UPLOAD_CREATE, mime_type: Optional[str] = None) -> str:
+    """
+    Upload any local file to Google Drive, like upload_csv_to_drive without the csv conversions.
+
+    Args:
+        file_path (str): Local directory of the file.
+        file_name (str): File name, in file_path and on Drive.
+        folder_id (str): Folder to upload into. Defaults to the root of My Drive.
+        mode (str): UPLOAD_CREATE, UPLOAD_UPDATE or UPLOAD_SKIP_IDENTICAL, see upload_csv_to_drive.
+        mime_type (str): Type the file is stored as. Guessed from the file name by default, files of unknown type
+            are stored as application/octet-stream.
+
+    Returns:
+        str: Id of the uploaded file.
+
+    """
+    mime_type = mime_type or mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+    return _upload(file_path, file_name, folder_id, mode, mime_type)
+
+
+def _upload(directory, file_name, folder_id, mode, media_type, compress=False, convert_to_sheet=False):
+    # The upload of upload_csv_to_drive and upload_file_to_drive, media_type is the type of the local file.
+    if mode not in (UPLOAD_CREATE, UPLOAD_UPDATE, UPLOAD_SKIP_IDENTICAL):
+        raise ValueError(f"Unknown upload mode {mode!r}")
+
+    from googleapiclient.http import MediaFileUpload
+
+    local_file = Path(f"{directory}/{file_name}")
+    size = os.path.getsize(local_file)
+    name = file_name + '.gz' if compress else file_name
+
+    if convert_to_sheet:
+        mime_type = SPREADSHEET_MIME_TYPE
+    elif compress:
+        mime_type = 'application/gzip'
     else:
-        csv_metadata = {'name': csv_name}
+        mime_type = media_type
 
-    csv_file = Path(f"{csv_path}/{csv_name}")
-    media = MediaFileUpload(csv_file,
-                            mimetype='text/csv')
-    file = drive_service().files().create(body=csv_metadata,
-                                          media_body=media,
-                                          fields='id').execute()
+    metadata = {'name': name}
+    if folder_id:
+        metadata['parents'] = [folder_id]
+    if convert_to_sheet:
+        if size > SHEET_CONVERSION_LIMIT:
+            raise ValueError(f"{local_file} is {size} bytes, too big to convert to a sheet "
+                             f"(limit {SHEET_CONVERSION_LIMIT})")
+        metadata['mimeType'] = SPREADSHEET_MIME_TYPE
+    if compress or convert_to_sheet:
+        # Drive's md5Checksum is of the stored content, so skip compares the md5 of the source kept here instead.
+        metadata['appProperties'] = {'sourceMd5': file_md5(local_file)}
+
+    existing = None
+    if mode != UPLOAD_CREATE:
+        # Only a file of the same kind is replaced, a sheet and a csv of the same name are different files.
+        response = drive_service().files().list(q=f"name = '{_quote(name)}' and mimeType = '{mime_type}' and "
+                                                  f"'{folder_id or 'root'}' in parents and trashed = false",
+                                                fields="files(id,md5Checksum,appProperties)",
+                                                supportsAllDrives=True,
+                                                includeItemsFromAllDrives=True,
+                                                pageSize=1).execute()
+        existing = response['files'][0] if response['files'] else None
+
+    if existing and mode == UPLOAD_SKIP_IDENTICAL:
+        stored = existing.get('appProperties', {}).get('sourceMd5') or existing.get('md5Checksum')
+        if stored == file_md5(local_file):
+            return existing['id']
+
+    if compress:
+        media = _gzip_upload()(local_file, UPLOAD_CHUNK_SIZE)
+    else:
+        media = MediaFileUpload(local_file,
+                                mimetype=media_type,
+                                chunksize=UPLOAD_CHUNK_SIZE,
+                                resumable=size > SIMPLE_UPLOAD_LIMIT)
+    if existing:
+        # Drive merges appProperties, a key is only removed by setting it to None. A plain upload has its content
+        # compared by md5Checksum, an old sourceMd5 would shadow it.
+        app_properties = metadata.get('appProperties', {'sourceMd5': None})
+        file = drive_service().files().update(fileId=existing['id'],
+                                              body={'appProperties': app_properties},
+                                              media_body=media,
+                                              supportsAllDrives=True,
+                                              fields='id').execute()
+    else:
+        file = drive_service().files().create(body=metadata,
+                                              media_body=media,
+                                              fields='id').execute()
+        _index_created(name, folder_id)
 
     return file.get('id')
 
 
+def download_file(file_id: str, path: Union[str, Path], chunk_size: int = UPLOAD_CHUNK_SIZE) -> int:
+    """
+    Download the content of a file to a local path, chunk_size bytes per request, so a large file is never held in
+    memory. Google Docs, Sheets and Slides have no content to download, export them instead.
+
+    Args:
+        file_id (str): Id of the file.
+        path (str): Where the content is written. An existing file is overwritten.
+        chunk_size (int): Bytes per request.
+
+    Returns:
+        int: Number of bytes written.
+
+    """
+    from googleapiclient.http import MediaIoBaseDownload
+
+    request = drive_service().files().get_media(fileId=file_id, supportsAllDrives=True)
+    with open(path, 'wb') as target:
+        downloader = MediaIoBaseDownload(target, request, chunksize=chunk_size)
+        done = False
+        while not done:
+            started, position = time.perf_counter(), target.tell()
+            status, done = downloader.next_chunk(num_retries=5)
+            _instrumentation.record_call('drive.files.get_media', time.perf_counter() - started, 0,
+                                         target.tell() - position, 200)
+        return target.tell()
+
+
 def create_folder_in_drive(folder_name: str, folder_id: Optional[str] = None) -> str:
     """
     This creates a folder in Google Drive. If no folder_id is passed to the function then folder will be created in the
@@ -479,6 +1483,7 @@ def create_folder_in_drive(folder_name: str, folder_id: Optional[str] = None) ->
         }
     folder = drive_service().files().create(body=file_metadata,
                                             fields='id').execute()
+    _index_created(folder_name, folder_id, file_metadata['mimeType'])
 
     return folder.get('id')
 
@@ -508,6 +1513,7 @@ def create_file_in_drive(file_name: str, folder_id: Optional[str] = None) -> str
         }
     folder = drive_service().files().create(body=file_metadata,
                                             fields='id').execute()
+    _index_created(file_name, folder_id, file_metadata['mimeType'])
 
     return folder.get('id')
 
@@ -523,26 +1529,472 @@ def delete_file_or_folder(file_id: str) -> bool:
 
     """
     # TODO Create unit test for this delete_file_or_folder
+    from googleapiclient.errors import HttpError
+
     try:
         drive_service().files().delete(fileId=file_id).execute()
         file_deleted_status = True
 
-    except errors.HttpError:
+    except HttpError:
         file_deleted_status = False
 
     return file_deleted_status
 
 
-def empty_trash():
+def empty_trash(drive_id: Optional[str] = None) -> bool:
+    """
+    This will empty the Oauth user's trash bin, or only the trash of one shared drive.
+
+    Args:
+        drive_id (str): Shared drive whose trash is emptied. Defaults to the user's own trash.
+
+    Returns:
+        bool: True if the trash was emptied, False if the api refused.
+    """
+    from googleapiclient.errors import HttpError
+
+    try:
+        if drive_id:
+            drive_service().files().emptyTrash(driveId=drive_id).execute()
+        else:
+            drive_service().files().emptyTrash().execute()
+        trash_emptied = True
+
+    except HttpError:
+        trash_emptied = False
+
+    return trash_emptied
+
+
+def find_folder_by_path(path: str) -> Union[bool, str]:
+    """
+    Walk a folder path like "projects/2020/reports" down from the root of the Oauth user's drive.
+
+    Args:
+        path (str): Folder names separated by "/".
+
+    Returns:
+        bool, str: The id of the last folder in the path. False if any folder along the way does not exist.
+
+    """
+    folder_id = 'root'
+    for name in [name for name in path.split('/') if name]:
+        response = drive_service().files().list(q=f"name = '{_quote(name)}' and '{folder_id}' in parents and "
+                                                  "mimeType = 'application/vnd.google-apps.folder' and "
+                                                  "trashed = false",
+                                                fields="files(id)",
+                                                pageSize=1).execute()
+        if not response['files']:
+            return False
+        folder_id = response['files'][0]['id']
+
+    return folder_id
+
+
+class RemovalReport:
+    """What remove_items planned and what actually happened."""
+
+    def __init__(self, planned: list):
+        """Start a report.
+
+        :param planned: Every item (dict with at least id and parents) that is going away, roots and descendants.
+        :type planned: list
+        """
+        self.planned = planned
+        self.removed = []
+        self.failed = {}
+
+    def __bool__(self):
+        return not self.failed
+
+    def __repr__(self):
+        return f"RemovalReport(planned={len(self.planned)}, removed={len(self.removed)}, failed={len(self.failed)})"
+
+
+def plan_removal(folder_id: Optional[str] = None,
+                 path: Optional[str] = None,
+                 query: Optional[str] = None,
+                 drive_id: Optional[str] = None) -> list:
+    """
+    List everything a removal would take away: the matching items and everything below them. The tree is walked one
+    level at a time, with the folders of a level looked up together instead of one listing per folder.
+
+    Args:
+        folder_id (str): Remove this folder (or file) and its contents.
+        path (str): Remove the folder at this path, see find_folder_by_path.
+        query (str): Remove every item matching this files.list query, e.g. "name = 'tmp' and trashed = false".
+        drive_id (str): Shared drive the query runs against. Defaults to the user's own drive.
+
+    Returns:
+        list: Dicts with id, name, mimeType, parents and, in shared drives, driveId of every item, parents before their
+            children.
+
+    """
+    fields = "nextPageToken, files(id,name,mimeType,parents,driveId)"
+
+    def list_all(q, drive):
+        # Every listing passes the shared drive flags, or the items of a shared drive would be left out.
+        scope = {'supportsAllDrives': True, 'includeItemsFromAllDrives': True}
+        scope.update({'corpora': 'drive', 'driveId': drive} if drive else {'corpora': 'user'})
+        found = []
+        page_token = None
+        while True:
+            response = drive_service().files().list(q=q, fields=fields, pageSize=1000, pageToken=page_token,
+                                                    **scope).execute()
+            found.extend(response['files'])
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return found
+
+    if path:
+        folder_id = find_folder_by_path(path)
+        if not folder_id:
+            return []
+
+    if folder_id:
+        from googleapiclient.errors import HttpError
+
+        try:
+            roots = [drive_service().files().get(fileId=folder_id, fields="id,name,mimeType,parents,driveId",
+                                                 supportsAllDrives=True).execute()]
+        except HttpError:
+            return []
+    elif query:
+        roots = list_all(query, drive_id)
+    else:
+        raise ValueError("plan_removal needs a folder_id, path or query")
+
+    planned = {item['id']: item for item in roots}
+    # Children live in the drive of their parent, so each shared drive is walked on its own.
+    levels = {}
+    for item in roots:
+        if item['mimeType'] == 'application/vnd.google-apps.folder':
+            levels.setdefault(item.get('driveId') or drive_id, []).append(item['id'])
+    while levels:
+        next_levels = {}
+        for drive, level in levels.items():
+            # Keep each query well below the api's query length limit.
+            for start in range(0, len(level), 50):
+                parents = ' or '.join(f"'{parent}' in parents" for parent in level[start:start + 50])
+                for item in list_all(f"({parents}) and trashed = false", drive):
+                    if item['id'] not in planned:
+                        planned[item['id']] = item
+                        if item['mimeType'] == 'application/vnd.google-apps.folder':
+                            next_levels.setdefault(drive, []).append(item['id'])
+        levels = next_levels
+
+    return list(planned.values())
+
+
+def remove_items(folder_id: Optional[str] = None,
+                 path: Optional[str] = None,
+                 query: Optional[str] = None,
+                 drive_id: Optional[str] = None,
+                 trash: bool = False,
+                 jobs: int = 4,
+                 num_retries: int = 5) -> RemovalReport:
+    """
+    Remove a folder tree, or everything matching a query, in as few requests as possible. Only the top most items of
+    the plan are deleted (or trashed), Drive takes their contents with them. The requests go out as concurrent batch
+    requests and are retried on 429 and 5xx responses.
+
+    Args:
+        folder_id (str): Remove this folder (or file) and its contents.
+        path (str): Remove the folder at this path, see find_folder_by_path.
+        query (str): Remove every item matching this files.list query.
+        drive_id (str): Shared drive the query runs against. Defaults to the user's own drive.
+        trash (bool): Move the items to the trash instead of deleting them permanently.
+        jobs (int): Number of batch requests in flight at once.
+        num_retries (int): How often a failed request is retried.
+
+    Returns:
+        RemovalReport: planned holds every item of the plan, removed the ids that are gone (descendants included)
+            and failed maps the ids that could not be removed to the error.
+
+    """
+    planned = plan_removal(folder_id, path, query, drive_id)
+    report = RemovalReport(planned)
+
+    planned_ids = {item['id'] for item in planned}
+    roots = [item['id'] for item in planned if not planned_ids.intersection(item.get('parents', ()))]
+
+    def make_request(service, file_id):
+        if trash:
+            return service.files().update(fileId=file_id, body={'trashed': True}, fields='id',
+                                          supportsAllDrives=True)
+        return service.files().delete(fileId=file_id, supportsAllDrives=True)
+
+    responses, errors = _execute_in_batches(make_request, roots, jobs=jobs, num_retries=num_retries)
+
+    children = {}
+    for item in planned:
+        for parent in item.get('parents', ()):
+            children.setdefault(parent, []).append(item['id'])
+    pending = [file_id for file_id in roots if file_id in responses]
+    while pending:
+        file_id = pending.pop()
+        report.removed.append(file_id)
+        pending.extend(children.get(file_id, ()))
+    report.failed = {file_id: str(error) for file_id, error in errors.items()}
+
+    return report
+
+
+class PermissionReport:
+    """Per item outcome of a bulk permission call."""
+
+    def __init__(self):
+        self.succeeded = {}
+        self.failed = {}
+        self.skipped = []
+
+    def __bool__(self):
+        return not self.failed
+
+    def __repr__(self):
+        return (f"PermissionReport(succeeded={len(self.succeeded)}, failed={len(self.failed)}, "
+                f"skipped={len(self.skipped)})")
+
+
+PERMISSION_FIELDS = 'id,type,role,emailAddress,domain'
+
+
+def list_permissions(file_ids: list, jobs: int = 4, num_retries: int = 5) -> PermissionReport:
+    """
+    List who has access to many files and folders at once, using batch requests.
+
+    Args:
+        file_ids (list): Ids of the files and folders.
+        jobs (int): Number of batch requests in flight at once.
+        num_retries (int): How often a failed request is retried.
+
+    Returns:
+        PermissionReport: succeeded maps each file id to its permissions (dicts with id, type, role, emailAddress
+            and domain), failed maps the ids that could not be read to the error.
+
+    """
+    def make_request(service, file_id):
+        return service.permissions().list(fileId=file_id, fields=f"nextPageToken, permissions({PERMISSION_FIELDS})",
+                                          pageSize=100, supportsAllDrives=True)
+
+    responses, errors = _execute_in_batches(make_request, list(dict.fromkeys(file_ids)), jobs=jobs,
+                                            num_retries=num_retries, read_only=True)
+
+    report = PermissionReport()
+    for file_id, response in responses.items():
+        permissions = response.get('permissions', [])
+        page_token = response.get('nextPageToken')
+        # Only files shared with more than a hundred grantees need another page.
+        while page_token:
+            response = drive_service().permissions().list(fileId=file_id, pageToken=page_token, pageSize=100,
+                                                          fields=f"nextPageToken, permissions({PERMISSION_FIELDS})",
+                                                          supportsAllDrives=True).execute(num_retries=num_retries)
+            permissions.extend(response.get('permissions', []))
+            page_token = response.get('nextPageToken')
+        report.succeeded[file_id] = permissions
+    report.failed = {file_id: str(error) for file_id, error in errors.items()}
+
+    return report
+
+
+def share_items(file_ids: list,
+                role: str,
+                permission_type: str = 'user',
+                email_address: Optional[str] = None,
+                domain: Optional[str] = None,
+                send_notification_email: bool = True,
+                email_message: Optional[str] = None,
+                jobs: int = 4,
+                num_retries: int = 5,
+                limiter: Optional[RateLimiter] = None) -> PermissionReport:
+    """
+    Give a user, group, domain or anyone with the link access to many files and folders at once. The permissions are
+    created through batch requests, paced to stay under Drive's sharing rate limits.
+
+    Args:
+        file_ids (list): Ids of the files and folders to share.
+        role (str): reader, commenter, writer, fileOrganizer, organizer or owner.
+        permission_type (str): user, group, domain or anyone.
+        email_address (str): The user or group, for permission_type user and group.
+        domain (str): The domain, for permission_type domain.
+        send_notification_email (bool): Email the user or group about every shared item. Turn it off for large
+            changes, Drive throttles sharing with notifications harder.
+        email_message (str): Text added to the notification email.
+        jobs (int): Number of batch requests in flight at once.
+        num_retries (int): How often a failed request is retried.
+        limiter (RateLimiter): Paces the requests. Defaults to SHARING_REQUESTS_PER_SECOND.
+
+    Returns:
+        PermissionReport: succeeded maps each file id to the new permission, failed maps the ids that could not be
+            shared to the error.
+
+    """
+    body = {'role': role, 'type': permission_type}
+    if email_address:
+        body['emailAddress'] = email_address
+    if domain:
+        body['domain'] = domain
+
+    options = {'fields': PERMISSION_FIELDS, 'supportsAllDrives': True}
+    if permission_type in ('user', 'group'):
+        options['sendNotificationEmail'] = send_notification_email
+        if send_notification_email and email_message:
+            options['emailMessage'] = email_message
+
+    def make_request(service, file_id):
+        return service.permissions().create(fileId=file_id, body=body, **options)
+
+    responses, errors = _execute_in_batches(make_request, list(dict.fromkeys(file_ids)), jobs=jobs,
+                                            num_retries=num_retries,
+                                            limiter=limiter or RateLimiter(SHARING_REQUESTS_PER_SECOND))
+
+    report = PermissionReport()
+    report.succeeded = responses
+    report.failed = {file_id: str(error) for file_id, error in errors.items()}
+    return report
+
+
+def _find_permissions(file_ids, permission_type, email_address, domain, jobs, num_retries):
+    """Look up the permission matching the grantee on every file. Returns the report and {file_id: permission_id}."""
+    if not (permission_type or email_address or domain):
+        raise ValueError("Pass the permission_type, email_address or domain of the permission to change")
+
+    listed = list_permissions(file_ids, jobs=jobs, num_retries=num_retries)
+    report = PermissionReport()
+    report.failed = listed.failed
+    matches = {}
+    for file_id, permissions in listed.succeeded.items():
+        for permission in permissions:
+            if (permission['role'] != 'owner'
+                    and (not permission_type or permission.get('type') == permission_type)
+                    and (not email_address or permission.get('emailAddress', '').lower() == email_address.lower())
+                    and (not domain or permission.get('domain', '').lower() == domain.lower())):
+                matches[file_id] = permission['id']
+                break
+        else:
+            report.skipped.append(file_id)
+    return report, matches
+
+
+def update_permissions(file_ids: list,
+                       role: str,
+                       email_address: Optional[str] = None,
+                       domain: Optional[str] = None,
+                       permission_type: Optional[str] = None,
+                       jobs: int = 4,
+                       num_retries: int = 5,
+                       limiter: Optional[RateLimiter] = None) -> PermissionReport:
+    """
+    Change the role of a grantee on many files and folders at once, e.g. turn a writer into a reader everywhere.
+
+    Args:
+        file_ids (list): Ids of the files and folders.
+        role (str): The new role.
+        email_address (str): Only change the permission of this user or group.
+        domain (str): Only change the permission of this domain.
+        permission_type (str): Only change permissions of this type, e.g. "anyone" for link sharing.
+        jobs (int): Number of batch requests in flight at once.
+        num_retries (int): How often a failed request is retried.
+        limiter (RateLimiter): Paces the requests. Defaults to SHARING_REQUESTS_PER_SECOND.
+
+    Returns:
+        PermissionReport: succeeded maps each file id to the updated permission, skipped lists the files the grantee
+            has no (non owner) permission on, failed maps the ids that could not be changed to the error.
+
+    """
+    report, matches = _find_permissions(file_ids, permission_type, email_address, domain, jobs, num_retries)
+
+    def make_request(service, file_id):
+        return service.permissions().update(fileId=file_id, permissionId=matches[file_id], body={'role': role},
+                                            fields=PERMISSION_FIELDS, supportsAllDrives=True)
+
+    responses, errors = _execute_in_batches(make_request, list(matches), jobs=jobs, num_retries=num_retries,
+                                            limiter=limiter or RateLimiter(SHARING_REQUESTS_PER_SECOND))
+    report.succeeded = responses
+    report.failed.update({file_id: str(error) for file_id, error in errors.items()})
+    return report
+
+
+def remove_permissions(file_ids: list,
+                       email_address: Optional[str] = None,
+                       domain: Optional[str] = None,
+                       permission_type: Optional[str] = None,
+                       jobs: int = 4,
+                       num_retries: int = 5,
+                       limiter: Optional[RateLimiter] = None) -> PermissionReport:
     """
-    This will empty the Oauth user's trash bin.
+    Take a grantee's access away from many files and folders at once. Owners are never removed.
+
+    Args:
+        file_ids (list): Ids of the files and folders.
+        email_address (str): Remove the permission of this user or group.
+        domain (str): Remove the permission of this domain.
+        permission_type (str): Remove permissions of this type, e.g. "anyone" to stop link sharing.
+        jobs (int): Number of batch requests in flight at once.
+        num_retries (int): How often a failed request is retried.
+        limiter (RateLimiter): Paces the requests. Defaults to SHARING_REQUESTS_PER_SECOND.
 
     Returns:
-        True: I have no way of testing this that i can think of so im just returning true. HACKY i know.
+        PermissionReport: succeeded maps each file id to the removed permission id, skipped lists the files the
+            grantee had no access to, failed maps the ids that could not be changed to the error.
+
     """
-    drive_service().files().emptyTrash().execute()
+    report, matches = _find_permissions(file_ids, permission_type, email_address, domain, jobs, num_retries)
+
+    def make_request(service, file_id):
+        return service.permissions().delete(fileId=file_id, permissionId=matches[file_id], supportsAllDrives=True)
 
-    return True
+    responses, errors = _execute_in_batches(make_request, list(matches), jobs=jobs, num_retries=num_retries,
+                                            limiter=limiter or RateLimiter(SHARING_REQUESTS_PER_SECOND))
+    report.succeeded = {file_id: matches[file_id] for file_id in responses}
+    report.failed.update({file_id: str(error) for file_id, error in errors.items()})
+    return report
+
+
+def get_changes_start_page_token(drive_id: Optional[str] = None) -> str:
+    """
+    The page token of the current state of the changes feed. Changes made after this call are listed from it.
+
+    Args:
+        drive_id (str): Shared drive whose changes are followed. Defaults to the user's own drive.
+
+    Returns:
+        str: Page token.
+
+    """
+    if drive_id:
+        response = drive_service().changes().getStartPageToken(driveId=drive_id, supportsAllDrives=True).execute()
+    else:
+        response = drive_service().changes().getStartPageToken().execute()
+    return response['startPageToken']
+
+
+def list_changes(page_token: str, drive_id: Optional[str] = None, num_retries: int = 5) -> tuple:
+    """
+    Everything that changed since page_token, following the pages of the changes feed.
+
+    Args:
+        page_token (str): Token from get_changes_start_page_token or a previous list_changes call.
+        drive_id (str): Shared drive whose changes are listed. Defaults to the user's own drive.
+        num_retries (int): How often a failed request is retried.
+
+    Returns:
+        tuple: (changes, new_page_token). changes is a list of dicts with fileId, removed, time and the file's id,
+            name, mimeType, parents and trashed. Pass new_page_token to the next call.
+
+    """
+    scope = {'driveId': drive_id, 'supportsAllDrives': True, 'includeItemsFromAllDrives': True} if drive_id else {}
+    changes = []
+    while True:
+        response = drive_service().changes().list(pageToken=page_token, pageSize=1000,
+                                                  fields="nextPageToken, newStartPageToken, "
+                                                         "changes(fileId,removed,time,"
+                                                         "file(id,name,mimeType,parents,trashed))",
+                                                  **scope).execute(num_retries=num_retries)
+        changes.extend(response.get('changes', []))
+        if 'newStartPageToken' in response:
+            return changes, response['newStartPageToken']
+        page_token = response['nextPageToken']
 
 
 def create_sheets(title, values):
@@ -556,6 +2008,7 @@ def create_sheets(title, values):
                                                          fields='spreadsheetId').execute()
 
     spreadsheet_id = spreadsheet.get('spreadsheetId')
+    _index_created(title, None, SPREADSHEET_MIME_TYPE)
 
     body = {
         'values': values
@@ -611,20 +2064,16 @@ class ProjectEnvironment:
 
         :return folder_id: The Google api identification number for a folder.
         """
-        find_project_folder = find_my_folder_by_name_by_searching_files(self.project_folder_name)
-        if not find_project_folder:
-            folder_id = create_folder_in_drive(self.project_folder_name)
-
-        else:
-            folder_id = find_my_folder_by_name_by_searching_files(self.project_folder_name)
-            folder_id = folder_id['id']
+        project_folder = find_my_folder_by_name_by_searching_files(self.project_folder_name)
+        if not project_folder:
+            return create_folder_in_drive(self.project_folder_name)
 
-        return folder_id
+        return project_folder['id']
 
     def _get_sub_folder_id(self, base_folder_id):
         """Find folder_id if not create it.
 
-        Search Google using Drive API v3 for a file/folder matching the sub_folder_name parameter.
+        Search Google using Drive API v3 for a folder matching the sub_folder_name parameter inside base_folder_id.
 
         If the file/folder is NOT found then a file/folder will be created and the id will be returned.
 
@@ -634,13 +2083,11 @@ class ProjectEnvironment:
         :type base_folder_id: str
         :return: folder_id: The Google api identification number for a folder.
         """
-        find_sub_folder = find_my_folder_by_name_by_searching_files(self.sub_folder_name)
-        if not find_sub_folder:
-            folder_id = create_folder_in_drive(self.sub_folder_name, base_folder_id)
-        else:
-            folder_id = find_my_folder_by_name_by_searching_files(self.sub_folder_name)['id']
+        sub_folder = find_child_by_name(self.sub_folder_name, base_folder_id, 'application/vnd.google-apps.folder')
+        if not sub_folder:
+            return create_folder_in_drive(self.sub_folder_name, base_folder_id)
 
-        return folder_id
+        return sub_folder['id']
 
     def build(self):
         """Create the folder structure for project then create a Google sheets file.
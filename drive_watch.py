@@ -0,0 +1,426 @@
+"""
+Push notifications for Drive changes.
+
+Drive can POST to an https endpoint whenever something changes, instead of callers rescanning with the list_*
+functions. A watch channel is registered with changes.watch (everything the user can see, or one shared drive) or
+files.watch (a single file) and expires after at most a day (files) or a week (changes), so it has to be renewed.
+
+WatchReceiver is a small embeddable http server that registers the channels, checks the channel token of every
+notification, fetches what changed from changes.list in a background thread and hands the changes to a callback.
+It renews its channels before they expire and stops them when closed:
+
+    def on_changes(channel, changes):
+        for change in changes:
+            print(change['fileId'], change['removed'])
+
+    with drive_watch.WatchReceiver(on_changes, port=8080, public_address='https://hooks.example.com/drive') as receiver:
+        receiver.watch_changes()
+        ...
+
+Google only delivers to public https addresses, so in production the receiver sits behind a proxy terminating TLS.
+drive_fake.FakeDrive delivers notifications to any address, which makes the whole loop testable locally.
+
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+import hmac
+import logging
+import queue
+import secrets
+import threading
+import time
+import uuid
+try:
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_tools
+
+logger = logging.getLogger(__name__)
+
+# Lifetime asked for when registering a channel. Drive caps it at a day for files and a week for changes.
+DEFAULT_CHANNEL_SECONDS = 3600
+
+# Channels are renewed this long before they expire.
+RENEW_MARGIN_SECONDS = 300
+
+
+class Channel:
+    """A registered watch channel."""
+
+    def __init__(self, response: dict, address: str, token: str, file_id: Optional[str] = None,
+                 page_token: Optional[str] = None, drive_id: Optional[str] = None):
+        """Wrap the channel resource returned by changes.watch or files.watch.
+
+        :param response: Channel resource from the api.
+        :type response: dict
+        :param address: Where notifications are sent.
+        :type address: str
+        :param token: Secret sent back with every notification of the channel.
+        :type token: str
+        :param file_id: Watched file, None for a changes channel.
+        :type file_id: str
+        :param page_token: Changes page token the next fetch starts from, changes channels only.
+        :type page_token: str
+        :param drive_id: Watched shared drive, changes channels only.
+        :type drive_id: str
+        """
+        self.id = response['id']
+        self.resource_id = response['resourceId']
+        self.resource_uri = response.get('resourceUri')
+        self.expiration = int(response['expiration']) / 1000 if response.get('expiration') else None
+        self.address = address
+        self.token = token
+        self.file_id = file_id
+        self.page_token = page_token
+        self.drive_id = drive_id
+
+    @property
+    def is_changes(self) -> bool:
+        return self.file_id is None
+
+    def __repr__(self):
+        watched = 'changes' if self.is_changes else self.file_id
+        return f"Channel(id={self.id!r}, watching={watched!r}, expiration={self.expiration!r})"
+
+
+def _channel_body(address, token, seconds):
+    body = {'id': str(uuid.uuid4()), 'type': 'web_hook', 'address': address, 'token': token}
+    if seconds:
+        body['expiration'] = str(int((time.time() + seconds) * 1000))
+    return body
+
+
+def watch_changes(address: str,
+                  token: Optional[str] = None,
+                  page_token: Optional[str] = None,
+                  drive_id: Optional[str] = None,
+                  seconds: int = DEFAULT_CHANNEL_SECONDS) -> Channel:
+    """
+    Register a channel that is notified about every change to the user's drive, or to one shared drive.
+
+    Args:
+        address (str): https address notifications are POSTed to.
+        token (str): Secret echoed back in every notification. A random one is made up if not given.
+        page_token (str): Changes page token to follow from. Defaults to the current state of the drive.
+        drive_id (str): Shared drive to watch.
+        seconds (int): Requested lifetime of the channel.
+
+    Returns:
+        Channel: The channel.
+
+    """
+    token = token or secrets.token_urlsafe(24)
+    page_token = page_token or drive_tools.get_changes_start_page_token(drive_id)
+    scope = {'driveId': drive_id, 'supportsAllDrives': True, 'includeItemsFromAllDrives': True} if drive_id else {}
+    response = drive_tools.drive_service().changes().watch(pageToken=page_token,
+                                                           body=_channel_body(address, token, seconds),
+                                                           **scope).execute(num_retries=5)
+    return Channel(response, address, token, page_token=page_token, drive_id=drive_id)
+
+
+def watch_file(file_id: str, address: str, token: Optional[str] = None,
+               seconds: int = DEFAULT_CHANNEL_SECONDS) -> Channel:
+    """
+    Register a channel that is notified when one file changes.
+
+    Args:
+        file_id (str): File to watch.
+        address (str): https address notifications are POSTed to.
+        token (str): Secret echoed back in every notification. A random one is made up if not given.
+        seconds (int): Requested lifetime of the channel.
+
+    Returns:
+        Channel: The channel.
+
+    """
+    token = token or secrets.token_urlsafe(24)
+    response = drive_tools.drive_service().files().watch(fileId=file_id, supportsAllDrives=True,
+                                                         body=_channel_body(address, token, seconds)
+                                                         ).execute(num_retries=5)
+    return Channel(response, address, token, file_id=file_id)
+
+
+def stop_channel(channel: Channel) -> bool:
+    """
+    Stop the notifications of a channel.
+
+    Args:
+        channel (Channel): Channel to stop.
+
+    Returns:
+        bool: True if the channel was stopped, False if Drive did not know it (anymore).
+
+    """
+    from googleapiclient.errors import HttpError
+
+    try:
+        drive_tools.drive_service().channels().stop(body={'id': channel.id,
+                                                          'resourceId': channel.resource_id}).execute()
+        return True
+    except HttpError:
+        return False
+
+
+def renew_channel(channel: Channel, seconds: int = DEFAULT_CHANNEL_SECONDS) -> Channel:
+    """
+    Replace a channel before it expires. Drive can't extend a channel, so a new one is registered for the same
+    resource, address and token, and the old one is stopped. A changes channel keeps its page token.
+
+    Args:
+        channel (Channel): Channel to renew.
+        seconds (int): Requested lifetime of the new channel.
+
+    Returns:
+        Channel: The new channel.
+
+    """
+    if channel.is_changes:
+        renewed = watch_changes(channel.address, channel.token, channel.page_token, channel.drive_id, seconds)
+    else:
+        renewed = watch_file(channel.file_id, channel.address, channel.token, seconds)
+    stop_channel(channel)
+    return renewed
+
+
+class WatchReceiver:
+    """Http server receiving the notifications of its channels."""
+
+    def __init__(self,
+                 on_changes: Callable[[Channel, list], None],
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 path: str = '/drive/notifications',
+                 public_address: Optional[str] = None,
+                 channel_seconds: int = DEFAULT_CHANNEL_SECONDS,
+                 renew_margin: int = RENEW_MARGIN_SECONDS):
+        """Start listening. Nothing is watched until watch_changes or watch_file is called. Channels are registered,
+        fetched, renewed and stopped as the identity current when the receiver is created (see
+        drive_tools.use_identity), whichever thread does it.
+
+        :param on_changes: Called with the channel and a list of changes (dicts with fileId, removed and file, see
+            drive_tools.list_changes). For a file channel the list holds one dict with fileId, removed and state.
+            Runs on the receiver's worker thread, one call at a time.
+        :type on_changes: callable
+        :param host: Interface to listen on.
+        :type host: str
+        :param port: Port to listen on. 0 picks a free one.
+        :type port: int
+        :param path: Url path notifications are accepted on.
+        :type path: str
+        :param public_address: Address Google sends notifications to, e.g. the https url of a proxy in front of the
+            receiver. Defaults to http://host:port/path.
+        :type public_address: str
+        :param channel_seconds: Requested lifetime of the channels.
+        :type channel_seconds: int
+        :param renew_margin: Channels are renewed this many seconds before they expire.
+        :type renew_margin: int
+        """
+        self.on_changes = on_changes
+        self.path = path
+        self.channel_seconds = channel_seconds
+        self.renew_margin = renew_margin
+        self.identity = drive_tools.current_identity()
+        self.channels = {}
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._queued = set()
+        # The changes channel the worker is fetching for, and the channel that replaced it meanwhile.
+        self._fetching = None
+        self._renewed_while_fetching = None
+        self._closed = threading.Event()
+        self._renewal_due = threading.Event()
+
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.address = public_address or f'http://{host}:{self._server.server_address[1]}{path}'
+
+        self._threads = [threading.Thread(target=self._server.serve_forever, name='WatchReceiver server', daemon=True),
+                         threading.Thread(target=self._run, args=(self._work,), name='WatchReceiver worker',
+                                          daemon=True),
+                         threading.Thread(target=self._run, args=(self._renew,), name='WatchReceiver renewal',
+                                          daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def watch_changes(self, drive_id: Optional[str] = None, page_token: Optional[str] = None) -> Channel:
+        """Watch the user's drive, or one shared drive. See drive_watch.watch_changes."""
+        with drive_tools.use_identity(self.identity):
+            channel = watch_changes(self.address, page_token=page_token, drive_id=drive_id,
+                                    seconds=self.channel_seconds)
+        return self._add(channel)
+
+    def watch_file(self, file_id: str) -> Channel:
+        """Watch one file. See drive_watch.watch_file."""
+        with drive_tools.use_identity(self.identity):
+            channel = watch_file(file_id, self.address, seconds=self.channel_seconds)
+        return self._add(channel)
+
+    def _add(self, channel):
+        with self._lock:
+            self.channels[channel.id] = channel
+        # Wake the renewal thread, the new channel may expire first.
+        self._renewal_due.set()
+        return channel
+
+    def _run(self, target):
+        # Background threads send their requests as the identity that created the receiver.
+        with drive_tools.use_identity(self.identity):
+            target()
+
+    def close(self):
+        """Stop every channel and shut the server down."""
+        self._closed.set()
+        self._renewal_due.set()
+        self._queue.put(None)
+        with self._lock:
+            channels = list(self.channels.values())
+            self.channels.clear()
+        with drive_tools.use_identity(self.identity):
+            for channel in channels:
+                stop_channel(channel)
+        self._server.shutdown()
+        self._server.server_close()
+        for thread in self._threads:
+            thread.join(timeout=10)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Receiving -------------------------------------------------------------------------------------------------
+
+    def _handler(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                if self.path.split('?')[0] != receiver.path:
+                    self.send_response(404)
+                else:
+                    self.send_response(receiver.notify(self.headers))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def notify(self, headers) -> int:
+        """
+        Handle one notification. The http handler calls this, it can also be fed notifications received elsewhere.
+
+        Args:
+            headers (dict): The X-Goog-* headers of the notification.
+
+        Returns:
+            int: Http status to answer with. Drive retries notifications answered with anything but a 2xx.
+
+        """
+        state = headers.get('X-Goog-Resource-State')
+        if state == 'sync':
+            # Sent once when the channel is registered, nothing changed yet. It can come in before watch_changes
+            # returned and the channel is known, so it is answered without looking the channel up.
+            return 200
+
+        with self._lock:
+            channel = self.channels.get(headers.get('X-Goog-Channel-ID'))
+        if channel is None or channel.resource_id != headers.get('X-Goog-Resource-ID'):
+            with self._lock:
+                self.rejected += 1
+            return 404
+        if not hmac.compare_digest(headers.get('X-Goog-Channel-Token') or '', channel.token):
+            with self._lock:
+                self.rejected += 1
+            return 403
+
+        if channel.is_changes:
+            self._schedule(channel.id)
+        else:
+            self._queue.put((channel.id, state))
+        return 200
+
+    def _schedule(self, channel_id):
+        # Notifications that come in while a fetch is pending are covered by that fetch.
+        with self._lock:
+            if channel_id in self._queued:
+                return
+            self._queued.add(channel_id)
+        self._queue.put((channel_id, None))
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            channel_id, state = job
+            with self._lock:
+                self._queued.discard(channel_id)
+                channel = self.channels.get(channel_id)
+                if channel is not None and channel.is_changes:
+                    page_token = channel.page_token
+                    self._fetching = channel
+            if channel is None:
+                continue
+
+            # Neither a failed fetch nor a failing callback may take the receiver down.
+            try:
+                if channel.is_changes:
+                    try:
+                        changes, page_token = drive_tools.list_changes(page_token, channel.drive_id)
+                    finally:
+                        with self._lock:
+                            self._fetching = None
+                            renewed, self._renewed_while_fetching = self._renewed_while_fetching, None
+                    with self._lock:
+                        channel.page_token = page_token
+                        if renewed is not None:
+                            # Renewal copied the token this fetch started from, the new channel goes on from here.
+                            renewed.page_token = page_token
+                    if not changes:
+                        continue
+                else:
+                    changes = [{'fileId': channel.file_id, 'removed': state == 'remove', 'state': state}]
+                self.on_changes(channel, changes)
+            except Exception:
+                logger.exception("Handling a notification of channel %s failed", channel.id)
+
+    # Renewal ---------------------------------------------------------------------------------------------------
+
+    def _renew(self):
+        while not self._closed.is_set():
+            with self._lock:
+                expirations = [channel.expiration for channel in self.channels.values() if channel.expiration]
+            wait = min(expirations) - self.renew_margin - time.time() if expirations else None
+            if wait is None or wait > 0:
+                self._renewal_due.wait(wait)
+                self._renewal_due.clear()
+                continue
+
+            with self._lock:
+                due = [channel for channel in self.channels.values()
+                       if channel.expiration and channel.expiration - self.renew_margin <= time.time()]
+            for channel in due:
+                if self._closed.is_set():
+                    return
+                try:
+                    renewed = renew_channel(channel, self.channel_seconds)
+                except Exception:
+                    logger.exception("Renewing channel %s failed, trying again in a minute", channel.id)
+                    self._closed.wait(60)
+                    break
+                with self._lock:
+                    if self.channels.pop(channel.id, None) is not None:
+                        # The old channel may have fetched changes while the new one was registered. A fetch still
+                        # running hands its page token on when it is done.
+                        renewed.page_token = channel.page_token
+                        if self._fetching is channel:
+                            self._renewed_while_fetching = renewed
+                        self.channels[renewed.id] = renewed
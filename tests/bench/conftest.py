@@ -0,0 +1,30 @@
+"""
+Benchmarks run against drive_fake.FakeDrive, so they need no network or Google account.
+
+DRIVE_BENCH_SCALE multiplies the amount of data every benchmark works on (default 1) and DRIVE_BENCH_LATENCY adds a
+fixed delay in seconds to every request (default 0).
+
+"""
+import os
+import pytest
+try:
+    import drive_fake
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_fake
+    from google_drive_tools import drive_tools
+
+SCALE = int(os.environ.get("DRIVE_BENCH_SCALE", "1"))
+LATENCY = float(os.environ.get("DRIVE_BENCH_LATENCY", "0"))
+
+
+def new_fake_drive() -> drive_fake.FakeDrive:
+    fake = drive_fake.FakeDrive(latency=LATENCY)
+    drive_tools.set_transport(fake.http)
+    return fake
+
+
+@pytest.fixture
+def fake_drive():
+    yield new_fake_drive()
+    drive_tools.set_transport(None)
@@ -0,0 +1,79 @@
+import pytest
+try:
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_tools
+from .conftest import SCALE, new_fake_drive
+
+pytest.importorskip("pytest_benchmark")
+
+FOLDERS = 1000 * SCALE
+BULK = 100 * SCALE
+
+
+@pytest.fixture
+def folders(fake_drive):
+    for number in range(FOLDERS):
+        fake_drive.add_folder(f"folder {number}")
+        if number % 4 == 0:
+            fake_drive.add_file(f"file {number}")
+    return fake_drive
+
+
+def test_list_my_folders(benchmark, folders):
+    result = benchmark(drive_tools.list_my_folders_by_searching_files)
+    assert len(result) == FOLDERS
+
+
+def test_list_my_folders_as_records(benchmark, folders):
+    result = benchmark(drive_tools.list_my_folders_by_searching_files, as_records=True)
+    assert len(result) == FOLDERS
+
+
+def test_list_domain_folders(benchmark, folders):
+    result = benchmark(drive_tools.list_domain_folders_by_searching_files)
+    assert len(result) == FOLDERS
+
+
+def test_find_folder_hit(benchmark, folders):
+    result = benchmark(drive_tools.find_my_folder_by_name_by_searching_files, f"folder {FOLDERS - 1}")
+    assert result
+
+
+def test_find_folder_miss(benchmark, folders):
+    assert not benchmark(drive_tools.find_my_folder_by_name_by_searching_files, "does not exist")
+
+
+def test_find_file(benchmark, folders):
+    assert benchmark(drive_tools.find_file_by_name, f"file {FOLDERS - 4}")
+
+
+def test_bulk_create_folders(benchmark, fake_drive):
+    def create():
+        return [drive_tools.create_folder_in_drive(f"new {number}") for number in range(BULK)]
+
+    assert len(benchmark.pedantic(create, rounds=3)) == BULK
+
+
+def test_bulk_delete(benchmark):
+    def setup():
+        fake = new_fake_drive()
+        return ([fake.add_file(f"delete {number}")["id"] for number in range(BULK)],), {}
+
+    def delete(file_ids):
+        return [drive_tools.delete_file_or_folder(file_id) for file_id in file_ids]
+
+    try:
+        assert all(benchmark.pedantic(delete, setup=setup, rounds=3))
+    finally:
+        drive_tools.set_transport(None)
+
+
+def test_upload_csv(benchmark, fake_drive, tmp_path):
+    csv_file = tmp_path / "upload.csv"
+    with open(csv_file, "w") as csv_out:
+        for number in range(20000 * SCALE):
+            csv_out.write(f"{number},name {number},{number * 3.5}\n")
+
+    file_id = benchmark(drive_tools.upload_csv_to_drive, str(tmp_path), "upload.csv")
+    assert fake_drive.files[file_id]["size"] == str(csv_file.stat().st_size)
@@ -0,0 +1,30 @@
+import pytest
+try:
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_tools
+from .conftest import SCALE
+
+pytest.importorskip("pytest_benchmark")
+
+ROWS = [[number, f"name {number}", number * 3.5] for number in range(2000 * SCALE)]
+
+
+def test_create_sheets(benchmark, fake_drive):
+    assert benchmark(drive_tools.create_sheets, "bench", ROWS)
+
+
+def test_write_to_existing_sheet(benchmark, fake_drive):
+    sheet_id = drive_tools.create_file_in_drive("bench")
+    result = benchmark(drive_tools.write_to_existing_sheet, sheet_id, ROWS)
+    assert result["updatedRows"] == len(ROWS)
+
+
+def test_many_small_writes(benchmark, fake_drive):
+    sheet_id = drive_tools.create_file_in_drive("bench")
+
+    def write():
+        for row in ROWS[:100]:
+            drive_tools.write_to_existing_sheet(sheet_id, [row])
+
+    benchmark(write)
@@ -18,16 +18,11 @@ def test_drive_create_upload_delete():
     tmp_base_folder = "delete_this_root_folder"
 
     # Confirm folder does not exist, if it does then delete it.
-    find_folder = drive_tools.find_my_folder_by_name_by_searching_files(tmp_base_folder)  # Find a folder that the Oauth user has access to.
-    while find_folder:
-        # Delete file
-        drive_tools.delete_file_or_folder(find_folder['id'])
-        # Try to find file again.
-        re_try_find_folder = drive_tools.find_my_folder_by_name_by_searching_files(tmp_base_folder)
-        # If the file was deleted then stop the loop and move on
-        if not re_try_find_folder:
-            find_folder = False
+    leftovers = drive_tools.remove_items(query=f"name = '{tmp_base_folder}' and "
+                                               "mimeType = 'application/vnd.google-apps.folder' and trashed = false")
+    assert leftovers
 
+    find_folder = drive_tools.find_my_folder_by_name_by_searching_files(tmp_base_folder)
     assert not find_folder
 
     # create base folder for test
@@ -66,9 +61,11 @@ def test_drive_create_upload_delete():
 
 
     # Delete folder and empty trash
-    file_deleted = drive_tools.delete_file_or_folder(folder_id)
-    assert file_deleted
-    drive_tools.empty_trash()
+    report = drive_tools.remove_items(path=tmp_base_folder)
+    assert report
+    assert folder_id in report.removed
+    assert upload_file in report.removed
+    assert drive_tools.empty_trash()
 
     # Confirm file was deleted.
     find_folder = drive_tools.find_my_folder_by_name_by_searching_files(tmp_base_folder)  # Find a folder that the Oauth user has access to.
@@ -0,0 +1,25 @@
+"""
+Fixtures shared by the unit tests. They run against drive_fake.FakeDrive, so they need no network or Google account.
+
+"""
+import pytest
+try:
+    import drive_fake
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_fake
+    from google_drive_tools import drive_tools
+
+
+@pytest.fixture
+def fake():
+    fake = drive_fake.FakeDrive()
+    drive_tools.set_transport(fake.http)
+    yield fake
+    drive_tools.set_transport(None)
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    # Retries back off without waiting. Only the retry loops are affected, time.sleep still sleeps.
+    monkeypatch.setattr(drive_tools, '_backoff', lambda attempt: None)
@@ -0,0 +1,178 @@
+import atexit
+import json
+import threading
+import time
+
+import pytest
+try:
+    import drive_append_buffer
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_append_buffer
+    from google_drive_tools import drive_tools
+
+pytestmark = pytest.mark.usefixtures('no_sleep')
+
+
+@pytest.fixture
+def sheet_id(fake):
+    return drive_tools.create_sheets('log', [])
+
+
+def appends(fake):
+    return [path for method, path in fake.requests if path.endswith(':append')]
+
+
+def abandon(buffer):
+    # What the process dying does to a buffer: the flusher thread stops, nothing is flushed and the journal stays.
+    with buffer._condition:
+        buffer._closed = True
+        buffer._condition.notify_all()
+    atexit.unregister(buffer.close)
+    buffer._thread.join()
+    if buffer._journal_file:
+        buffer._journal_file.close()
+
+
+def test_rows_from_many_threads_are_coalesced_in_order(fake, sheet_id):
+    with drive_append_buffer.AppendBuffer(max_rows=10000, flush_interval=60) as buffer:
+        def produce(thread):
+            for number in range(50):
+                buffer.append(sheet_id, [[thread, number]], range='Sheet1!A1')
+
+        threads = [threading.Thread(target=produce, args=(thread,)) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert appends(fake) == []
+
+    rows = fake.sheets[sheet_id]['Sheet1']
+    assert len(rows) == 400
+    assert len(appends(fake)) == 1
+    for thread in range(8):
+        assert [int(row[1]) for row in rows if row[0] == str(thread)] == list(range(50))
+    assert buffer.stats() == {'appends': 400, 'requests': 1, 'rows_sent': 400, 'pending': 0, 'parked': 0,
+                              'errors': 0}
+
+
+def test_flush_on_size_and_time(fake, sheet_id):
+    buffer = drive_append_buffer.AppendBuffer(max_rows=5, flush_interval=0.2)
+    buffer.append(sheet_id, [[number] for number in range(5)])
+    buffer.append(sheet_id, [['late']], range='Other!A1')
+    deadline = time.monotonic() + 5
+    while buffer.pending() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert buffer.pending() == 0
+    assert len(fake.sheets[sheet_id]['Sheet1']) == 5
+    assert fake.sheets[sheet_id]['Other'] == [['late']]
+    buffer.close()
+    with pytest.raises(RuntimeError):
+        buffer.append(sheet_id, [[1]])
+
+
+def test_failed_flush_keeps_the_rows_in_order(fake, sheet_id):
+    buffer = drive_append_buffer.AppendBuffer(flush_interval=60, num_retries=0)
+    buffer.append(sheet_id, [['first']])
+    fake.fail_next(1, status=503, path=':append')
+    with pytest.raises(Exception):
+        buffer.flush()
+    assert buffer.pending() == 1
+
+    buffer.append(sheet_id, [['second']])
+    buffer.flush(sheet_id)
+    assert fake.sheets[sheet_id]['Sheet1'] == [['first'], ['second']]
+    assert buffer.stats()['errors'] == 1
+    buffer.close()
+
+
+def test_failing_ranges_back_off(fake, sheet_id):
+    buffer = drive_append_buffer.AppendBuffer(max_rows=1, flush_interval=0, num_retries=0)
+    fake.fail_next(1000, status=503, path=':append')
+    for number in range(20):
+        buffer.append(sheet_id, [[number]])
+    time.sleep(0.5)
+    # The first try and at most one retry after a second, not one request per loop of the flusher thread.
+    assert len(appends(fake)) <= 2
+    assert buffer.pending() == 20
+    abandon(buffer)
+
+
+def test_refused_rows_are_parked(fake, sheet_id):
+    buffer = drive_append_buffer.AppendBuffer(max_rows=1, flush_interval=0, max_pending_rows=5, append_timeout=1)
+    buffer.append('missing', [['lost']])
+    deadline = time.monotonic() + 5
+    while not buffer.parked and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert buffer.parked == {('missing', 'A1'): [['lost']]}
+    assert len(appends(fake)) == 1
+    with pytest.raises(Exception) as refused:
+        buffer.append('missing', [['more']])
+    assert refused.value is buffer.errors[-1]
+
+    # The other ranges are not held up.
+    for number in range(10):
+        buffer.append(sheet_id, [[number]])
+    buffer.flush()
+    assert len(fake.sheets[sheet_id]['Sheet1']) == 10
+    assert buffer.stats()['parked'] == 1
+
+    assert buffer.retry_parked() == 1
+    with pytest.raises(Exception):
+        buffer.flush()
+    assert buffer.stats()['errors'] == 2
+    buffer.close()
+
+
+def test_errors_are_bounded(fake, monkeypatch):
+    monkeypatch.setattr(drive_append_buffer, 'MAX_ERRORS', 3)
+    buffer = drive_append_buffer.AppendBuffer(flush_interval=60)
+    for number in range(5):
+        buffer.retry_parked()
+        buffer.append('missing', [[number]])
+        with pytest.raises(Exception):
+            buffer.flush()
+    assert len(buffer.errors) == 3
+    assert buffer.stats()['errors'] == 5
+    buffer.close()
+
+
+def test_append_does_not_wait_forever(fake, sheet_id):
+    buffer = drive_append_buffer.AppendBuffer(flush_interval=60, max_pending_rows=2, append_timeout=0.1)
+    buffer.append(sheet_id, [[1], [2]])
+    with pytest.raises(TimeoutError):
+        buffer.append(sheet_id, [[3]])
+    buffer.close()
+    assert len(fake.sheets[sheet_id]['Sheet1']) == 2
+
+
+def test_large_flushes_are_split(fake, sheet_id, monkeypatch):
+    monkeypatch.setattr(drive_append_buffer, 'ROWS_PER_REQUEST', 3)
+    with drive_append_buffer.AppendBuffer(flush_interval=60) as buffer:
+        buffer.append(sheet_id, [[number] for number in range(7)])
+    assert len(appends(fake)) == 3
+    assert [row[0] for row in fake.sheets[sheet_id]['Sheet1']] == [str(number) for number in range(7)]
+
+
+def test_journal_survives_the_process(fake, sheet_id, tmp_path):
+    journal = tmp_path / 'appends.jsonl'
+    buffer = drive_append_buffer.AppendBuffer(flush_interval=60, journal=str(journal))
+    buffer.append(sheet_id, [['sent']])
+    buffer.flush()
+    buffer.append(sheet_id, [['waiting']])
+    assert [json.loads(line)['rows'] for line in journal.read_text().splitlines()] == [[['waiting']]]
+    # The process dies without closing the buffer.
+    abandon(buffer)
+
+    with drive_append_buffer.AppendBuffer(flush_interval=60, journal=str(journal)) as replayed:
+        assert replayed.pending() == 1
+    assert fake.sheets[sheet_id]['Sheet1'] == [['sent'], ['waiting']]
+    assert journal.read_text() == ''
+
+
+def test_append_rows_uses_the_default_buffer(fake, sheet_id):
+    drive_append_buffer.append_rows(sheet_id, [['a']])
+    drive_append_buffer.append_rows(sheet_id, [['b']])
+    drive_append_buffer.default_buffer().close()
+    assert fake.sheets[sheet_id]['Sheet1'] == [['a'], ['b']]
+    assert len(appends(fake)) == 1
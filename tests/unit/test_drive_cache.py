@@ -0,0 +1,124 @@
+import time
+from googleapiclient.http import HttpMockSequence
+from googleapiclient.model import JsonModel
+try:
+    import drive_cache
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_cache
+    from google_drive_tools import drive_tools
+
+FILES_LIST_URI = "https://www.googleapis.com/drive/v3/files?q=name&alt=json"
+
+
+def _request(http, uri=FILES_LIST_URI, method='GET', method_id='drive.files.list'):
+    return drive_tools._request_builder()(http, JsonModel().response, uri, method=method, methodId=method_id)
+
+
+def test_cache_key_ignores_parameter_order():
+    key_a = drive_cache.cache_key('drive.files.list', 'https://x/drive/v3/files?q=a&fields=id')
+    key_b = drive_cache.cache_key('drive.files.list', 'https://x/drive/v3/files?fields=id&q=a')
+    assert key_a == key_b
+
+
+def test_ttl_expires_entries():
+    cache = drive_cache.ResponseCache(ttl=0.05)
+    cache.set('["drive.files.list"]', {'files': []})
+    assert cache.is_fresh(cache.get('["drive.files.list"]'))
+
+    time.sleep(0.06)
+    assert not cache.is_fresh(cache.get('["drive.files.list"]'))
+
+
+def test_lru_eviction_respects_caps():
+    cache = drive_cache.ResponseCache(max_entries=2)
+    cache.set('["a"]', 1)
+    cache.set('["b"]', 2)
+    cache.get('["a"]')
+    cache.set('["c"]', 3)
+    assert cache.get('["b"]') is None
+    assert cache.get('["a"]').body == 1
+
+    cache = drive_cache.ResponseCache(max_bytes=20)
+    cache.set('["a"]', 'x' * 10)
+    cache.set('["b"]', 'y' * 10)
+    assert cache.get('["a"]') is None
+    assert len(cache) == 1
+
+
+def test_disk_cache_survives_new_instance(tmp_path):
+    drive_cache.ResponseCache(directory=str(tmp_path)).set('["drive.files.get"]', {'id': '1'})
+    cache = drive_cache.ResponseCache(directory=str(tmp_path))
+    assert cache.get('["drive.files.get"]').body == {'id': '1'}
+
+    cache.invalidate('drive.')
+    assert drive_cache.ResponseCache(directory=str(tmp_path)).get('["drive.files.get"]') is None
+
+
+def test_disk_invalidation_only_removes_matching_methods(tmp_path, monkeypatch):
+    cache = drive_cache.ResponseCache(directory=str(tmp_path))
+    cache.set('["drive.files.get"]', {'id': '1'})
+    cache.set('["sheets.spreadsheets.get"]', {'id': '2'})
+    # Written by another process after this cache listed the directory.
+    drive_cache.ResponseCache(directory=str(tmp_path)).set('["drive.files.list"]', {'files': []})
+
+    def no_open(*args, **kwargs):
+        raise AssertionError("invalidate opened a cache file")
+
+    with monkeypatch.context() as patch:
+        patch.setattr('builtins.open', no_open)
+        cache.invalidate('drive.')
+
+    fresh = drive_cache.ResponseCache(directory=str(tmp_path))
+    assert fresh.get('["drive.files.get"]') is None
+    assert fresh.get('["drive.files.list"]') is None
+    assert fresh.get('["sheets.spreadsheets.get"]').body == {'id': '2'}
+
+
+def test_cached_bodies_are_copies():
+    cache = drive_cache.ResponseCache()
+    body = {'files': [{'id': '1'}]}
+    cache.set('["drive.files.list"]', body)
+    body['files'].clear()
+    cache.get('["drive.files.list"]').body['files'].append({'id': '2'})
+    assert cache.get('["drive.files.list"]').body == {'files': [{'id': '1'}]}
+
+
+def test_get_requests_are_served_from_cache():
+    drive_tools.set_response_cache(drive_cache.ResponseCache())
+    try:
+        http = HttpMockSequence([({'status': '200'}, '{"files": [{"id": "1"}]}')])
+        assert _request(http).execute() == {'files': [{'id': '1'}]}
+        # The mock has no responses left, a second request over the wire would fail.
+        assert _request(http).execute() == {'files': [{'id': '1'}]}
+    finally:
+        drive_tools.set_response_cache(None)
+
+
+def test_stale_entries_are_revalidated_with_etag():
+    cache = drive_cache.ResponseCache(ttl=0)
+    drive_tools.set_response_cache(cache)
+    try:
+        http = HttpMockSequence([({'status': '200', 'etag': '"v1"'}, '{"files": []}'),
+                                 ({'status': '304'}, '')])
+        assert _request(http).execute() == {'files': []}
+
+        revalidate = _request(http)
+        assert revalidate.execute() == {'files': []}
+        assert revalidate.headers['If-None-Match'] == '"v1"'
+    finally:
+        drive_tools.set_response_cache(None)
+
+
+def test_mutations_invalidate_cache():
+    cache = drive_cache.ResponseCache()
+    drive_tools.set_response_cache(cache)
+    try:
+        http = HttpMockSequence([({'status': '200'}, '{"files": []}'),
+                                 ({'status': '200'}, '{"id": "new"}'),
+                                 ({'status': '200'}, '{"files": [{"id": "new"}]}')])
+        _request(http).execute()
+        _request(http, "https://www.googleapis.com/drive/v3/files?alt=json", 'POST', 'drive.files.create').execute()
+        assert _request(http).execute() == {'files': [{'id': 'new'}]}
+    finally:
+        drive_tools.set_response_cache(None)
@@ -0,0 +1,93 @@
+import gzip
+import pytest
+try:
+    import drive_cassettes
+    import drive_fake
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_cassettes
+    from google_drive_tools import drive_fake
+    from google_drive_tools import drive_tools
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    fake = drive_fake.FakeDrive(latency=0.01)
+    fake.add_folder('project')
+    path = str(tmp_path / 'build.cassette.gz')
+
+    with drive_cassettes.recording(path, http_factory=fake.http) as cassette:
+        file_id = drive_tools.ProjectEnvironment('sheet', 'project', 'sub').build()
+        with drive_cassettes.operation('cleanup'):
+            drive_tools.delete_file_or_folder(file_id)
+    assert drive_tools._transport is None
+    return path, cassette, file_id
+
+
+def test_recording_captures_operations(recorded):
+    _, cassette, _ = recorded
+    operations = {event['operation'] for event in cassette.interactions}
+    assert operations == {'ProjectEnvironment.build', 'cleanup'}
+    assert all(event['elapsed'] >= 0.01 for event in cassette.interactions)
+
+
+def test_secrets_are_scrubbed(tmp_path):
+    class TokenHttp:
+        def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+            import httplib2
+            return httplib2.Response({'status': '200'}), b'{"access_token": "secret-token", "id": "1"}'
+
+    path = str(tmp_path / 'secret.cassette.gz')
+    with drive_cassettes.recording(path, http_factory=TokenHttp):
+        drive_tools._build_service('drive', 'v3')._http.request(
+            'https://www.googleapis.com/drive/v3/files?access_token=secret-token&alt=json',
+            headers={'Authorization': 'Bearer secret-token'})
+
+    with gzip.open(path, 'rt') as cassette_file:
+        assert 'secret-token' not in cassette_file.read()
+
+
+def test_replay_without_network(recorded):
+    path, _, file_id = recorded
+    with drive_cassettes.replaying(path) as replayer:
+        assert drive_tools.ProjectEnvironment('sheet', 'project', 'sub').build() == file_id
+        with drive_cassettes.operation('cleanup'):
+            assert drive_tools.delete_file_or_folder(file_id)
+    assert replayer.remaining == 0
+
+    with drive_cassettes.replaying(path):
+        with pytest.raises(drive_cassettes.CassetteMismatch):
+            drive_tools.create_folder_in_drive('not recorded')
+
+
+def test_replay_speed(recorded):
+    path, cassette, _ = recorded
+    recorded_seconds = sum(event['elapsed'] for event in cassette.interactions
+                           if event['operation'] == 'ProjectEnvironment.build')
+    with drive_cassettes.replaying(path, speed=2):
+        started = drive_tools.time.perf_counter()
+        drive_tools.ProjectEnvironment('sheet', 'project', 'sub').build()
+        assert drive_tools.time.perf_counter() - started >= recorded_seconds / 2 * 0.9
+
+
+def test_redundancy_report(recorded, tmp_path):
+    path, _, _ = recorded
+    report = drive_cassettes.redundancy_report(path)
+
+    build = report['ProjectEnvironment.build']
+    assert build['redundant_requests'] == 0
+    assert build['service_builds'] == 1
+
+    fake = drive_fake.FakeDrive()
+    fake.add_folder('project')
+    repeated = str(tmp_path / 'repeated.cassette.gz')
+    with drive_cassettes.recording(repeated, http_factory=fake.http):
+        with drive_cassettes.operation('lookups'):
+            # The same listing twice in one operation.
+            drive_tools.find_my_folder_by_name_by_searching_files('project')
+            drive_tools.find_my_folder_by_name_by_searching_files('project')
+    lookups = drive_cassettes.redundancy_report(repeated)['lookups']
+    assert lookups['redundant_requests'] >= 1
+    assert lookups['duplicates'][0][0].startswith('https://www.googleapis.com/drive/v3/files?')
+    assert report['cleanup']['requests_by_method'] == {'DELETE': 1}
+    assert 'ProjectEnvironment.build' in drive_cassettes.format_report(report)
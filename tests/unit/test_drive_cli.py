@@ -0,0 +1,190 @@
+import gzip
+import json
+import os
+import pathlib
+import subprocess
+import sys
+
+import pytest
+try:
+    import drive_cli
+    import drive_inventory
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_cli
+    from google_drive_tools import drive_inventory
+    from google_drive_tools import drive_tools
+
+
+def run(capsys, *argv):
+    status = drive_cli.main(list(argv))
+    return status, [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_ls_streams_pages_as_json_lines(fake, capsys):
+    folder_id = fake.add_folder('reports')['id']
+    for number in range(25):
+        fake.add_file(f'{number}.csv', parent=folder_id)
+    fake.add_file('elsewhere.csv')
+
+    status, lines = run(capsys, 'ls', '/reports', '--page-size', '10', '--fields', 'id,name')
+    assert status == 0
+    assert sorted(line['name'] for line in lines) == sorted(f'{number}.csv' for number in range(25))
+    assert set(lines[0]) == {'id', 'name'}
+    assert len([path for method, path in fake.requests if path == '/drive/v3/files']) == 3 + 1
+
+    status, lines = run(capsys, 'ls', '/missing')
+    assert status == 1
+
+
+def test_ls_and_find_list_ranges_in_parallel(fake, capsys, monkeypatch):
+    folder_id = fake.add_folder('reports')['id']
+    for number in range(40):
+        fake.add_file(f'{number}.csv', parent=folder_id, modifiedTime=f'2020-01-{number % 28 + 1:02d}T00:00:00.000Z')
+    calls = []
+    list_files_in_parallel = drive_tools.list_files_in_parallel
+
+    def recorded(*args, **kwargs):
+        calls.append(kwargs)
+        return list_files_in_parallel(*args, **kwargs)
+
+    monkeypatch.setattr(drive_tools, 'list_files_in_parallel', recorded)
+    status, lines = run(capsys, 'ls', '/reports', '--jobs', '4', '--page-size', '5', '--fields', 'id,name')
+    assert status == 0
+    assert sorted(line['name'] for line in lines) == sorted(f'{number}.csv' for number in range(40))
+    assert set(lines[0]) == {'id', 'name'}
+
+    status, lines = run(capsys, 'find', '3', '--contains', '--jobs', '2')
+    assert status == 0
+    assert sorted(line['name'] for line in lines) == sorted(f'{number}.csv' for number in range(40)
+                                                            if '3' in str(number))
+    assert [call['jobs'] for call in calls] == [4, 2]
+
+
+def test_find_and_tree(fake, capsys):
+    top = fake.add_folder('top')['id']
+    middle = fake.add_folder('middle', parent=top)['id']
+    fake.add_file('deep report.csv', parent=middle)
+    fake.add_file('report.csv', parent=top)
+
+    status, lines = run(capsys, 'find', 'report', '--contains', '--fields', 'name')
+    assert sorted(line['name'] for line in lines) == ['deep report.csv', 'report.csv']
+
+    status, lines = run(capsys, 'tree', top, '--jobs', '3', '--page-size', '1')
+    assert status == 0
+    assert sorted(line['path'] for line in lines) == ['/middle', '/middle/deep report.csv', '/report.csv']
+
+    status, lines = run(capsys, 'tree', top, '--depth', '1')
+    assert sorted(line['path'] for line in lines) == ['/middle', '/report.csv']
+
+
+def test_upload_download_and_rm(fake, capsys, tmp_path):
+    paths = []
+    for number in range(3):
+        path = tmp_path / f'{number}.csv'
+        path.write_bytes(f'id\n{number}\n'.encode())
+        paths.append(str(path))
+
+    status, lines = run(capsys, 'upload', *paths, '--jobs', '3', '--compress')
+    assert status == 0
+    uploaded = {line['path']: line['id'] for line in lines}
+    assert gzip.decompress(fake.content[uploaded[paths[1]]]) == b'id\n1\n'
+
+    target = tmp_path / 'downloads'
+    target.mkdir()
+    status, lines = run(capsys, 'download', *uploaded.values(), '-o', str(target))
+    assert sorted(line['path'].rsplit('/', 1)[1] for line in lines) == ['0.csv.gz', '1.csv.gz', '2.csv.gz']
+    assert gzip.decompress((target / '2.csv.gz').read_bytes()) == b'id\n2\n'
+
+    status, lines = run(capsys, 'rm', uploaded[paths[0]], '--trash')
+    assert lines == [{'id': uploaded[paths[0]], 'trashed': True}]
+    assert fake.files[uploaded[paths[0]]]['trashed']
+
+    status, lines = run(capsys, 'rm')
+    assert status == 1
+
+
+def test_sync_mirrors_directories_and_skips_unchanged(fake, capsys, tmp_path):
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'top.csv').write_bytes(b'1\n')
+    (tmp_path / 'a' / 'b' / 'deep.csv').write_bytes(b'2\n')
+    (tmp_path / 'a' / 'report.pdf').write_bytes(b'%PDF-1.4\n')
+    (tmp_path / 'a' / 'NOTES').write_bytes(b'no extension\n')
+
+    status, lines = run(capsys, 'sync', str(tmp_path), '--jobs', '2')
+    assert status == 0
+    assert len(lines) == 4
+    folders = {item['name'] for item in fake.files.values() if item['mimeType'] == drive_cli.FOLDER_MIME_TYPE}
+    assert folders == {'a', 'b'}
+    types = {item['name']: item['mimeType'] for item in fake.files.values()}
+    assert (types['top.csv'], types['report.pdf'], types['NOTES']) == ('text/csv', 'application/pdf',
+                                                                       'application/octet-stream')
+
+    uploads = len([path for method, path in fake.requests if path.startswith('/upload/')])
+    status, lines = run(capsys, 'sync', str(tmp_path))
+    assert len([path for method, path in fake.requests if path.startswith('/upload/')]) == uploads
+    assert len(fake.files) == 6
+
+
+def test_sheets_write_in_batches(fake, capsys, tmp_path, monkeypatch):
+    monkeypatch.setattr(drive_cli, 'SHEET_ROWS_PER_REQUEST', 2)
+    sheet_id = drive_tools.create_sheets('cli', [])
+    rows = tmp_path / 'rows.csv'
+    rows.write_text('a,1\nb,2\nc,3\n')
+
+    status, lines = run(capsys, 'sheets-write', sheet_id, '--range', 'Sheet1!B2', '--input', str(rows))
+    assert status == 0
+    assert [line['rows'] for line in lines] == [2, 1]
+    assert fake.sheets[sheet_id]['Sheet1'][1:] == [['', 'a', '1'], ['', 'b', '2'], ['', 'c', '3']]
+
+    jsonl = tmp_path / 'rows.jsonl'
+    jsonl.write_text('["d", 4]\n')
+    run(capsys, 'sheets-write', sheet_id, '--range', 'Sheet1!B2', '--append', '--format', 'jsonl',
+        '--input', str(jsonl))
+    assert fake.sheets[sheet_id]['Sheet1'][-1] == ['', 'd', '4']
+
+
+def test_inventory_jobs_are_worker_processes(capsys, monkeypatch, tmp_path):
+    called = {}
+
+    def export_inventory(path, **arguments):
+        called.update(arguments)
+        return drive_inventory.InventoryReport([])
+
+    monkeypatch.setattr(drive_inventory, 'export_inventory', export_inventory)
+    status, lines = run(capsys, 'inventory', str(tmp_path / 'inventory.csv'), '--jobs', '3')
+    assert status == 0
+    assert called['processes'] == 3
+
+    # sheets-write sends its batches one after the other and takes no --jobs.
+    with pytest.raises(SystemExit):
+        drive_cli.main(['sheets-write', 'sheet', '--jobs', '2'])
+
+
+def test_offset_range():
+    assert drive_cli._offset_range('A1', 1000) == 'A1001'
+    assert drive_cli._offset_range('Data!C', 2) == 'Data!C3'
+    assert drive_cli._offset_range("'My data'!B7", 0) == "'My data'!B7"
+    assert drive_cli._offset_range('Data!A1:C5', 5) == 'Data!A6'
+    assert drive_cli._offset_range('Sheet1', 10) == 'Sheet1!A11'
+    assert drive_cli._offset_range('Log', 1) == 'Log!A2'
+
+
+def test_installed_script(tmp_path):
+    pytest.importorskip('poetry.core')
+    root = pathlib.Path(drive_cli.__file__).parent
+    pip = [sys.executable, '-m', 'pip', '--disable-pip-version-check', '-q']
+    subprocess.run([*pip, 'wheel', '--no-deps', '--no-build-isolation', '-w', str(tmp_path / 'wheel'), str(root)],
+                   check=True)
+    wheel, = (tmp_path / 'wheel').glob('*.whl')
+    subprocess.run([*pip, 'install', '--no-deps', '--target', str(tmp_path / 'site'), str(wheel)], check=True)
+
+    # Run from an empty directory, so only the installed package can be imported.
+    env = dict(os.environ, PYTHONPATH=str(tmp_path / 'site'))
+    script = tmp_path / 'site' / 'bin' / 'drive-tools'
+    result = subprocess.run([str(script), '--help'], cwd=tmp_path, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert 'sheets-write' in result.stdout
+
+    check = "from google_drive_tools import drive_tools; drive_tools._discovery_document('drive', 'v3')"
+    subprocess.run([sys.executable, '-c', check], cwd=tmp_path, env=env, check=True)
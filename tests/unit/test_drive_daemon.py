@@ -0,0 +1,135 @@
+import io
+import json
+import time
+
+import pytest
+try:
+    import drive_cli
+    import drive_daemon
+    import drive_identities
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_cli
+    from google_drive_tools import drive_daemon
+    from google_drive_tools import drive_identities
+    from google_drive_tools import drive_tools
+
+
+@pytest.fixture
+def daemon(fake, tmp_path):
+    with drive_daemon.DriveDaemon(str(tmp_path / 'drive.sock'), workers=2, requests_per_second=1000) as daemon:
+        yield daemon
+    assert not (tmp_path / 'drive.sock').exists()
+    assert drive_tools.current_identity() is None
+
+
+def submit(daemon, *argv, **options):
+    stream = io.StringIO()
+    status = drive_daemon.submit(list(argv), daemon.socket_path, stream=stream, **options)
+    return status, [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def job(client, priority=0):
+    return drive_daemon.Job(None, None, priority, client)
+
+
+def test_jobs_run_on_the_daemon(fake, daemon, tmp_path, monkeypatch):
+    folder_id = fake.add_folder('exports')['id']
+    (tmp_path / 'report.csv').write_bytes(b'a,b\n')
+    monkeypatch.chdir(tmp_path)
+
+    status, lines = submit(daemon, 'upload', 'report.csv', '--folder', '/exports', client='cron')
+    assert status == 0
+    assert fake.content[lines[0]['id']] == b'a,b\n'
+
+    status, lines = submit(daemon, 'ls', folder_id, '--fields', 'name')
+    assert (status, lines) == (0, [{'name': 'report.csv'}])
+
+    sheet_id = drive_tools.create_sheets('daemon', [])
+    status, lines = submit(daemon, 'sheets-write', sheet_id, input='x,1\ny,2\n')
+    assert fake.sheets[sheet_id]['Sheet1'] == [['x', '1'], ['y', '2']]
+
+    stats = drive_daemon.stats(daemon.socket_path)
+    assert stats['completed'] == 3
+    assert stats['clients']['cron']['usage_seconds'] > 0
+    # Every request went through the daemon's identity and its cache.
+    assert stats['identity']['requests'] > 0
+    assert stats['cache_entries'] > 0
+    assert stats['name_index']['scopes'] == 0
+
+
+def test_refused_jobs(daemon, capsys):
+    assert submit(daemon, 'ls', '--no-such-option')[0] == 2
+    assert submit(daemon, 'inventory', 'out.csv')[0] == 2
+    assert submit(daemon, 'ls', '/missing')[0] == 1
+    assert 'does not run inventory' in capsys.readouterr().err
+
+
+def test_failing_jobs_exit_non_zero(fake, daemon, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sheet_id = drive_tools.create_sheets('daemon', [])
+    status, lines = submit(daemon, 'sheets-write', sheet_id, '--input', 'missing.csv')
+    assert status == 1
+    assert lines[0]['command'] == 'sheets-write'
+    assert 'missing.csv' in lines[0]['error']
+
+
+def test_lost_clients_stop_the_output():
+    class Gone(io.StringIO):
+        def write(self, text):
+            raise BrokenPipeError(32, 'Broken pipe')
+
+    out = drive_daemon.ClientOutput(Gone())
+    with pytest.raises(drive_daemon.ClientGone):
+        out.write({'id': 1})
+    assert out.disconnected
+    with pytest.raises(drive_daemon.ClientGone):
+        out.error({'id': 2}, OSError('too late'))
+
+
+def test_cli_via_daemon(fake, daemon, capsys):
+    fake.add_file('report.csv')
+    assert drive_cli.main(['find', 'report.csv', '--fields', 'name', '--via', daemon.socket_path]) == 0
+    assert json.loads(capsys.readouterr().out) == {'name': 'report.csv'}
+
+
+def test_second_daemon_on_the_same_socket(daemon):
+    with pytest.raises(RuntimeError):
+        drive_daemon.DriveDaemon(daemon.socket_path).start()
+
+
+def test_priorities_then_fair_share():
+    scheduler = drive_daemon.Scheduler()
+    for number in range(3):
+        scheduler.submit(job('busy'))
+    scheduler.submit(job('quiet'))
+    scheduler.submit(job('late', priority=5))
+
+    assert scheduler.next().client == 'late'
+    first = scheduler.next()
+    assert first.client == 'busy'
+    # busy has a job running, so quiet goes next even though it queued later.
+    assert scheduler.next().client == 'quiet'
+    scheduler.finished(first, 10)
+    assert scheduler.stats()['clients']['busy'] == {'queued': 2, 'running': 0, 'usage_seconds': 10.0}
+
+
+def test_usage_decays():
+    scheduler = drive_daemon.Scheduler(half_life=0.05)
+    scheduler.submit(job('a'))
+    scheduler.finished(scheduler.next(), 8)
+    time.sleep(0.2)
+    assert scheduler.usage('a') < 1
+
+
+def test_throttling_holds_back_low_priority_jobs():
+    identity = drive_identities.Identity('daemon', None)
+    scheduler = drive_daemon.Scheduler(identity)
+    scheduler.submit(job('a'))
+    scheduler.submit(job('b', priority=drive_daemon.THROTTLED_MIN_PRIORITY))
+    identity.throttled()
+
+    assert scheduler.next().client == 'b'
+    assert scheduler._pick()[0] is None
+    identity.cooldown_until = 0
+    assert scheduler.next().client == 'a'
@@ -0,0 +1,128 @@
+import pytest
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload
+try:
+    import drive_fake
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_fake
+    from google_drive_tools import drive_tools
+
+pytestmark = pytest.mark.usefixtures('no_sleep')
+
+FOLDER = drive_fake.FOLDER_MIME_TYPE
+UPLOAD_DIR = "tests/func/test_upload_files"
+
+
+def test_query_language():
+    item = {'name': "Bob's report", 'mimeType': FOLDER, 'parents': ['p1'], 'trashed': False,
+            'modifiedTime': '2020-06-01T00:00:00.000Z'}
+    assert drive_fake.compile_query("name = 'Bob\\'s report' and 'p1' in parents")(item)
+    assert drive_fake.compile_query(f"mimeType != '{FOLDER}' or trashed = false")(item)
+    assert drive_fake.compile_query("modifiedTime >= '2020-05-01T00:00:00' and not name contains 'draft'")(item)
+    assert not drive_fake.compile_query("(trashed = true or 'p2' in parents)")(item)
+
+
+def test_projection():
+    response = {'nextPageToken': '5', 'files': [{'id': '1', 'name': 'a', 'size': '3'}]}
+    assert drive_fake.project(response, 'files(id,name)') == {'files': [{'id': '1', 'name': 'a'}]}
+    assert drive_fake.project(response, '*') == response
+
+
+def test_list_and_find_paginate(fake):
+    fake.default_page_size = 5
+    for number in range(12):
+        fake.add_folder(f'folder {number}')
+    fake.add_file('not a folder')
+
+    assert len(drive_tools.list_my_folders_by_searching_files()) == 12
+    assert drive_tools.find_my_folder_by_name_by_searching_files('folder 11')['mimeType'] == FOLDER
+    assert not drive_tools.find_my_folder_by_name_by_searching_files('missing')
+    assert fake.requests.count(('GET', '/drive/v3/files')) == 3 * 3
+
+
+def test_shared_drives(fake):
+    shared = fake.add_drive('Team')
+    fake.add_folder('team folder', drive_id=shared['id'])
+    fake.add_folder('my folder')
+
+    assert len(drive_tools.list_my_folders_by_searching_files()) == 1
+    assert len(drive_tools.list_domain_folders_by_searching_files()) == 2
+    assert drive_tools.find_domain_folder_by_name_by_searching_drives('Team')['id'] == shared['id']
+    assert drive_tools.get_domain_folder_by_id_by_searching_drive(shared['id'])['name'] == 'Team'
+
+
+def test_create_upload_delete(fake):
+    folder_id = drive_tools.create_folder_in_drive('project')
+    file_id = drive_tools.upload_csv_to_drive(UPLOAD_DIR, 'csv_move_to_drive_test.csv', folder_id)
+
+    uploaded = drive_tools.find_file_by_name('csv_move_to_drive_test.csv')
+    assert uploaded['parents'] == [folder_id]
+    assert uploaded['mimeType'] == 'text/csv'
+    with open(f'{UPLOAD_DIR}/csv_move_to_drive_test.csv', 'rb') as csv_file:
+        assert fake.content[file_id] == csv_file.read()
+
+    assert drive_tools.delete_file_or_folder(folder_id)
+    assert file_id not in fake.files
+    assert not drive_tools.delete_file_or_folder(folder_id)
+
+
+def test_resumable_upload(fake):
+    media = MediaFileUpload(f'{UPLOAD_DIR}/csv_move_to_drive_test.csv', mimetype='text/csv', resumable=True,
+                            chunksize=256 * 1024)
+    uploaded = drive_tools.drive_service().files().create(body={'name': 'big.csv'}, media_body=media,
+                                                          fields='id,md5Checksum').execute()
+    assert uploaded['md5Checksum'] == fake.files[uploaded['id']]['md5Checksum']
+
+
+def test_batch(fake):
+    keep = fake.add_file('keep')
+    service = drive_tools.drive_service()
+    responses = {}
+    batch = service.new_batch_http_request(callback=lambda request_id, response, error:
+                                           responses.__setitem__(request_id, error))
+    batch.add(service.files().delete(fileId=fake.add_file('remove')['id']))
+    batch.add(service.files().delete(fileId='missing'))
+    batch.execute()
+
+    assert responses['1'] is None
+    assert responses['2'].resp.status == 404
+    assert list(fake.files) == [keep['id']]
+
+
+def test_sheets(fake):
+    sheet_id = drive_tools.create_sheets('report', [['a', 'b'], [1, 2]])
+    drive_tools.write_to_existing_sheet(sheet_id, [['c']])
+    assert fake.sheets[sheet_id]['Sheet1'] == [['c', 'b'], ['1', '2']]
+
+    sheet_id = drive_tools.create_file_in_drive('from drive')
+    drive_tools.write_to_existing_sheet(sheet_id, [['x']])
+    assert fake.sheets[sheet_id]['Sheet1'] == [['x']]
+
+
+def test_changes(fake):
+    service = drive_tools.drive_service()
+    token = service.changes().getStartPageToken().execute()['startPageToken']
+    file_id = drive_tools.create_folder_in_drive('new')
+    drive_tools.delete_file_or_folder(file_id)
+
+    changes = service.changes().list(pageToken=token).execute()
+    assert [(change['fileId'], change['removed']) for change in changes['changes']] == [(file_id, False),
+                                                                                     (file_id, True)]
+
+
+def test_injected_errors(fake):
+    fake.fail_next(2, status=429)
+    assert drive_tools.drive_service().files().list().execute(num_retries=2) == {'kind': 'drive#fileList',
+                                                                                 'files': []}
+
+    fake.fail_next(1, status=503)
+    with pytest.raises(HttpError):
+        drive_tools.drive_service().files().list().execute()
+
+
+def test_rate_limit():
+    fake = drive_fake.FakeDrive(requests_per_second=2)
+    http = fake.http()
+    statuses = [http.request('https://www.googleapis.com/drive/v3/files')[0].status for _ in range(4)]
+    assert statuses.count(429) >= 2
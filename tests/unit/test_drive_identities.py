@@ -0,0 +1,145 @@
+import pytest
+try:
+    import drive_cache
+    import drive_cassettes
+    import drive_identities
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_cache
+    from google_drive_tools import drive_cassettes
+    from google_drive_tools import drive_identities
+    from google_drive_tools import drive_tools
+
+pytestmark = pytest.mark.usefixtures('no_sleep')
+
+
+@pytest.fixture
+def service_account_info():
+    rsa = pytest.importorskip('cryptography.hazmat.primitives.asymmetric.rsa')
+    from cryptography.hazmat.primitives import serialization
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption()).decode()
+    return {'type': 'service_account', 'project_id': 'project', 'private_key_id': '1', 'private_key': pem,
+            'client_email': 'robot@project.iam.gserviceaccount.com', 'client_id': '1',
+            'token_uri': 'https://oauth2.googleapis.com/token'}
+
+
+def pool_of(*names, **limits):
+    return drive_identities.CredentialsPool([drive_identities.Identity(name, None, **limits) for name in names])
+
+
+def test_delegation(service_account_info):
+    robot = drive_identities.Identity.from_service_account_info(service_account_info, requests_per_second=3)
+    assert robot.name == 'robot@project.iam.gserviceaccount.com'
+
+    pool = drive_identities.CredentialsPool.delegated(robot, ['ann@example.com', 'bob@example.com'])
+    ann, bob = pool.identities
+    assert (ann.name, ann.credentials._subject) == ('ann@example.com', 'ann@example.com')
+    assert bob.limiter.rate == 3
+    assert bob.limiter is not ann.limiter
+
+    with pytest.raises(ValueError):
+        drive_identities.CredentialsPool([ann, ann])
+
+
+def test_services_and_limits_per_identity(fake):
+    pool = pool_of('ann', 'bob', requests_per_second=1000)
+    ann, bob = pool.identities
+
+    with drive_tools.use_identity(ann):
+        service = drive_tools.drive_service()
+        assert drive_tools.drive_service() is service
+        drive_tools.list_my_folders_by_searching_files()
+        with drive_tools.use_identity(bob):
+            assert drive_tools.drive_service() is not service
+        assert drive_tools.current_identity() is ann
+    assert drive_tools.current_identity() is None
+    assert drive_tools.drive_service() is not service
+
+    assert pool.stats() == {'ann': {'requests': 1, 'throttles': 0}, 'bob': {'requests': 0, 'throttles': 0}}
+
+
+def test_identities_do_not_share_cached_responses(fake):
+    ann, bob = pool_of('ann', 'bob', requests_per_second=1000).identities
+    drive_tools.set_response_cache(drive_cache.ResponseCache())
+    try:
+        for identity in (ann, bob, ann, bob):
+            with drive_tools.use_identity(identity):
+                drive_tools.list_my_folders_by_searching_files()
+        assert fake.requests.count(('GET', '/drive/v3/files')) == 2
+
+        with drive_tools.use_identity(bob):
+            drive_tools.create_folder_in_drive('new')
+        with drive_tools.use_identity(ann):
+            assert [folder['name'] for folder in drive_tools.list_my_folders_by_searching_files()] == ['new']
+    finally:
+        drive_tools.set_response_cache(None)
+
+
+def test_recordings_send_as_the_identity(monkeypatch):
+    google_auth_httplib2 = pytest.importorskip('google_auth_httplib2')
+    monkeypatch.setattr(google_auth_httplib2, 'AuthorizedHttp', lambda credentials, http: credentials)
+    monkeypatch.setattr(drive_tools, 'google_creds', lambda: 'default credentials')
+    ann = drive_identities.Identity('ann', 'ann credentials')
+
+    with drive_tools.use_identity(ann):
+        assert drive_cassettes._default_http() == 'ann credentials'
+    assert drive_cassettes._default_http() == 'default credentials'
+
+
+def test_map_spreads_the_work(fake):
+    for number in range(60):
+        fake.add_file(f'{number}.csv')
+    pool = pool_of('ann', 'bob', 'cy', requests_per_second=5)
+
+    found = pool.map(drive_tools.find_file_by_name, [f'{number}.csv' for number in range(60)], jobs=6)
+
+    assert [item['name'] for item in found] == [f'{number}.csv' for number in range(60)]
+    requests = [stats['requests'] for stats in pool.stats().values()]
+    assert sum(requests) == 60
+    assert min(requests) >= 15
+
+
+def test_batches_run_as_the_callers_identity(fake):
+    file_ids = [fake.add_file(f'{number}.csv')['id'] for number in range(5)]
+    pool = pool_of('ann', requests_per_second=1000)
+
+    with pool.identity():
+        drive_tools.share_items(file_ids, 'reader', permission_type='anyone')
+    assert pool.stats()['ann']['requests'] == 5
+
+
+def test_affinity_is_sticky(fake):
+    pool = pool_of('ann', 'bob', 'cy', 'dee')
+    picked = {pool.pick(affinity=f'user{number}') for number in range(40)}
+    assert len(picked) > 1
+    assert all(pool.pick(affinity=f'user{number}') is pool.pick(affinity=f'user{number}') for number in range(40))
+
+
+def test_throttled_identities_cool_down(fake):
+    pool = pool_of('ann', 'bob', requests_per_second=1000)
+    ann, bob = pool.identities
+
+    page_token = drive_tools.get_changes_start_page_token()
+    fake.fail_next(1, status=429)
+    with drive_tools.use_identity(ann):
+        drive_tools.list_changes(page_token)
+    assert pool.stats()['ann'] == {'requests': 2, 'throttles': 1}
+
+    assert all(pool.pick() is bob for _ in range(10))
+    assert all(pool.pick(affinity=f'user{number}') is bob for number in range(10))
+
+
+def test_pick_prefers_budget_left():
+    pool = pool_of('ann', 'bob', requests_per_second=2)
+    ann, bob = pool.identities
+    ann.acquire(1)
+    assert pool.pick() is bob
+
+    # Work still running on an identity counts against it.
+    with pool.identity() as first:
+        with pool.identity() as second:
+            assert (first, second) == (bob, ann)
+    assert ann.active == bob.active == 0
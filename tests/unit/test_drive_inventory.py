@@ -0,0 +1,101 @@
+import csv
+import datetime
+import multiprocessing
+
+import pytest
+try:
+    import drive_inventory
+except ModuleNotFoundError:
+    from google_drive_tools import drive_inventory
+
+# The workers inherit the fake from the test process, which only works when they are forked.
+pytestmark = pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+
+
+@pytest.fixture
+def seeded(fake):
+    for number in range(30):
+        fake.add_file(f'mine {number}.csv', content=b'a,b\n',
+                      modifiedTime=f'2019-{number % 12 + 1:02d}-01T00:00:00.000Z')
+    for name in ('Sales', 'Ops'):
+        drive_id = fake.add_drive(name)['id']
+        folder_id = fake.add_folder('reports', drive_id=drive_id)['id']
+        for number in range(20):
+            fake.add_file(f'{name} {number}.csv', parent=folder_id, drive_id=drive_id)
+    return fake
+
+
+def read_csv(paths):
+    rows = []
+    for path in paths:
+        with open(path, newline='') as exported:
+            reader = csv.reader(exported)
+            assert tuple(next(reader)) == drive_inventory.COLUMNS
+            rows.extend(reader)
+    return rows
+
+
+def test_shards():
+    shards = drive_inventory.shards_by_modified_time(4, datetime.datetime(2018, 1, 1), datetime.datetime(2021, 1, 1),
+                                                     query='trashed = false')
+    assert [shard.query for shard in shards] == [
+        "(trashed = false) and ((modifiedTime < '2018-01-01T00:00:00'))",
+        "(trashed = false) and ((modifiedTime >= '2018-01-01T00:00:00') and (modifiedTime < '2019-07-03T00:00:00'))",
+        "(trashed = false) and ((modifiedTime >= '2019-07-03T00:00:00') and (modifiedTime < '2021-01-01T00:00:00'))",
+        "(trashed = false) and ((modifiedTime >= '2021-01-01T00:00:00'))"]
+    assert shards[0].list_arguments()['corpora'] == 'allDrives'
+
+
+def test_export_by_drive_to_chunked_csv(seeded, tmp_path):
+    progress = []
+    report = drive_inventory.export_inventory(str(tmp_path / 'inventory.csv'), processes=3, rows_per_chunk=25,
+                                              progress=progress.append, progress_interval=0, start_method='fork')
+
+    assert report
+    assert report.shards == {'my drive': 30, 'Sales': 21, 'Ops': 21}
+    assert report.rows == 72
+    assert report.rows_per_second > 0
+    assert progress and progress[-1] is report
+    assert [path.rsplit('/', 1)[1] for path in report.files] == [f'inventory-0000{number}.csv' for number in range(3)]
+
+    rows = read_csv(report.files)
+    assert len(rows) == 72
+    assert len({row[0] for row in rows}) == 72
+    mine = next(row for row in rows if row[1] == 'mine 0.csv')
+    assert mine[3] == seeded.root_id
+    assert mine[6] == '4'
+
+
+def test_export_by_modified_time(seeded, tmp_path):
+    report = drive_inventory.export_inventory(str(tmp_path / 'inventory.csv'), shard_by='modified', partitions=5,
+                                              start=datetime.datetime(2019, 1, 1), query='trashed = false',
+                                              processes=2, start_method='fork')
+    assert report.rows == len(seeded.files)
+    assert len(report.shards) == 5
+    assert len({row[0] for row in read_csv(report.files)}) == report.rows
+
+
+def test_failed_shards_are_reported(seeded, tmp_path):
+    shards = [drive_inventory.Shard('fine'), drive_inventory.Shard('empty', drive_id='missing'),
+              drive_inventory.Shard('bad query', query='name = ')]
+    report = drive_inventory.export_inventory(str(tmp_path / 'inventory.csv'), shards=shards, start_method='fork')
+    assert not report
+    assert set(report.failed) == {'bad query'}
+    assert report.shards == {'fine': 30, 'empty': 0, 'bad query': 0}
+
+
+def test_shards_with_the_same_label_are_reported_apart(seeded, tmp_path):
+    shards = [drive_inventory.Shard('reports', query="name contains 'mine'"),
+              drive_inventory.Shard('reports', query='name = ')]
+    report = drive_inventory.export_inventory(str(tmp_path / 'inventory.csv'), shards=shards, start_method='fork')
+    assert report.shards == {'reports #0': 30, 'reports #1': 0}
+    assert set(report.failed) == {'reports #1'}
+
+
+def test_parquet(seeded, tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    report = drive_inventory.export_inventory(str(tmp_path / 'inventory.parquet'), rows_per_chunk=10,
+                                              start_method='fork')
+    table = parquet.read_table(report.files[0])
+    assert table.num_rows == report.rows == 72
+    assert table.column_names == list(drive_inventory.COLUMNS)
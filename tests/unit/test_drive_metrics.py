@@ -0,0 +1,113 @@
+import pytest
+from google.oauth2.credentials import Credentials
+from googleapiclient.http import HttpMockSequence
+from googleapiclient.model import JsonModel
+try:
+    import drive_cache
+    import drive_metrics
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_cache
+    from google_drive_tools import drive_metrics
+    from google_drive_tools import drive_tools
+
+FILES_LIST_URI = "https://www.googleapis.com/drive/v3/files?alt=json"
+
+
+def _request(http):
+    return drive_tools._request_builder()(http, JsonModel().response, FILES_LIST_URI, methodId='drive.files.list')
+
+
+def test_default_instrumentation_is_disabled():
+    assert not drive_tools._instrumentation.enabled
+
+
+def test_calls_pages_and_retries_are_recorded(no_sleep):
+    recorder = drive_metrics.MetricsRecorder()
+    drive_tools.set_instrumentation(recorder)
+    try:
+        http = HttpMockSequence([({'status': '503'}, 'unavailable'),
+                                 ({'status': '200'}, '{"files": []}')])
+        assert _request(http).execute(num_retries=2) == {'files': []}
+    finally:
+        drive_tools.set_instrumentation(None)
+
+    stats = recorder.summary()['methods']['drive.files.list']
+    assert stats['calls'] == 2
+    assert stats['errors'] == 1
+    assert stats['retries'] == 1
+    assert stats['pages'] == 1
+    assert stats['response_bytes'] == len('unavailable') + len('{"files": []}')
+
+
+class _FlakyHttp(HttpMockSequence):
+    """Drops the connection before the first response."""
+
+    def __init__(self, error, iterable):
+        super().__init__(iterable)
+        self.error = error
+
+    def request(self, *args, **kwargs):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+        return super().request(*args, **kwargs)
+
+
+def test_transport_errors_are_retried(no_sleep):
+    recorder = drive_metrics.MetricsRecorder()
+    drive_tools.set_instrumentation(recorder)
+    try:
+        http = _FlakyHttp(ConnectionResetError(), [({'status': '200'}, '{"files": []}')])
+        assert _request(http).execute(num_retries=5) == {'files': []}
+    finally:
+        drive_tools.set_instrumentation(None)
+
+    stats = recorder.summary()['methods']['drive.files.list']
+    assert (stats['calls'], stats['errors'], stats['retries']) == (2, 1, 1)
+
+    with pytest.raises(ConnectionResetError):
+        _request(_FlakyHttp(ConnectionResetError(), [])).execute()
+    with pytest.raises(FileNotFoundError):
+        _request(_FlakyHttp(FileNotFoundError(), [])).execute(num_retries=5)
+
+
+def test_cache_hits_are_recorded():
+    recorder = drive_metrics.MetricsRecorder()
+    drive_tools.set_instrumentation(recorder)
+    drive_tools.set_response_cache(drive_cache.ResponseCache())
+    try:
+        http = HttpMockSequence([({'status': '200'}, '{"files": []}')])
+        _request(http).execute()
+        _request(http).execute()
+    finally:
+        drive_tools.set_instrumentation(None)
+        drive_tools.set_response_cache(None)
+
+    stats = recorder.summary()['methods']['drive.files.list']
+    assert (stats['calls'], stats['cache_hits'], stats['cache_misses']) == (1, 1, 1)
+
+
+def test_service_builds_are_recorded(monkeypatch):
+    monkeypatch.setattr(drive_tools, '_creds', Credentials(token='offline'))
+    monkeypatch.setattr(drive_tools, '_services', type(drive_tools._services)())
+    recorder = drive_metrics.MetricsRecorder()
+    drive_tools.set_instrumentation(recorder)
+    try:
+        drive_tools.drive_service()
+        drive_tools.drive_service()
+    finally:
+        drive_tools.set_instrumentation(None)
+
+    assert recorder.summary()['builds']['drive.v3']['count'] == 1
+
+
+def test_prometheus_text():
+    recorder = drive_metrics.MetricsRecorder()
+    recorder.record_call('drive.files.list', 0.2, 0, 100, 200)
+    recorder.record_call('drive.files.list', 3.0, 0, 100, 200)
+    text = drive_metrics.prometheus_text(recorder)
+
+    assert 'drive_tools_request_duration_seconds_bucket{method="drive.files.list",le="0.25"} 1' in text
+    assert 'drive_tools_request_duration_seconds_bucket{method="drive.files.list",le="+Inf"} 2' in text
+    assert 'drive_tools_response_bytes_total{method="drive.files.list"} 200' in text
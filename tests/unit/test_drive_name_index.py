@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+try:
+    import drive_fake
+    import drive_identities
+    import drive_name_index
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_fake
+    from google_drive_tools import drive_identities
+    from google_drive_tools import drive_name_index
+    from google_drive_tools import drive_tools
+
+FOLDER = drive_fake.FOLDER_MIME_TYPE
+
+
+@pytest.fixture
+def index(fake):
+    index = drive_name_index.NameIndex()
+    drive_tools.set_name_index(index)
+    yield index
+    drive_tools.set_name_index(None)
+
+
+def lists(fake):
+    return len([path for method, path in fake.requests if path == '/drive/v3/files'])
+
+
+def test_bloom_filter():
+    bloom = drive_name_index.BloomFilter(1000, error_rate=0.01)
+    for number in range(1000):
+        bloom.add(f'folder {number}')
+    assert all(f'folder {number}' in bloom for number in range(1000))
+    false_positives = sum(f'other {number}' in bloom for number in range(10000))
+    assert false_positives < 300
+    assert len(bloom) == 1000
+
+
+def test_absent_names_cost_no_requests(fake, index):
+    parent_id = fake.add_folder('clients')['id']
+    for number in range(50):
+        fake.add_folder(f'client {number}', parent=parent_id)
+
+    assert drive_tools.find_child_by_name('client 7', parent_id, FOLDER)['name'] == 'client 7'
+    requests = lists(fake)
+    assert [drive_tools.find_child_by_name(f'new client {number}', parent_id) for number in range(100)] == \
+           [False] * 100
+    assert lists(fake) - requests < 10
+    assert index.stats()['builds'] == 1
+
+
+def test_creates_keep_the_index_current(fake, index):
+    parent_id = fake.add_folder('clients')['id']
+    assert not drive_tools.find_child_by_name('acme', parent_id)
+    assert not drive_tools.find_my_folder_by_name_by_searching_files('acme')
+
+    folder_id = drive_tools.create_folder_in_drive('acme', parent_id)
+    assert drive_tools.find_child_by_name('acme', parent_id)['id'] == folder_id
+    assert drive_tools.find_my_folder_by_name_by_searching_files('acme')['id'] == folder_id
+    assert not drive_tools.find_child_by_name('acme', parent_id, 'text/csv')
+
+    # A deleted item stays in the filter, the server check answers for it.
+    drive_tools.delete_file_or_folder(folder_id)
+    assert not drive_tools.find_child_by_name('acme', parent_id)
+    assert index.stats()['false_positives'] == 1
+
+
+def test_sheets_and_uploads_keep_the_index_current(fake, index, tmp_path):
+    assert not drive_tools.find_child_by_name('report', 'root')
+    assert not drive_tools.find_child_by_name('export.csv', 'root')
+
+    sheet_id = drive_tools.create_sheets('report', [])
+    assert drive_tools.find_child_by_name('report', 'root')['id'] == sheet_id
+    (tmp_path / 'export.csv').write_text('a,b\n')
+    file_id = drive_tools.upload_csv_to_drive(str(tmp_path), 'export.csv')
+    assert drive_tools.find_child_by_name('export.csv', 'root')['id'] == file_id
+    assert index.stats()['false_positives'] == 0
+
+
+def test_creates_during_a_build_are_kept(fake, index, monkeypatch):
+    parent_id = fake.add_folder('clients')['id']
+    files_list = fake._files_list
+    created = []
+
+    def listing_with_a_create(params, body, headers):
+        response = files_list(params, body, headers)
+        if not created and 'name' in params.get('fields', ''):
+            # Another thread creates a folder after this page was put together.
+            thread = threading.Thread(target=lambda: created.append(drive_tools.create_folder_in_drive('acme',
+                                                                                                       parent_id)))
+            thread.start()
+            thread.join()
+        return response
+
+    monkeypatch.setattr(fake, '_files_list', listing_with_a_create)
+    assert not drive_tools.find_child_by_name('other', parent_id)
+    assert created
+    assert drive_tools.find_child_by_name('acme', parent_id)['id'] == created[0]
+
+
+def test_identities_have_their_own_filters(fake, index):
+    ann, bob = (drive_identities.Identity(name, None) for name in ('ann', 'bob'))
+    parent_id = fake.add_folder('clients')['id']
+    with drive_tools.use_identity(ann):
+        assert not drive_tools.find_child_by_name('acme', parent_id)
+        drive_tools.create_folder_in_drive('acme', parent_id)
+        assert drive_tools.find_child_by_name('acme', parent_id)
+    assert index.needs_build(parent_id)
+    assert not index.needs_build(f'ann:{parent_id}')
+
+    with drive_tools.use_identity(bob):
+        assert drive_tools.find_child_by_name('acme', parent_id)
+        assert not drive_tools.find_child_by_name('globex', parent_id)
+    assert index.stats()['builds'] == 2
+
+
+def test_stale_scopes_are_listed_again(fake, index):
+    parent_id = fake.add_folder('clients')['id']
+    assert not drive_tools.find_child_by_name('made elsewhere', parent_id)
+    fake.add_folder('made elsewhere', parent=parent_id)
+    assert not drive_tools.find_child_by_name('made elsewhere', parent_id)
+
+    index.max_age = 0
+    assert drive_tools.find_child_by_name('made elsewhere', parent_id)
+
+    index.max_age = 300
+    index.max_false_positives = 1
+    index.false_positive(parent_id)
+    assert index.needs_build(parent_id)
+
+
+def test_project_environment_finds_or_creates(fake, index):
+    first = drive_tools.ProjectEnvironment('sheet', 'project', 'sub').build()
+    second = drive_tools.ProjectEnvironment('sheet 2', 'project', 'sub').build()
+    assert fake.files[first]['parents'] == fake.files[second]['parents']
+    assert len([item for item in fake.files.values() if item['mimeType'] == FOLDER]) == 2
+    # Without the index the lookups still work, as a single query each.
+    drive_tools.set_name_index(None)
+    third = drive_tools.ProjectEnvironment('sheet 3', 'project', 'sub').build()
+    assert fake.files[third]['parents'] == fake.files[first]['parents']
@@ -0,0 +1,91 @@
+import datetime
+
+try:
+    import drive_fake
+    import drive_records
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_fake
+    from google_drive_tools import drive_records
+    from google_drive_tools import drive_tools
+
+FOLDER = drive_fake.FOLDER_MIME_TYPE
+
+
+def modified(days, seconds=0):
+    value = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(days=days,
+                                                                                           seconds=seconds)
+    return drive_fake.format_time(value)
+
+
+def lists(fake):
+    return [path for method, path in fake.requests if path == '/drive/v3/files']
+
+
+def test_partitions_are_disjoint_and_complete(fake):
+    # Spread over ten years, with a burst of activity on one day.
+    for number in range(300):
+        fake.add_folder(f'old {number}', modifiedTime=modified(number * 12))
+    for number in range(700):
+        fake.add_folder(f'busy {number}', modifiedTime=modified(2000, seconds=number * 30))
+    fake.add_file('not a folder.txt', modifiedTime=modified(10))
+
+    folders = drive_tools.list_files_in_parallel(f"mimeType = '{FOLDER}'", partitions=4, jobs=4, page_size=50,
+                                                 split_after_pages=2, fields='id,name')
+
+    assert len(folders) == 1000
+    assert {folder['id'] for folder in folders} == {item['id'] for item in fake.files.values()
+                                                     if item['mimeType'] == FOLDER}
+    assert set(folders[0]) == {'id', 'name', 'modifiedTime'}
+    # Splitting gave the busy day more cursors than a single chain of 20 pages would have had.
+    assert len(lists(fake)) > 20 + 1
+
+
+def test_empty_pages_with_a_token_are_followed(fake, monkeypatch):
+    for number in range(40):
+        fake.add_folder(f'folder {number}', modifiedTime=modified(number))
+    files_list = fake._files_list
+
+    def empty_first_pages(params, body, headers):
+        # Drive sometimes answers with no items but a token to go on with.
+        if not params.get('pageToken') and params.get('pageSize') != '1':
+            return 200, {'files': [], 'nextPageToken': '0'}
+        return files_list(params, body, headers)
+
+    monkeypatch.setattr(fake, '_files_list', empty_first_pages)
+    folders = drive_tools.list_files_in_parallel(partitions=2, page_size=5, split_after_pages=1)
+    assert len(folders) == 40
+
+
+def test_identical_timestamps_are_not_split_forever(fake):
+    for number in range(120):
+        fake.add_folder(f'same {number}', modifiedTime=modified(100))
+
+    folders = drive_tools.list_files_in_parallel(partitions=3, page_size=10, split_after_pages=1)
+    assert len(folders) == 120
+
+
+def test_created_time_and_scope(fake):
+    drive_id = fake.add_drive('Team')['id']
+    for number in range(30):
+        fake.add_file(f'{number}.csv', drive_id=drive_id)
+    fake.add_file('mine.csv')
+
+    items = drive_tools.list_files_in_parallel(field='createdTime', partitions=3, page_size=5, corpora='drive',
+                                               driveId=drive_id, includeItemsFromAllDrives=True,
+                                               supportsAllDrives=True)
+    assert len(items) == 30
+
+
+def test_empty_corpus(fake):
+    assert drive_tools.list_files_in_parallel("name = 'nothing'") == []
+
+
+def test_my_folders_with_jobs(fake):
+    for number in range(40):
+        fake.add_folder(f'folder {number}', modifiedTime=modified(number))
+
+    sequential = drive_tools.list_my_folders_by_searching_files(as_records=True)
+    parallel = drive_tools.list_my_folders_by_searching_files(as_records=True, jobs=4)
+    assert all(isinstance(folder, drive_records.FolderRecord) for folder in parallel)
+    assert sorted(parallel, key=lambda folder: folder.id) == sorted(sequential, key=lambda folder: folder.id)
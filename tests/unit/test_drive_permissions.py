@@ -0,0 +1,100 @@
+import json
+
+import pytest
+try:
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_tools
+
+pytestmark = pytest.mark.usefixtures('no_sleep', 'unpaced')
+
+
+@pytest.fixture
+def unpaced(monkeypatch):
+    # The sharing limiter would pace these tests to a few requests a second.
+    monkeypatch.setattr(drive_tools, 'SHARING_REQUESTS_PER_SECOND', 100000)
+
+
+@pytest.fixture
+def file_ids(fake):
+    return [fake.add_file(f'report {number}.csv')['id'] for number in range(150)]
+
+
+def test_share_batches_and_suppresses_notifications(fake, file_ids):
+    report = drive_tools.share_items(file_ids, 'reader', email_address='ann@example.com',
+                                     send_notification_email=False)
+
+    assert report
+    assert set(report.succeeded) == set(file_ids)
+    assert {permission['id'] for permission in report.succeeded.values()} == \
+        {report.succeeded[file_ids[0]]['id']}
+    assert not fake.notifications
+    assert [path for method, path in fake.requests] == ['/batch/drive/v3'] * 2
+
+    drive_tools.share_items(file_ids[:2], 'writer', email_address='bob@example.com', email_message='Have a look')
+    assert fake.notifications == [('bob@example.com', file_id, 'Have a look') for file_id in file_ids[:2]]
+
+
+def test_list_update_and_remove(fake, file_ids):
+    drive_tools.share_items(file_ids, 'writer', email_address='ann@example.com', send_notification_email=False)
+    drive_tools.share_items(file_ids[:10], 'reader', permission_type='anyone')
+
+    listed = drive_tools.list_permissions(file_ids)
+    assert {permission['role'] for permission in listed.succeeded[file_ids[0]]} == {'owner', 'writer', 'reader'}
+
+    updated = drive_tools.update_permissions(file_ids, 'reader', email_address='ANN@example.com')
+    assert set(updated.succeeded) == set(file_ids)
+    assert all(permission['role'] == 'reader' for permission in updated.succeeded.values())
+
+    removed = drive_tools.remove_permissions(file_ids, permission_type='anyone')
+    assert set(removed.succeeded) == set(file_ids[:10])
+    assert set(removed.skipped) == set(file_ids[10:])
+    assert all(len(fake.permissions[file_id]) == 2 for file_id in file_ids)
+
+
+def test_owner_is_never_removed(fake, file_ids):
+    report = drive_tools.remove_permissions(file_ids[:3], email_address=fake.user_email)
+    assert report.skipped == file_ids[:3]
+    with pytest.raises(ValueError):
+        drive_tools.remove_permissions(file_ids)
+
+
+def test_per_item_failures(fake, file_ids):
+    report = drive_tools.share_items(file_ids[:3] + ['missing'], 'commenter', email_address='ann@example.com')
+    assert not report
+    assert set(report.succeeded) == set(file_ids[:3])
+    assert list(report.failed) == ['missing']
+
+    report = drive_tools.share_items(file_ids[:3], 'boss', email_address='ann@example.com')
+    assert set(report.failed) == set(file_ids[:3])
+
+
+def test_sharing_rate_limits_are_retried(fake, file_ids):
+    fake.fail_next(2, status=429, path='/batch')
+    report = drive_tools.share_items(file_ids[:5], 'reader', permission_type='domain', domain='example.com')
+    assert set(report.succeeded) == set(file_ids[:5])
+
+    class Error:
+        def __init__(self, status, reason):
+            self.resp = type('Response', (), {'status': status})()
+            self.content = json.dumps({'error': {'errors': [{'reason': reason}]}}).encode()
+
+    assert drive_tools._retryable(Error(403, 'sharingRateLimitExceeded'))
+    assert not drive_tools._retryable(Error(403, 'insufficientFilePermissions'))
+    assert not drive_tools._retryable(Error(404, 'notFound'))
+
+
+def test_rate_limiter_paces_requests(monkeypatch):
+    now = [0.0]
+    slept = []
+    monkeypatch.setattr(drive_tools.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(drive_tools.time, 'sleep', slept.append)
+
+    limiter = drive_tools.RateLimiter(10)
+    limiter.acquire(10)
+    assert not slept
+    limiter.acquire(100)
+    assert slept == [10.0]
+    now[0] = 20.0
+    limiter.acquire(5)
+    assert slept == [10.0]
@@ -0,0 +1,69 @@
+import tracemalloc
+try:
+    import drive_records
+except ModuleNotFoundError:
+    from google_drive_tools import drive_records
+
+API_FOLDER = {'kind': 'drive#file',
+              'id': '1a2b3c',
+              'name': 'Reports',
+              'mimeType': 'application/vnd.google-apps.folder',
+              'parents': ['0AParent'],
+              'modifiedTime': '2020-11-02T18:03:11.000Z'}
+
+
+def test_folder_record_from_api():
+    folder = drive_records.FolderRecord.from_api(API_FOLDER)
+    assert folder.id == '1a2b3c'
+    assert folder.parents == ('0AParent',)
+    assert folder.drive_id is None
+    assert folder['mimeType'] == 'application/vnd.google-apps.folder'
+    assert not hasattr(folder, '__dict__')
+
+
+def test_records_intern_repeated_values():
+    first = drive_records.FolderRecord.from_api(dict(API_FOLDER, mimeType=''.join(['application/', 'pdf'])))
+    second = drive_records.FolderRecord.from_api(dict(API_FOLDER, mimeType=''.join(['application/', 'pdf'])))
+    assert first.mime_type is second.mime_type
+    assert first.parents[0] is second.parents[0]
+
+
+def test_file_record_round_trip():
+    api_file = {'id': 'f1', 'name': 'data.csv', 'mimeType': 'text/csv', 'parents': ['p1'], 'size': '2048',
+                'md5Checksum': 'abc'}
+    record = drive_records.FileRecord.from_api(api_file)
+    assert record.size == 2048
+    assert record.to_dict() == api_file
+    assert drive_records.FileRecord(id='f1', name='data.csv', mime_type='text/csv', parents=['p1'], size=2048,
+                                    md5_checksum='abc') == record
+
+
+def test_records_are_hashable():
+    first = drive_records.FolderRecord.from_api(API_FOLDER)
+    second = drive_records.FolderRecord.from_api(dict(API_FOLDER))
+    other = drive_records.FolderRecord.from_api(dict(API_FOLDER, id='other'))
+    assert hash(first) == hash(second)
+    assert {first, second, other} == {first, other}
+    assert len({first: 1, second: 2}) == 1
+
+
+def test_fields_selector():
+    assert drive_records.DriveRecord.fields() == 'id,name,createdTime,hidden'
+
+
+def test_records_use_less_memory_than_dicts():
+    items = [dict(API_FOLDER, id=str(number), name=f'folder {number}', parents=[f'parent {number % 10}'])
+             for number in range(2000)]
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    dicts = [dict(item, parents=list(item['parents'])) for item in items]
+    dict_bytes = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+
+    before = tracemalloc.take_snapshot()
+    records = [drive_records.FolderRecord.from_api(item) for item in items]
+    record_bytes = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    tracemalloc.stop()
+
+    assert len(dicts) == len(records)
+    assert record_bytes < dict_bytes / 2
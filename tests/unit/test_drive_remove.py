@@ -0,0 +1,142 @@
+import pytest
+try:
+    import drive_cache
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_cache
+    from google_drive_tools import drive_tools
+
+pytestmark = pytest.mark.usefixtures('no_sleep')
+
+
+def build_tree(fake, parent=None, depth=3, width=3):
+    """Folders width wide and depth deep below parent, with one file in every folder."""
+    created = []
+    level = [parent or fake.root_id]
+    for _ in range(depth):
+        next_level = []
+        for folder_id in level:
+            for number in range(width):
+                child = fake.add_folder(f'folder {number}', parent=folder_id)['id']
+                created.append(child)
+                created.append(fake.add_file('notes.txt', parent=child, content=b'x')['id'])
+                next_level.append(child)
+        level = next_level
+    return created
+
+
+def test_find_folder_by_path(fake):
+    projects = fake.add_folder('projects')['id']
+    reports = fake.add_folder("Bob's reports", parent=fake.add_folder('2020', parent=projects)['id'])['id']
+
+    assert drive_tools.find_folder_by_path("projects/2020/Bob's reports/") == reports
+    assert drive_tools.find_folder_by_path('projects') == projects
+    assert not drive_tools.find_folder_by_path('projects/2021')
+
+
+def test_plan_walks_levels_together(fake):
+    top = fake.add_folder('top')['id']
+    created = build_tree(fake, top)
+
+    plan = drive_tools.plan_removal(folder_id=top)
+    assert {item['id'] for item in plan} == {top, *created}
+    assert plan[0]['id'] == top
+
+    # One get, then one listing per level plus the level of empty file "children".
+    lists = [path for method, path in fake.requests if path.endswith('/files')]
+    assert len(lists) == 4
+
+
+def test_plan_walks_shared_drive_folders(fake):
+    drive_id = fake.add_drive('Team')['id']
+    top = fake.add_folder('top', parent=drive_id)['id']
+    created = build_tree(fake, top, depth=2, width=2)
+
+    plan = drive_tools.plan_removal(folder_id=top)
+    assert {item['id'] for item in plan} == {top, *created}
+    assert {item['driveId'] for item in plan} == {drive_id}
+
+
+def test_remove_deletes_only_the_top_items(fake):
+    top = fake.add_folder('top')['id']
+    created = build_tree(fake, top)
+    keep = fake.add_file('keep.txt')['id']
+
+    report = drive_tools.remove_items(path='top')
+
+    assert report
+    assert set(report.removed) == {top, *created}
+    assert set(fake.files) == {keep}
+    batches = [path for method, path in fake.requests if path == '/batch/drive/v3']
+    assert len(batches) == 1
+
+
+def test_remove_by_query_skips_nested_matches(fake):
+    outer = fake.add_folder('tmp')['id']
+    inner = fake.add_folder('tmp', parent=outer)['id']
+    other = fake.add_folder('tmp')['id']
+
+    report = drive_tools.remove_items(query="name = 'tmp' and trashed = false", jobs=2)
+
+    assert report
+    assert set(report.removed) == {outer, inner, other}
+    assert not fake.files
+
+
+def test_trash_instead_of_delete(fake):
+    top = fake.add_folder('top')['id']
+    child = fake.add_file('a.txt', parent=top)['id']
+
+    report = drive_tools.remove_items(folder_id=top, trash=True)
+
+    assert set(report.removed) == {top, child}
+    assert fake.files[top]['trashed']
+    assert child in fake.files
+
+
+def test_remove_retries_and_reports_failures(fake):
+    folders = [fake.add_folder(f'tmp {number}')['id'] for number in range(5)]
+
+    fake.fail_next(2, status=503, path='/batch')
+    report = drive_tools.remove_items(query="name contains 'tmp'")
+    assert report
+    assert set(report.removed) == set(folders)
+
+    fake.add_folder('tmp again')
+    fake.fail_next(3, status=500, path='/batch')
+    report = drive_tools.remove_items(query="name contains 'tmp'", num_retries=2)
+    assert not report
+    assert not report.removed
+    assert list(report.failed) == [item['id'] for item in report.planned]
+
+
+def test_remove_nothing(fake):
+    assert not drive_tools.remove_items(folder_id='missing').planned
+    assert not drive_tools.remove_items(path='missing').planned
+    with pytest.raises(ValueError):
+        drive_tools.remove_items()
+
+
+def test_remove_invalidates_the_response_cache(fake):
+    cache = drive_cache.ResponseCache()
+    drive_tools.set_response_cache(cache)
+    try:
+        fake.add_folder('tmp')
+        assert drive_tools.find_my_folder_by_name_by_searching_files('tmp')
+        drive_tools.remove_items(path='tmp')
+        assert not drive_tools.find_my_folder_by_name_by_searching_files('tmp')
+    finally:
+        drive_tools.set_response_cache(None)
+
+
+def test_empty_trash_scoped_to_a_shared_drive(fake):
+    drive_id = fake.add_drive('Team')['id']
+    shared = fake.add_file('shared.txt', parent=drive_id, drive_id=drive_id, trashed=True)['id']
+    mine = fake.add_file('mine.txt', trashed=True)['id']
+
+    assert drive_tools.empty_trash(drive_id=drive_id)
+    assert shared not in fake.files
+    assert mine in fake.files
+
+    assert drive_tools.empty_trash()
+    assert mine not in fake.files
@@ -0,0 +1,31 @@
+import subprocess
+import sys
+from google.oauth2.credentials import Credentials
+try:
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_tools
+
+
+def test_import_does_not_load_google_clients():
+    check = ("import sys\n"
+             "try:\n"
+             "    import drive_tools\n"
+             "except ModuleNotFoundError:\n"
+             "    from google_drive_tools import drive_tools\n"
+             "print([name for name in sys.modules if name.startswith(('googleapiclient', 'google_auth_oauthlib'))])")
+    output = subprocess.run([sys.executable, '-c', check], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == '[]'
+
+
+def test_services_are_built_offline_and_reused(monkeypatch):
+    monkeypatch.setattr(drive_tools, '_creds', Credentials(token='offline'))
+    monkeypatch.setattr(drive_tools, '_services', type(drive_tools._services)())
+
+    service = drive_tools.drive_service()
+    assert str(type(service)) == "<class 'googleapiclient.discovery.Resource'>"
+    assert drive_tools.drive_service() is service
+    assert drive_tools.no_cache_discovery_service() is service
+
+    request = drive_tools.sheets_service().spreadsheets().values().update(spreadsheetId='1', range='A1', body={})
+    assert request.methodId == 'sheets.spreadsheets.values.update'
@@ -0,0 +1,155 @@
+import gzip
+import hashlib
+import os
+
+import pytest
+try:
+    import drive_tools
+except ModuleNotFoundError:
+    from google_drive_tools import drive_tools
+
+
+@pytest.fixture
+def export(tmp_path):
+    path = tmp_path / "export.csv"
+    path.write_bytes(b"id,name\n1,ann\n2,bob\n")
+    return path
+
+
+def uploads(fake):
+    return [path for method, path in fake.requests if path.startswith('/upload/')]
+
+
+def test_file_md5_is_cached_by_mtime_and_size(export):
+    assert drive_tools.file_md5(export, chunk_size=4) == hashlib.md5(export.read_bytes()).hexdigest()
+    hits = drive_tools._md5_of.cache_info().hits
+    drive_tools.file_md5(export, chunk_size=4)
+    assert drive_tools._md5_of.cache_info().hits == hits + 1
+
+    export.write_bytes(b"id,name\n1,cy\n")
+    os.utime(export, ns=(0, 0))
+    assert drive_tools.file_md5(export) == hashlib.md5(b"id,name\n1,cy\n").hexdigest()
+
+
+def test_create_mode_always_adds_a_file(fake, export):
+    first = drive_tools.upload_csv_to_drive(str(export.parent), export.name)
+    second = drive_tools.upload_csv_to_drive(str(export.parent), export.name)
+    assert first != second
+    assert len(uploads(fake)) == 2
+
+
+def test_skip_identical(fake, export):
+    folder_id = fake.add_folder('exports')['id']
+    file_id = drive_tools.upload_csv_to_drive(str(export.parent), export.name, folder_id, mode='skip')
+    assert len(uploads(fake)) == 1
+
+    requests = len(fake.requests)
+    assert drive_tools.upload_csv_to_drive(str(export.parent), export.name, folder_id, mode='skip') == file_id
+    assert len(fake.requests) == requests + 1
+    assert len(uploads(fake)) == 1
+
+    export.write_bytes(b"id,name\n1,ann\n2,bob\n3,cy\n")
+    assert drive_tools.upload_csv_to_drive(str(export.parent), export.name, folder_id, mode='skip') == file_id
+    assert len(uploads(fake)) == 2
+    assert fake.content[file_id] == export.read_bytes()
+    assert len(fake.files) == 2
+
+
+def test_update_in_place(fake, export):
+    file_id = drive_tools.upload_csv_to_drive(str(export.parent), export.name, mode=drive_tools.UPLOAD_UPDATE)
+    assert drive_tools.upload_csv_to_drive(str(export.parent), export.name, mode=drive_tools.UPLOAD_UPDATE) == file_id
+    assert len(uploads(fake)) == 2
+    assert list(fake.files) == [file_id]
+
+    with pytest.raises(ValueError):
+        drive_tools.upload_csv_to_drive(str(export.parent), export.name, mode='overwrite')
+
+
+def test_update_only_replaces_a_file_of_the_same_kind(fake, export):
+    sheet_id = drive_tools.upload_csv_to_drive(str(export.parent), export.name, convert_to_sheet=True)
+    file_id = drive_tools.upload_csv_to_drive(str(export.parent), export.name, mode=drive_tools.UPLOAD_UPDATE)
+    assert file_id != sheet_id
+    assert fake.files[file_id]['mimeType'] == 'text/csv'
+    assert drive_tools.upload_csv_to_drive(str(export.parent), export.name, mode=drive_tools.UPLOAD_UPDATE,
+                                           convert_to_sheet=True) == sheet_id
+    assert len(fake.files) == 2
+
+
+def test_update_drops_a_stale_source_md5(fake, export):
+    file_id = fake.add_file(export.name, mime_type='text/csv', content=b'old',
+                            appProperties={'sourceMd5': drive_tools.file_md5(export), 'job': 'nightly'})['id']
+    assert drive_tools.upload_csv_to_drive(str(export.parent), export.name, mode=drive_tools.UPLOAD_UPDATE) == file_id
+    assert fake.files[file_id]['appProperties'] == {'job': 'nightly'}
+
+    # With the stale md5 gone, skip compares the content again.
+    export.write_bytes(b"id,name\n3,cy\n")
+    drive_tools.upload_csv_to_drive(str(export.parent), export.name, mode=drive_tools.UPLOAD_SKIP_IDENTICAL)
+    assert fake.content[file_id] == export.read_bytes()
+
+
+@pytest.fixture
+def big_export(tmp_path):
+    path = tmp_path / "big.csv"
+    with open(path, 'w') as export:
+        for number in range(60000):
+            export.write(f"{number},{hashlib.sha1(str(number).encode()).hexdigest()}\n")
+    return path
+
+
+@pytest.mark.parametrize('chunks', [1, 2])
+def test_compress_streams_in_chunks(fake, big_export, monkeypatch, chunks):
+    expected = gzip.compress(big_export.read_bytes(), mtime=0)
+    # A size that is an exact multiple of the chunk size must still finish in as many requests as chunks.
+    monkeypatch.setattr(drive_tools, 'UPLOAD_CHUNK_SIZE', len(expected) // chunks)
+    expected_chunks = chunks if len(expected) % chunks == 0 else chunks + 1
+
+    file_id = drive_tools.upload_csv_to_drive(str(big_export.parent), big_export.name, compress=True)
+
+    assert fake.files[file_id]['name'] == 'big.csv.gz'
+    assert fake.files[file_id]['mimeType'] == 'application/gzip'
+    assert gzip.decompress(fake.content[file_id]) == big_export.read_bytes()
+    assert len([path for path in uploads(fake) if path.startswith('/upload/session/')]) == expected_chunks
+
+
+def test_compressed_upload_resumes_from_json(fake, big_export):
+    from googleapiclient.http import HttpRequest, MediaUpload
+
+    expected = gzip.compress(big_export.read_bytes(), mtime=0)
+    media = drive_tools._gzip_upload()(big_export, len(expected) // 3)
+    request = drive_tools.drive_service().files().create(body={'name': 'big.csv.gz'}, media_body=media)
+    assert request.next_chunk()[1] is None
+
+    assert type(MediaUpload.new_from_json(media.to_json())) is type(media)
+    restored = HttpRequest.from_json(request.to_json(), fake.http(), request.postproc)
+    response = None
+    while response is None:
+        response = restored.next_chunk()[1]
+    assert fake.content[response['id']] == expected
+
+
+def test_compressed_copies_skip_by_source_md5(fake, export):
+    file_id = drive_tools.upload_csv_to_drive(str(export.parent), export.name, mode='skip', compress=True)
+    assert drive_tools.upload_csv_to_drive(str(export.parent), export.name, mode='skip', compress=True) == file_id
+    assert len(uploads(fake)) == 2
+
+    export.write_bytes(b"id,name\n3,cy\n")
+    assert drive_tools.upload_csv_to_drive(str(export.parent), export.name, mode='skip', compress=True) == file_id
+    assert gzip.decompress(fake.content[file_id]) == b"id,name\n3,cy\n"
+
+
+def test_convert_to_sheet(fake, export, monkeypatch):
+    file_id = drive_tools.upload_csv_to_drive(str(export.parent), export.name, convert_to_sheet=True)
+    assert fake.files[file_id]['mimeType'] == drive_tools.SPREADSHEET_MIME_TYPE
+    assert fake.sheets[file_id] == {'Sheet1': [['id', 'name'], ['1', 'ann'], ['2', 'bob']]}
+    assert [path for path in uploads(fake)] == ['/upload/drive/v3/files']
+
+    # Past the simple upload limit the same conversion goes through a resumable session.
+    monkeypatch.setattr(drive_tools, 'SIMPLE_UPLOAD_LIMIT', 4)
+    drive_tools.upload_csv_to_drive(str(export.parent), export.name, convert_to_sheet=True)
+    assert uploads(fake)[-1].startswith('/upload/session/')
+
+    monkeypatch.setattr(drive_tools, 'SHEET_CONVERSION_LIMIT', 4)
+    with pytest.raises(ValueError):
+        drive_tools.upload_csv_to_drive(str(export.parent), export.name, convert_to_sheet=True)
+    with pytest.raises(ValueError):
+        drive_tools.upload_csv_to_drive(str(export.parent), export.name, compress=True, convert_to_sheet=True)
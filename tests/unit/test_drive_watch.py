@@ -0,0 +1,187 @@
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+try:
+    import drive_identities
+    import drive_tools
+    import drive_watch
+except ModuleNotFoundError:
+    from google_drive_tools import drive_identities
+    from google_drive_tools import drive_tools
+    from google_drive_tools import drive_watch
+
+
+@pytest.fixture
+def received():
+    return queue.Queue()
+
+
+@pytest.fixture
+def receiver(fake, received):
+    receiver = drive_watch.WatchReceiver(lambda channel, changes: received.put((channel, changes)))
+    yield receiver
+    receiver.close()
+
+
+def test_list_changes_follows_the_feed(fake):
+    page_token = drive_tools.get_changes_start_page_token()
+    file_id = fake.add_file('a.txt')['id']
+    fake.add_folder('b')
+
+    changes, page_token = drive_tools.list_changes(page_token)
+    assert [change['fileId'] for change in changes][0] == file_id
+    assert len(changes) == 2
+    assert drive_tools.list_changes(page_token) == ([], page_token)
+
+
+def test_changes_are_pushed_and_fetched(fake, receiver, received):
+    channel = receiver.watch_changes()
+    file_id = fake.add_file('report.csv')['id']
+
+    notified, changes = received.get(timeout=5)
+    assert notified is channel
+    assert [change['fileId'] for change in changes] == [file_id]
+    assert changes[0]['file']['name'] == 'report.csv'
+
+    drive_tools.delete_file_or_folder(file_id)
+    notified, changes = received.get(timeout=5)
+    assert changes[0]['removed']
+
+    fake.flush_notifications()
+    assert [state for _, state, _ in fake.deliveries] == ['sync', 'change', 'change']
+    assert {status for _, _, status in fake.deliveries} == {200}
+
+
+def test_file_channel(fake, receiver, received):
+    file_id = fake.add_file('report.csv')['id']
+    fake.add_file('other.csv')
+    receiver.watch_file(file_id)
+
+    drive_tools.drive_service().files().update(fileId=file_id, body={'trashed': True}).execute()
+
+    channel, changes = received.get(timeout=5)
+    assert channel.file_id == file_id
+    assert changes == [{'fileId': file_id, 'removed': False, 'state': 'trash'}]
+    assert received.empty()
+
+
+def test_bad_tokens_are_rejected(fake, receiver):
+    channel = receiver.watch_changes()
+    headers = {'X-Goog-Channel-ID': channel.id, 'X-Goog-Resource-ID': channel.resource_id,
+               'X-Goog-Resource-State': 'change', 'X-Goog-Channel-Token': 'guessed'}
+
+    request = urllib.request.Request(receiver.address, data=b'', headers=headers, method='POST')
+    with pytest.raises(urllib.error.HTTPError) as raised:
+        urllib.request.urlopen(request, timeout=5)
+    assert raised.value.code == 403
+
+    assert receiver.notify(dict(headers, **{'X-Goog-Channel-ID': 'unknown'})) == 404
+    assert receiver.notify(dict(headers, **{'X-Goog-Channel-Token': channel.token})) == 200
+    # A sync message can beat watch_changes to the receiver, it is not a rejection.
+    assert receiver.notify(dict(headers, **{'X-Goog-Channel-ID': 'new', 'X-Goog-Resource-State': 'sync'})) == 200
+    assert receiver.rejected == 2
+
+
+def test_notifications_are_coalesced(fake, received, monkeypatch):
+    fetches = []
+    list_changes = drive_tools.list_changes
+
+    def slow_list_changes(page_token, drive_id=None):
+        fetches.append(page_token)
+        time.sleep(0.2)
+        return list_changes(page_token, drive_id)
+
+    monkeypatch.setattr(drive_tools, 'list_changes', slow_list_changes)
+    with drive_watch.WatchReceiver(lambda channel, changes: received.put(changes)) as receiver:
+        receiver.watch_changes()
+        for number in range(10):
+            fake.add_file(f'{number}.csv')
+        fake.flush_notifications()
+
+        seen = []
+        while len(seen) < 10:
+            seen.extend(received.get(timeout=5))
+    assert len(fetches) < 10
+
+
+def test_renewal_replaces_expiring_channels(fake, received):
+    with drive_watch.WatchReceiver(lambda channel, changes: received.put(changes), channel_seconds=2,
+                                   renew_margin=1.5) as receiver:
+        first = receiver.watch_changes()
+        deadline = time.time() + 5
+        while first.id in receiver.channels and time.time() < deadline:
+            time.sleep(0.05)
+
+        assert first.id not in receiver.channels
+        assert first.id not in fake.channels
+        renewed, = receiver.channels.values()
+        assert renewed.token == first.token
+        assert renewed.page_token == first.page_token
+
+    assert not fake.channels
+
+
+def test_renewal_during_a_fetch_keeps_its_page_token(fake, received, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    list_changes = drive_tools.list_changes
+
+    def blocked_list_changes(page_token, drive_id=None):
+        started.set()
+        release.wait(5)
+        return list_changes(page_token, drive_id)
+
+    monkeypatch.setattr(drive_tools, 'list_changes', blocked_list_changes)
+    with drive_watch.WatchReceiver(lambda channel, changes: received.put(changes), channel_seconds=2,
+                                   renew_margin=1.5) as receiver:
+        first = receiver.watch_changes()
+        start_token = first.page_token
+        fake.add_file('a.csv')
+        fake.flush_notifications()
+        assert started.wait(5)
+
+        deadline = time.time() + 5
+        while first.id in receiver.channels and time.time() < deadline:
+            release.wait(0.05)
+        assert first.id not in receiver.channels
+        release.set()
+        assert [change['file']['name'] for change in received.get(timeout=5)] == ['a.csv']
+
+        renewed, = receiver.channels.values()
+        assert renewed.page_token == first.page_token != start_token
+
+
+def test_background_threads_use_the_receivers_identity(fake, received, monkeypatch):
+    ann = drive_identities.Identity('ann@example.com', None, requests_per_second=1000)
+    identities = []
+    list_changes, renew_channel = drive_tools.list_changes, drive_watch.renew_channel
+
+    def recorded_list_changes(page_token, drive_id=None):
+        identities.append(('list', drive_tools.current_identity()))
+        return list_changes(page_token, drive_id)
+
+    def recorded_renew_channel(channel, seconds):
+        identities.append(('renew', drive_tools.current_identity()))
+        return renew_channel(channel, seconds)
+
+    monkeypatch.setattr(drive_tools, 'list_changes', recorded_list_changes)
+    monkeypatch.setattr(drive_watch, 'renew_channel', recorded_renew_channel)
+    with drive_tools.use_identity(ann):
+        receiver = drive_watch.WatchReceiver(lambda channel, changes: received.put(changes), channel_seconds=2,
+                                             renew_margin=1.5)
+    with receiver:
+        first = receiver.watch_changes()
+        fake.add_file('a.csv')
+        fake.flush_notifications()
+        assert [change['file']['name'] for change in received.get(timeout=5)] == ['a.csv']
+
+        deadline = time.time() + 5
+        while first.id in receiver.channels and time.time() < deadline:
+            time.sleep(0.05)
+
+    assert {call for call, _ in identities} == {'list', 'renew'}
+    assert all(identity is ann for _, identity in identities)
+    assert ann.requests >= 4